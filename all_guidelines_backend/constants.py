@@ -1,4 +1,5 @@
-from langchain_openai import ChatOpenAI
+from shared.admission import UPSTREAM_MAX_CONCURRENT
+from shared.upstream import chat_model
 
 
 LARGE_EMBD = "text-embedding-3-large"
@@ -10,9 +11,106 @@ __SMALL_MODEL = "gpt-4o-mini"
 
 # ------------------------------------------------------------------- #
 
-MAKE_SUBQ_LLM = ChatOpenAI(model=__BIG_MODEL, temperature=0.5)
-ANSWER_SUBQ_LLM = ChatOpenAI(model=__SMALL_MODEL, temperature=0.5)
+# every chat model shares the process-wide LLM connection pool and budget (shared/upstream.py)
+MAKE_SUBQ_LLM = chat_model(__BIG_MODEL, temperature=0.5)
+ANSWER_SUBQ_LLM = chat_model(__SMALL_MODEL, temperature=0.5)
 
-CONV_LLM = ChatOpenAI(model=__BIG_MODEL, temperature=0.2)
+CONV_LLM = chat_model(__BIG_MODEL, temperature=0.2)
+CONV_SMALL_LLM = chat_model(__SMALL_MODEL, temperature=0.2)      # answers routed to the small tier (RESPOND_TIERS)
 
-QUERY_FROM_HISTORY_LLM = ChatOpenAI(model=__SMALL_MODEL, temperature=0.3)
\ No newline at end of file
+QUERY_FROM_HISTORY_LLM = chat_model(__SMALL_MODEL, temperature=0.3)
+
+# ------------------------------------------------------------------- #
+# semantic response cache: near-duplicate (rewritten) queries replay a stored answer
+
+RESPONSE_CACHE_BACKEND = "memory"   # "memory", "local" (local-process shared store; needs RESPONSE_CACHE_AUTHKEY) or None
+RESPONSE_CACHE_THRESHOLD = 0.97     # cosine similarity of query embeddings
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+RESPONSE_CACHE_TTL_S = 24 * 60 * 60
+
+
+# ------------------------------------------------------------------- #
+# retriever caches: query embeddings and rerank orderings
+
+EMBEDDING_CACHE_MAX_ENTRIES = 2000  # float32 vectors, ~12KB each at 3072 dims
+RERANK_CACHE_MAX_ENTRIES = 2000
+
+# ------------------------------------------------------------------- #
+# "cohere" (hosted), "hybrid" (in-process BM25 + dense) or "cross-encoder" (in-process, needs sentence-transformers)
+RERANKER = "cohere"
+
+# ------------------------------------------------------------------- #
+# candidate retrieval ahead of the reranker: "dense" (FAISS only) or "hybrid" (FAISS + BM25, reciprocal-rank fusion)
+RETRIEVAL_MODE = "dense"
+DENSE_CANDIDATES_K = 50
+HYBRID_CANDIDATES_K = 25            # fusion recovers exact-term matches, so fewer candidates go to the reranker
+
+# two-stage retrieval: pick the top guidelines (chunk centroid / titles_vector), then search only their chunks
+ROUTE_BY_GUIDELINE = False
+ROUTE_TOP_GUIDELINES = 3
+ROUTE_MIN_SCORE = 0.3               # best guideline's cosine below this falls back to global search
+ROUTED_CANDIDATES_K = 15
+
+# ------------------------------------------------------------------- #
+# vector index held on each worker's heap (shared/quantized_index.py): "flat", "sq8", "ivfpq" or "mrl"
+INDEX_KIND = "flat"
+INDEX_MRL_DIMS = 1024
+INDEX_RECALL_TARGET = 0.95          # recall@10 vs. flat search, calibrated when the compressed index is built
+
+# ------------------------------------------------------------------- #
+# /chat admission control (shared/admission.py AdmissionLimiter)
+CHAT_MAX_CONCURRENT = UPSTREAM_MAX_CONCURRENT["llm"] // 2   # half the process-wide LLM budget; None disables
+CHAT_MAX_QUEUE = CHAT_MAX_CONCURRENT                         # at most ~one response time of queueing
+CHAT_QUEUE_TIMEOUT_S = 10
+
+# ------------------------------------------------------------------- #
+# /chat streaming (shared/streaming.py framed)
+STREAM_FLUSH_MS = 40
+STREAM_MAX_BATCH_CHARS = 256
+STREAM_HEARTBEAT_S = 15
+
+# ------------------------------------------------------------------- #
+# respond prompt context: repeated documents dropped, the rest picked for diversity (MMR) and packed to a budget
+CONTEXT_MAX_TOKENS = None           # prompt tokens of retrieved context; None: deduplicate only (all 10 reranked pages fit)
+CONTEXT_MMR_LAMBDA = 0.7            # relevance vs. diversity; 1.0 keeps rank order
+CONTEXT_NEAR_DUPLICATE = 0.9        # lexical cosine at which a document counts as a repeat
+
+# ------------------------------------------------------------------- #
+# respond prompt layout: the system template already leads with the static instructions; "cache-prefix" also
+# writes the retrieved context in a stable order, so the provider's prompt cache can reuse the prefix
+PROMPT_LAYOUT = "cache-prefix"
+PROMPT_CACHE_KEY = "all-guidelines-respond"     # routes requests sharing the prefix to the same cache
+
+# ------------------------------------------------------------------- #
+# per-request tracing (shared/tracing.py): sampled requests feed the /metrics histograms
+TRACE_SAMPLE_RATE = 0.1             # share of /chat requests traced; 0 disables
+TRACE_JSON_LOG = False              # also write each traced request's spans as one JSON line to stderr
+
+# ------------------------------------------------------------------- #
+# cross-request retrieval micro-batching (shared/batching.py)
+RETRIEVAL_BATCH_WINDOW_MS = 3.0     # the most it adds to a lookup; 0 disables
+RETRIEVAL_BATCH_MAX = 64            # a full batch goes out at once
+
+# ------------------------------------------------------------------- #
+# corpus hot swap (shared/corpus.py) when main_graph.corpus_files change
+CORPUS_WATCH_INTERVAL_S = 30        # seconds between checks (sizes and mtimes only); None disables
+
+# ------------------------------------------------------------------- #
+# chat sessions (shared/sessions.py): /chat requests carrying a "session_id"
+SESSION_BACKEND = "memory"          # "memory" or None to disable
+SESSION_MAX = 10000                 # least recently used sessions beyond this are dropped
+SESSION_TTL_S = 30 * 60             # a session idle this long is dropped
+SESSION_REUSE_MIN_SIMILARITY = 0.8  # cosine similarity of the (rewritten) query to the query the candidates came from
+
+# ------------------------------------------------------------------- #
+# respond model tiering (shared/model_tiers.py): each query is classified locally, from its wording and the
+# documents retrieved for it, and answered by CONV_SMALL_LLM or CONV_LLM according to its class
+RESPOND_TIERING = True              # False: every answer from CONV_LLM
+RESPOND_TIERS = {"trivial": "small", "off_topic": "small", "short_factual": "small", "complex": "big", "default": "big"}
+# lower context budgets, by class; off_topic keeps some, so a medical question taken for off topic
+# (the class is a lexical heuristic) is still answered from the retrieved documents
+RESPOND_TIER_CONTEXT_TOKENS = {"trivial": 0, "off_topic": 3000, "short_factual": 3000}
+RESPOND_SMALL_MAX_WORDS = 12        # longest single question counted as short_factual
+RESPOND_OFF_TOPIC_RELEVANCE = 0.05  # best Cohere relevance below which a query is off topic (RERANKER "cohere" only)
+RESPOND_MIN_COVERAGE = 0.2          # share of the query's content words found in the retrieved documents, below which it is off topic
+RESPOND_TIER_LOG = False            # log every decision as a JSON line to stderr
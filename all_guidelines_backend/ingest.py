@@ -0,0 +1,259 @@
+"""Build (or incrementally update) `docs_vector` and `titles_vector` from the PDFs in `pdfs/`.
+
+    python -m all_guidelines_backend.ingest                       # OpenAI embeddings
+    python -m all_guidelines_backend.ingest --embeddings hashing  # offline stand-in
+    python -m all_guidelines_backend.ingest --full                # ignore the manifest
+    python -m all_guidelines_backend.ingest --quantize sq8 ivfpq  # plus compressed indexes
+
+PDFs stream through parse (process pool) -> chunk -> batched embedding (bounded concurrency)
+-> FAISS write, plus a BM25 index (`sparse.npz`) for hybrid retrieval. `manifest.json` in the output directory records each file's content hash and
+the docstore ids it produced, so a re-run only parses and embeds new or changed PDFs, deletes the
+chunks of changed or removed ones, and appends to the existing index.
+
+`titles_vector` is rebuilt from the manifest's per-file titles (PDF metadata title, else the file
+name). Titles can be corrected by hand in the manifest; unchanged files keep their entry.
+
+Each build is written to a hidden directory next to its output, and `docs_vector` / `titles_vector`
+become symlinks switched to the new build in one rename.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from uuid import uuid4
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from shared.embeddings import embedding_model_name, get_embeddings
+from shared.persisted_index import load_index, load_writable_index, save_index
+from shared.quantized_index import QUANTIZED_KINDS, load_or_build_quantized
+from shared.sparse_index import SparseIndex
+
+current_dir = Path(__file__).resolve().parent
+MANIFEST_FILE = "manifest.json"
+
+# ------------------------------------------------------------------- #
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def parse_pdf(path: str, source: str) -> tuple[str, list[Document]]:
+    """Runs in a worker process; returns one Document per page, with `source` relative to the backend dir."""
+    from langchain_community.document_loaders import PyMuPDFLoader
+
+    pages = PyMuPDFLoader(path).load()
+    for page in pages:
+        page.metadata["source"] = source
+        page.metadata["file_path"] = source
+    return source, pages
+
+
+def guess_title(pages: list[Document], fallback: str) -> str:
+    if pages and pages[0].metadata.get("title", "").strip():
+        return pages[0].metadata["title"].strip()
+    return fallback
+
+
+def load_manifest(out_dir: Path) -> dict:
+    try:
+        with open(out_dir / MANIFEST_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_atomic(vectorstore: FAISS, out_dir: Path, manifest: dict | None = None):
+    out_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f".{out_dir.name}-", dir=out_dir.parent))
+    save_index(tmp, vectorstore)
+    # the BM25 side of hybrid retrieval is rebuilt over the whole docstore on every save
+    SparseIndex.from_vectorstore(vectorstore).save(tmp)
+    if manifest is not None:
+        with open(tmp / MANIFEST_FILE, 'w') as file:
+            json.dump(manifest, file, indent=1)
+    publish(tmp, out_dir)
+
+
+def publish(build: Path, out_dir: Path):
+    """Point `out_dir`, a symlink, at `build` (a complete index directory next to it) in one rename: a
+    reader (a boot, the corpus watcher) resolves either the previous build or the new one, never a
+    missing or half-written directory. The previous build is kept for graphs still serving from it."""
+    previous = out_dir.resolve() if out_dir.is_symlink() else None
+    if out_dir.exists() and previous is None:
+        # a plain directory (as shipped) becomes a build of its own: the only moment without `out_dir`
+        previous = out_dir.with_name(f".{out_dir.name}-{uuid4().hex[:8]}")
+        os.replace(out_dir, previous)
+    link = out_dir.with_name(f".{out_dir.name}-link-{uuid4().hex[:8]}")
+    os.symlink(build.name, link)
+    os.replace(link, out_dir)
+    keep = {build.name, previous and previous.name}
+    for stale in out_dir.parent.glob(f".{out_dir.name}-*"):
+        if stale.is_dir() and not stale.is_symlink() and stale.name not in keep:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+class Ingestor(object):
+    def __init__(self, embeddings: Embeddings, chunk_size: int, chunk_overlap: int,
+                 batch_size: int, concurrency: int, workers: int):
+        self.embeddings = embeddings
+        # chunk_size 0 keeps one chunk per page, which is how the shipped docs_vector was built
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap) if chunk_size else None
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.workers = workers
+        self.stats = {"files": 0, "pages": 0, "chunks": 0, "parse_s": 0.0, "embed_s": 0.0}
+
+    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        async with self.semaphore:
+            start = time.perf_counter()
+            vectors = await self.embeddings.aembed_documents(texts)
+            self.stats["embed_s"] += time.perf_counter() - start
+            return vectors
+
+    async def embed_file(self, pages: list[Document]) -> tuple[list[Document], list[list[float]]]:
+        chunks = self.splitter.split_documents(pages) if self.splitter else pages
+        texts = [c.page_content for c in chunks]
+        batches = await asyncio.gather(*[
+            self.embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)
+        ])
+        return chunks, [v for batch in batches for v in batch]
+
+    async def run(self, pdfs: dict[str, Path], hashes: dict[str, str], vectorstore: FAISS | None, manifest: dict) -> tuple[FAISS | None, dict]:
+        self.vectorstore = vectorstore
+        self.manifest = manifest
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            await asyncio.gather(*[
+                self.ingest_file(loop.run_in_executor(pool, parse_pdf, str(path), source), hashes[source])
+                for source, path in pdfs.items()
+            ])
+        return self.vectorstore, self.manifest
+
+    async def ingest_file(self, parsing: asyncio.Future, sha256: str):
+        # each file moves on to embedding as soon as its own parse finishes
+        start = time.perf_counter()
+        source, pages = await parsing
+        self.stats["parse_s"] = max(self.stats["parse_s"], time.perf_counter() - start)
+        self.stats["files"] += 1
+        self.stats["pages"] += len(pages)
+
+        chunks, vectors = await self.embed_file(pages)
+
+        # writes run on the event loop thread, so they never interleave
+        ids = [str(uuid4()) for _ in chunks]
+        pairs = list(zip([c.page_content for c in chunks], vectors))
+        metadatas = [c.metadata for c in chunks]
+        if chunks and self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(pairs, self.embeddings, metadatas=metadatas, ids=ids)
+        elif chunks:
+            self.vectorstore.add_embeddings(pairs, metadatas=metadatas, ids=ids)
+        self.stats["chunks"] += len(chunks)
+        self.manifest["files"][source] = {
+            "sha256": sha256,
+            "pages": len(pages),
+            "title": guess_title(pages, Path(source).stem),
+            "ids": ids,
+        }
+
+
+def build_titles(manifest: dict, embeddings: Embeddings, out_dir: Path):
+    sources = sorted(manifest["files"])
+    titles = [manifest["files"][s]["title"] for s in sources]
+    vectorstore = FAISS.from_texts(titles, embeddings, metadatas=[{"source": s} for s in sources])
+    save_atomic(vectorstore, out_dir)
+
+
+def build_quantized(args, embeddings: Embeddings):
+    for kind in args.quantize:
+        vectorstore = load_index(args.out, embeddings)
+        index = load_or_build_quantized(vectorstore, args.out, kind, args.mrl_dims, args.recall_target)
+        print(f"{kind} index: recall@10 {index.recall:.3f} (nprobe {index.nprobe}, oversample {index.oversample})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", type=Path, default=current_dir / "pdfs")
+    parser.add_argument("--out", type=Path, default=current_dir / "docs_vector")
+    parser.add_argument("--titles-out", type=Path, default=current_dir / "titles_vector")
+    parser.add_argument("--no-titles", action="store_true", help="leave titles_vector untouched")
+    parser.add_argument("--embeddings", choices=["openai", "hashing"], default="openai")
+    parser.add_argument("--chunk-size", type=int, default=0, help="characters per chunk; 0 = one chunk per page")
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64, help="texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch")
+    parser.add_argument("--quantize", choices=QUANTIZED_KINDS, nargs="*", default=[],
+                        help="also build these compressed indexes (see INDEX_KIND in constants.py)")
+    parser.add_argument("--mrl-dims", type=int, default=1024)
+    parser.add_argument("--recall-target", type=float, default=0.95, help="recall@10 vs. flat search")
+    args = parser.parse_args()
+
+    if args.embeddings == "openai":
+        from dotenv import load_dotenv
+        load_dotenv('.env', override=True)
+        os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_KEY_ALL_GUIDELINES', os.getenv('OPENAI_API_KEY', ''))
+        from .constants import LARGE_EMBD
+        embeddings = get_embeddings(args.embeddings, LARGE_EMBD)
+    else:
+        embeddings = get_embeddings(args.embeddings, "")
+    model = embedding_model_name(embeddings)
+
+    manifest = load_manifest(args.out)
+    settings = {"embedding_model": model, "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap}
+    vectorstore = None
+    if args.full or manifest.get("settings") != settings or not (args.out / "index.faiss").exists():
+        manifest = {"settings": settings, "files": {}}
+    else:
+        vectorstore = load_writable_index(args.out, embeddings)
+
+    pdfs = {f"{args.pdf_dir.name}/{p.name}": p for p in sorted(args.pdf_dir.glob("*.pdf"))}
+    hashes = {s: file_hash(p) for s, p in pdfs.items()}
+    stale = [s for s in manifest["files"] if hashes.get(s) != manifest["files"][s]["sha256"]]
+    todo = {s: p for s, p in pdfs.items() if s not in manifest["files"] or s in stale}
+    if stale and vectorstore is not None:
+        vectorstore.delete([i for s in stale for i in manifest["files"][s]["ids"]])
+    for s in stale:
+        del manifest["files"][s]
+
+    print(f"{len(pdfs)} pdfs: {len(todo)} to ingest, {len(stale)} stale, {len(pdfs) - len(todo)} unchanged")
+    if not todo and not stale:
+        build_quantized(args, embeddings)
+        return
+
+    ingestor = Ingestor(embeddings, args.chunk_size, args.chunk_overlap, args.batch_size, args.concurrency, args.workers)
+    start = time.perf_counter()
+    vectorstore, manifest = asyncio.run(ingestor.run(todo, hashes, vectorstore, manifest))
+    elapsed = time.perf_counter() - start
+
+    if vectorstore is not None:
+        save_atomic(vectorstore, args.out, manifest)
+    if not args.no_titles:
+        build_titles(manifest, embeddings, args.titles_out)
+    build_quantized(args, embeddings)
+
+    s = ingestor.stats
+    print(f"ingested {s['files']} files, {s['pages']} pages, {s['chunks']} chunks in {elapsed:.1f}s")
+    print(f"  overall: {s['pages'] / elapsed:.1f} pages/s, {s['chunks'] / elapsed:.1f} chunks/s")
+    if s["parse_s"]:
+        print(f"  parse stage: {s['pages'] / s['parse_s']:.1f} pages/s ({args.workers} workers)")
+    if s["embed_s"]:
+        print(f"  embedding: {s['chunks'] / s['embed_s']:.1f} chunks/s per request slot ({args.concurrency} slots)")
+
+
+if __name__ == "__main__":
+    main()
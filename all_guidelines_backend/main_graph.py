@@ -6,28 +6,62 @@ from pathlib import Path
 os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_KEY_ALL_GUIDELINES')
 os.environ['LANGCHAIN_PROJECT'] = os.getenv('LANGCHAIN_PROJECT_ALL_GUIDELINES')
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_cohere import CohereRerank
 from langchain.retrievers import ContextualCompressionRetriever
+from langchain_core.embeddings import Embeddings
 from langchain_core.messages import AnyMessage
+from langchain_core.runnables import RunnableConfig
 
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Send
 
 from operator import add
-from typing_extensions import TypedDict, Annotated
+from typing import Callable
+from typing_extensions import TypedDict, Annotated, Optional
 
-from .constants import LARGE_EMBD
+from .constants import LARGE_EMBD, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_S
+from .constants import EMBEDDING_CACHE_MAX_ENTRIES, RERANK_CACHE_MAX_ENTRIES, RERANKER
+from .constants import RETRIEVAL_MODE, DENSE_CANDIDATES_K, HYBRID_CANDIDATES_K
+from .constants import ROUTE_BY_GUIDELINE, ROUTE_TOP_GUIDELINES, ROUTE_MIN_SCORE, ROUTED_CANDIDATES_K
+from .constants import INDEX_KIND, INDEX_MRL_DIMS, INDEX_RECALL_TARGET
+from .constants import CONTEXT_MAX_TOKENS, CONTEXT_MMR_LAMBDA, CONTEXT_NEAR_DUPLICATE, PROMPT_LAYOUT
+from .constants import RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX
+from .constants import SESSION_BACKEND, SESSION_MAX, SESSION_TTL_S, SESSION_REUSE_MIN_SIMILARITY
+from .constants import RESPOND_TIERING, RESPOND_TIERS, RESPOND_TIER_CONTEXT_TOKENS, RESPOND_SMALL_MAX_WORDS
+from .constants import RESPOND_OFF_TOPIC_RELEVANCE, RESPOND_MIN_COVERAGE, RESPOND_TIER_LOG
+from shared.context import ContextBudgeter
+from shared.prompt_cache import PromptCacheStats
+from shared.tracing import TracedIndex
+from shared.batching import BatchedEmbeddings, BatchedIndex
+from shared.corpus import CorpusRegistry
+from shared.mapped_docstore import DOCS_FILE
+from shared.persisted_index import INDEX_FILE, fingerprint, load_index
+from shared.quantized_index import load_or_build_quantized
+from shared.embeddings import embedding_model_name
+from shared.upstream import openai_embeddings
+from shared.readiness import timed
+from shared.response_cache import make_response_cache
+from shared.retrieval_cache import CachedEmbeddings, CachedReranker
+from shared.rerankers import IndexVectors, arerank, make_reranker as default_reranker
+from shared.sessions import RetrievalReuse, in_session, make_session_store
+from shared.model_tiers import TierRouter
+from shared.routing import GuidelineRouter, RoutedRetriever
+from shared.sparse_index import FusedRetriever, load_or_build_sparse
 from .subquestions import subqueries_chain
 from .answer_subq import answer_subq_chain
-from .response import response_chain
+from .response import response_chains
 from .query_from_history import query_from_history_chain
 # ------------------------------------------------------------------- #
 
 class MainState(TypedDict):
     messages: list[AnyMessage]
 
+    query_embedding: list[float]
+    cached_response: str
+
+    last_turn: dict                     # kept by the session checkpointer for the next turn (RetrievalReuse)
+
     subqueries: list[str]
     user_goal: str
 
@@ -42,18 +76,75 @@ class SubquestionState(TypedDict):
 # ------------------------------------------------------------------- #
 
 class MainGraph(object):
-    def __init__(self):
-        current_dir = Path(__file__).resolve().parent
-        vector_db = FAISS.load_local(current_dir / "docs_vector", 
-                                       OpenAIEmbeddings(model=LARGE_EMBD), 
-                                       allow_dangerous_deserialization=True)
-        vector_retriever = vector_db.as_retriever(search_kwargs={"k": 50})
-        self.reranker = CohereRerank(model="rerank-english-v3.0", top_n=5)
+    def __init__(self, embeddings: Optional[Embeddings] = None, make_reranker: Optional[Callable] = None,
+                 index_dir: Optional[Path] = None, timings: Optional[dict] = None, sessions: Optional[BaseCheckpointSaver] = None):
+        """`embeddings`, `make_reranker(top_n)` and `index_dir` (holding docs_vector and titles_vector)
+        replace the OpenAI embeddings, Cohere reranker and shipped index location; `sessions`, the
+        SESSION_BACKEND checkpointer. Per-step load times (seconds) are recorded in `timings`, if given."""
+        current_dir = Path(index_dir or Path(__file__).resolve().parent)
+        embeddings = embeddings or openai_embeddings(LARGE_EMBD)
+        self.batching = {}
+        if RETRIEVAL_BATCH_WINDOW_MS:
+            embeddings = self.batching["embed"] = BatchedEmbeddings(embeddings, RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX)
+        embeddings = self.embeddings = CachedEmbeddings(embeddings, maxsize=EMBEDDING_CACHE_MAX_ENTRIES)
+        make_reranker = make_reranker or (lambda top_n: default_reranker(RERANKER, top_n, "rerank-english-v3.0", embeddings, vectors))
+        # vectors and documents are memory-mapped: worker processes share one page-cache copy
+        with timed(timings, "docs_index"):
+            vector_db = load_index(current_dir / "docs_vector", embeddings)
+            # the in-process reranker scores candidates against their stored vectors
+            vectors = IndexVectors(vector_db) if RERANKER == "hybrid" else None
+            if INDEX_KIND != "flat":
+                load_or_build_quantized(vector_db, current_dir / "docs_vector", INDEX_KIND, INDEX_MRL_DIMS, INDEX_RECALL_TARGET)
+            if RETRIEVAL_BATCH_WINDOW_MS:
+                vector_db.index = self.batching["search"] = BatchedIndex(vector_db.index, RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX)
+            vector_db.index = TracedIndex(vector_db.index, "docs_index")
+        sparse = None
+        if RETRIEVAL_MODE == "hybrid":
+            with timed(timings, "sparse_index"):
+                sparse = load_or_build_sparse(vector_db, current_dir / "docs_vector")
+            vector_retriever = FusedRetriever(vectorstore=vector_db, sparse=sparse, k=HYBRID_CANDIDATES_K)
+        else:
+            vector_retriever = vector_db.as_retriever(search_kwargs={"k": DENSE_CANDIDATES_K})
+        if ROUTE_BY_GUIDELINE:
+            with timed(timings, "router"):
+                titles_db = load_index(current_dir / "titles_vector", embeddings)
+                router = GuidelineRouter(vector_db, titles_db)
+            vector_retriever = RoutedRetriever(
+                router=router,
+                retriever=FusedRetriever(vectorstore=vector_db, sparse=sparse, k=ROUTED_CANDIDATES_K),
+                fallback=vector_retriever,
+                top_m=ROUTE_TOP_GUIDELINES,
+                min_score=ROUTE_MIN_SCORE,
+            )
+        self.reranker = make_reranker(5)
         self.retriever = ContextualCompressionRetriever(
-            base_compressor=CohereRerank(model="rerank-english-v3.0", top_n=10), 
+            base_compressor=CachedReranker(make_reranker(10), maxsize=RERANK_CACHE_MAX_ENTRIES), 
             base_retriever=vector_retriever
         )
+        # answers are only valid for the index build (vectors and the page text they point to) they were grounded in
+        with timed(timings, "response_cache"):
+            index_version = fingerprint([*(current_dir / "docs_vector").glob("index.*"), current_dir / "docs_vector" / DOCS_FILE],
+                                        embedding_model_name(embeddings))
+            self.response_cache = make_response_cache(
+                embeddings, namespace="all_guidelines", version=index_version, backend=RESPONSE_CACHE_BACKEND,
+                threshold=RESPONSE_CACHE_THRESHOLD, maxsize=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_S,
+            )
+        self.context = ContextBudgeter(CONTEXT_MAX_TOKENS, CONTEXT_MMR_LAMBDA, CONTEXT_NEAR_DUPLICATE,
+                                       stable_order=PROMPT_LAYOUT == "cache-prefix")
+        self.prompt_cache = PromptCacheStats()
+        # relevance scores are only comparable across queries for the hosted reranker
+        self.tiers = TierRouter("all_guidelines", RESPOND_TIERS, RESPOND_TIER_CONTEXT_TOKENS, RESPOND_SMALL_MAX_WORDS,
+                                RESPOND_OFF_TOPIC_RELEVANCE if RERANKER == "cohere" else None, RESPOND_MIN_COVERAGE,
+                                enabled=RESPOND_TIERING, log=RESPOND_TIER_LOG)
+        # requests with a session id run on session_graph, which keeps each session's last turn
+        self.sessions = sessions if sessions is not None else make_session_store(SESSION_BACKEND, SESSION_MAX, SESSION_TTL_S)
+        self.reuse = RetrievalReuse(vector_db.docstore, SESSION_REUSE_MIN_SIMILARITY)
         self.graph = self.build_graph()
+        self.session_graph = self.build_graph(self.sessions) if self.sessions is not None else None
+
+    def turn_input(self, messages: list) -> dict:
+        """Graph input for one chat turn: in a session, it also clears what the previous turn left in the state."""
+        return {"messages": messages, "cached_response": None, "query_embedding": None}
 
     async def query_from_history(self, state: MainState):
         query = state["messages"][-1]['content']
@@ -66,6 +157,20 @@ class MainGraph(object):
         query = await query_from_history_chain.ainvoke({"query": query, "last_response": last_response})
         return {"messages": [{"role": "human", "content": query}]}
     
+    async def check_cache(self, state: MainState):
+        if self.response_cache is None:
+            return
+        query = state["messages"][-1]['content']
+        cached_response, query_embedding = await self.response_cache.lookup(query)
+        if cached_response is None:
+            return {"query_embedding": query_embedding}
+        # picked up by run_graph through stream_mode="custom"
+        get_stream_writer()({"cached_response": cached_response})
+        return {"cached_response": cached_response, "messages": [{"role": "ai", "content": cached_response}]}
+
+    def route_after_cache(self, state: MainState):
+        return END if state.get("cached_response") else 'respond'
+
     async def get_subquestions(self, state: MainState):
         return
         prompt = state["messages"][-1]['content']
@@ -85,31 +190,54 @@ class MainGraph(object):
         subresponse = await answer_subq_chain.ainvoke({"query": query, "context": formatted_context})
         return {"subresponses": [subresponse], "debug": [len(refined_context)]}
 
-    async def respond(self, state: MainState):
+    async def respond(self, state: MainState, config: RunnableConfig):
         prompt = state["messages"][-1]['content']
-        refined_context = await self.retriever.ainvoke(prompt)
-        formatted_context = "\n\n".join([c.page_content for c in refined_context])
-        response = await response_chain.ainvoke({"query": prompt, "context": formatted_context})
-        return {"messages": [response]}
-        prompt = state["messages"][-1]['content']
-        formatted_responses = "\n\n".join([f"<subquestion_{i+1}>:\n{subquery}\n{subresponse}</subquestion_{i+1}>" for i, (subquery, subresponse) in enumerate(zip(state["subqueries"], state["subresponses"]))])
-        response = await response_chain.ainvoke({"query": prompt, "subresponses": formatted_responses})
+        embedding = state.get("query_embedding")
+        if state.get("last_turn") and embedding is None:
+            embedding = await self.embeddings.aembed_query(prompt)
+        # the same subject as the session's last turn: its candidates are reranked for this query, no search
+        candidates = reused = self.reuse.candidates(state.get("last_turn"), embedding)
+        if candidates is None:
+            candidates = await self.retriever.base_retriever.ainvoke(prompt)
+        refined_context = await arerank(self.retriever, prompt, candidates)
+        tier = self.tiers.route(prompt, refined_context)
+        formatted_context = self.context.assemble([refined_context], tier.context_tokens)
+        response = await response_chains[tier.tier].with_config(callbacks=[self.prompt_cache, self.tiers.usage[tier.tier]]).ainvoke(
+            {"query": prompt, "context": formatted_context}, config)
+        if self.response_cache is not None:
+            await self.response_cache.store(state.get("query_embedding"), response)
+        if in_session(config) and reused is None:
+            # reused candidates stay paired with the query they were retrieved for, so a conversation
+            # drifting away from it searches again
+            embedding = embedding if embedding is not None else await self.embeddings.aembed_query(prompt)
+            return {"messages": [response], "last_turn": self.reuse.remember(prompt, embedding, candidates)}
         return {"messages": [response]}
     
-    def build_graph(self):
+    def build_graph(self, checkpointer: Optional[BaseCheckpointSaver] = None):
         builder = StateGraph(MainState)
         builder.add_node('query_from_history', self.query_from_history)
+        builder.add_node('check_cache', self.check_cache)
         #builder.add_node('get_subquestions', self.get_subquestions)
         #builder.add_node('answer_subquestion', self.answer_subquestion)
         builder.add_node('respond', self.respond)
 
         builder.add_edge(START, 'query_from_history')
-        builder.add_edge('query_from_history', 'respond')
+        builder.add_edge('query_from_history', 'check_cache')
+        builder.add_conditional_edges('check_cache', self.route_after_cache, ['respond', END])
         #builder.add_conditional_edges('get_subquestions', self.send_subquestions, ['answer_subquestion'])
         #builder.add_edge('answer_subquestion', 'respond')
         builder.add_edge('respond', END)
-        graph = builder.compile()
+        graph = builder.compile(checkpointer=checkpointer)
         return graph
-    
-g = MainGraph()
-graph = g.graph
\ No newline at end of file
+
+def corpus_files() -> list[Path]:
+    """What a graph is built from: replacing any of these (ingest.py rewrites them) is picked up by a corpus swap."""
+    current_dir = Path(__file__).resolve().parent
+    return [current_dir / name / f for name in ("docs_vector", "titles_vector") for f in (INDEX_FILE, DOCS_FILE)]
+
+# the process-wide graph, one version per corpus: requests run on the version they started on (see server.py)
+corpus = CorpusRegistry("all_guidelines", lambda timings: MainGraph(timings=timings), corpus_files)
+
+def get_main_graph(timings: Optional[dict] = None) -> MainGraph:
+    """The current graph, built on first use, so importing this module loads nothing."""
+    return corpus.get(timings)
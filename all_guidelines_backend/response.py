@@ -1,6 +1,6 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from .constants import CONV_LLM
+from .constants import CONV_LLM, CONV_SMALL_LLM, PROMPT_CACHE_KEY
 
 template = """Given the query, use the provided context to create an accurate and succinct response.
 
@@ -30,7 +30,10 @@ prompt = ChatPromptTemplate.from_messages([
 #    ('ai', 'scratchpad: Thinking about the user query, here are some subquestions and my thoughts:\n\n{context}'),
 #])
 
-response_chain = prompt | CONV_LLM | StrOutputParser()
+response_chain = prompt | CONV_LLM.bind(prompt_cache_key=PROMPT_CACHE_KEY) | StrOutputParser()
+# the same prompt for the queries shared/model_tiers.py sends to the small model
+small_response_chain = prompt | CONV_SMALL_LLM.bind(prompt_cache_key=PROMPT_CACHE_KEY + "-small") | StrOutputParser()
+response_chains = {"big": response_chain, "small": small_response_chain}
 
 
 """carefully consider each part of it as a subquestion in order to frame how you will answer the question.
@@ -5,16 +5,12 @@ from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from .main_graph import graph
-import json
+from .main_graph import corpus
+from .constants import TRACE_SAMPLE_RATE, TRACE_JSON_LOG
+from shared.streaming import graph_events
 # ----------------------------------------
 
-async def run_graph(input):
-    async for event in graph.astream_events({"messages": input}, version="v2"):
-        kind = event["event"]
-        if kind == "on_chat_model_stream":
-            content = event["data"]["chunk"].content
-            node = event["metadata"]["langgraph_node"]
-            if content and node == "respond":
-                id = event["run_id"]
-                yield json.dumps({"id": id, "text": content, "type": "text"})
\ No newline at end of file
+async def run_graph(input, session_id=None):
+    # callers wait for the backend to be ready and frame the events for the wire (see run_services.py)
+    async for event in graph_events(corpus, "all_guidelines", input, session_id, TRACE_SAMPLE_RATE, TRACE_JSON_LOG):
+        yield event
@@ -0,0 +1,173 @@
+"""Burst load against the BPH /chat endpoint, with and without admission control, against stubbed upstreams.
+
+Each chat request runs a stand-in pipeline shaped like the BPH graph (one embedding call, one
+rerank call, one streamed LLM response) whose upstreams are local stubs: each serves as many
+concurrent calls as its budget at full speed, slows down proportionally beyond that and answers 429
+past twice the budget, like the hosted APIs. Failed upstream calls are retried with backoff the way
+the OpenAI SDK does (2 retries). Requests arrive open-loop (Poisson) through the real run_services
+app and its /chat handler.
+
+    python -m benchmarks.bench_admission [--rate 40] [--duration 10]
+
+"off": no limiter, no upstream budgets (the old behaviour). "on": the CHAT_* limits from
+bph_backend/constants.py and the upstream budgets from shared/admission.py.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+import httpx
+
+import run_services
+from bph_backend import constants
+from shared.admission import UPSTREAM_MAX_CONCURRENT, AdmissionLimiter, AsyncBudgetedTransport, UpstreamBudget
+from shared.readiness import Component
+
+from .common import percentile
+
+MAX_RETRIES = 2
+
+# ------------------------------------------------------------------- #
+
+class StubUpstream(object):
+    def __init__(self, name: str, latency_s: float, capacity: int, rate_limit: int, chunks: int = 1):
+        self.name = name
+        self.latency_s = latency_s
+        self.capacity = capacity
+        self.rate_limit = rate_limit
+        self.chunks = chunks
+        self.active = 0
+        self.peak = 0
+        self.throttled = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.active >= self.rate_limit:
+            self.throttled += 1
+            return httpx.Response(429, headers={"retry-after-ms": "500"})
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+        async def body():
+            try:
+                # beyond `capacity` concurrent calls every call slows down (shared upstream throughput)
+                for _ in range(self.chunks):
+                    await asyncio.sleep(self.latency_s / self.chunks * max(1.0, self.active / self.capacity))
+                    yield b"token "
+            finally:
+                self.active -= 1
+        return httpx.Response(200, content=body())
+
+
+async def call(client: httpx.AsyncClient, stats: dict):
+    for attempt in range(MAX_RETRIES + 1):
+        async with client.stream("POST", "http://upstream/") as response:
+            if response.status_code == 200:
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+                return
+        stats["upstream_retries"] += 1
+        await asyncio.sleep(0.5 * 2 ** attempt * random.uniform(0.75, 1.0))
+    raise RuntimeError("upstream rate limited")
+
+
+def pipeline(clients: dict, stats: dict):
+    async def run_graph(payload, session_id=None):
+        async for _ in call(clients["embeddings"], stats):
+            pass
+        async for _ in call(clients["rerank"], stats):
+            pass
+        async for token in call(clients["llm"], stats):
+            yield {"id": "stub", "text": token.decode(), "type": "text"}
+    return run_graph
+
+
+async def run(limited: bool, args) -> dict:
+    # upstreams slow down beyond their budget and throttle at twice it
+    upstreams = {name: StubUpstream(name, latency, capacity=UPSTREAM_MAX_CONCURRENT[name], rate_limit=2 * UPSTREAM_MAX_CONCURRENT[name],
+                                    chunks=20 if name == "llm" else 1)
+                 for name, latency in (("llm", args.llm_s), ("embeddings", args.embed_s), ("rerank", args.rerank_s))}
+    budgets = {name: UpstreamBudget(name, UPSTREAM_MAX_CONCURRENT[name] if limited else None) for name in upstreams}
+    clients = {name: httpx.AsyncClient(transport=AsyncBudgetedTransport(budgets[name], httpx.MockTransport(upstream.handle)))
+               for name, upstream in upstreams.items()}
+    stats = {"upstream_retries": 0}
+
+    ready = Component("bph", lambda timings: None)
+    ready.start()
+    await ready.wait(1)
+    run_services.bph_backend = ready
+    run_services.run_graph_bph = pipeline(clients, stats)
+    run_services.bph_admission = AdmissionLimiter(
+        "bph", constants.CHAT_MAX_CONCURRENT if limited else None, constants.CHAT_MAX_QUEUE, constants.CHAT_QUEUE_TIMEOUT_S)
+
+    results = []
+    body = {"messages": [{"role": "human", "content": [{"type": "text", "text": "What are my options for an enlarged prostate?"}]}]}
+    transport = httpx.ASGITransport(app=run_services.bph_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bph", timeout=None) as client:
+        async def one():
+            start = time.perf_counter()
+            try:
+                # framed, so a stream that fails after its 200 ends with an error event
+                response = await client.post("/chat?format=ndjson", json=body)
+                outcome = str(response.status_code)
+                if response.status_code == 200:
+                    outcome = "failed" if '"type": "error"' in response.text else "ok"
+            except RuntimeError:
+                outcome = "failed"
+            results.append((outcome, time.perf_counter() - start))
+
+        rng = random.Random(0)
+        tasks, start = [], time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            tasks.append(asyncio.create_task(one()))
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    for c in clients.values():
+        await c.aclose()
+    metrics = run_services.bph_admission.metrics()
+
+    ok = [latency for outcome, latency in results if outcome == "ok"]
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return {
+        "sent": len(results),
+        "goodput": len(ok) / elapsed,
+        "p50": percentile(ok, 0.5) if ok else float("nan"),
+        "p99": percentile(ok, 0.99) if ok else float("nan"),
+        "outcomes": outcomes,
+        "throttled": sum(u.throttled for u in upstreams.values()),
+        "retries": stats["upstream_retries"],
+        "peak_llm": upstreams["llm"].peak,
+        "admission": metrics,
+    }
+
+
+async def main(args):
+    print(f"offered {args.rate:.0f} req/s for {args.duration:.0f}s; stub latencies llm {args.llm_s}s (streamed), "
+          f"embeddings {args.embed_s}s, rerank {args.rerank_s}s; upstream limits {UPSTREAM_MAX_CONCURRENT}")
+    print(f"{'limiter':<9}{'sent':>6}{'ok/s':>7}{'p50':>8}{'p99':>8}{'upstream 429':>14}{'retries':>9}  outcomes")
+    for limited in (False, True):
+        r = await run(limited, args)
+        print(f"{'on' if limited else 'off':<9}{r['sent']:>6}{r['goodput']:>7.1f}{r['p50']:>7.2f}s{r['p99']:>7.2f}s"
+              f"{r['throttled']:>14}{r['retries']:>9}  {r['outcomes']}")
+        if limited:
+            a = r["admission"]
+            print(f"{'':<9}queue: max {a['max_queued']}/{a['max_queue']}, wait p50 {a['wait_ms_p50']:.0f}ms "
+                  f"p99 {a['wait_ms_p99']:.0f}ms, rejected {a['rejected']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=40.0, help="offered requests per second")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--llm-s", type=float, default=1.0)
+    parser.add_argument("--embed-s", type=float, default=0.05)
+    parser.add_argument("--rerank-s", type=float, default=0.15)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,113 @@
+"""Prompt context of the respond step: the concatenated lookups vs. shared/context.py's budgeter.
+
+Retrieval runs offline: hashing embeddings (shared/embeddings.py) and the in-process hybrid
+reranker stand in for OpenAI and Cohere, over the shipped BPH parent documents and guideline pages.
+BPH queries discuss 0-3 treatments each (seeded), like choose_tx's output, so respond does 1-4 lookups.
+
+    python -m benchmarks.bench_context [--budget 6000] [--ttft-base-ms 400] [--prefill-ms-per-1k 40]
+
+Time to first token is modelled as a fixed part plus prompt prefill proportional to its tokens
+(pass the figures measured for your deployment); the budgeter's own CPU time is added to "after".
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain.retrievers import ContextualCompressionRetriever
+
+import bph_backend.main_graph as main_graph
+from bph_backend.choose_tx import TREATMENT_OPTIONS
+from shared import context
+from shared.context import ContextBudgeter, count_tokens
+from shared.embeddings import HashingEmbeddings
+from shared.rerankers import HybridReranker, aretrieve_many
+
+from .common import guideline_index, load_queries, percentile
+
+# ------------------------------------------------------------------- #
+
+def bph_lookups(queries: list[str]) -> list[tuple[list[str], list]]:
+    """(treatments, [query lookup] + one lookup per treatment) per query."""
+    embeddings = HashingEmbeddings()
+    main_graph.RESPONSE_CACHE_BACKEND = None
+    main_graph.PREWARM_TREATMENT_QUERIES = False
+    index_dir = Path(tempfile.mkdtemp(prefix="bench-context-"))
+    try:
+        g = main_graph.MainGraph(embeddings=embeddings, index_dir=index_dir,
+                                 make_reranker=lambda top_n: HybridReranker(top_n=top_n, embeddings=embeddings))
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+    rng = random.Random(0)
+
+    async def lookups():
+        results = []
+        for query in queries:
+            treatments = rng.sample(TREATMENT_OPTIONS, rng.randint(0, 3))
+            results.append((treatments, await aretrieve_many([(g.big_retriever, query)] + [(g.small_retriever, t) for t in treatments])))
+        return results
+    return asyncio.run(lookups())
+
+
+def all_guidelines_lookups(queries: list[str]):
+    embeddings = HashingEmbeddings()
+    retriever = ContextualCompressionRetriever(
+        base_compressor=HybridReranker(top_n=10, embeddings=embeddings),
+        base_retriever=guideline_index(embeddings).as_retriever(search_kwargs={"k": 50}),
+    )
+    return [[retriever.invoke(query)] for query in queries]
+
+
+def measure(lookups: list, budget, args) -> dict:
+    budgeter = ContextBudgeter(budget)
+    before, after, cpu = [], [], []
+    for result in lookups:
+        before.append(count_tokens(context.SEPARATOR.join(d.page_content for docs in result for d in docs)))
+        start = time.process_time()
+        after.append(count_tokens(budgeter.assemble(result)))
+        cpu.append(time.process_time() - start)
+    ttft = lambda tokens, extra=0.0: args.ttft_base_ms + tokens / 1000 * args.prefill_ms_per_1k + extra * 1000
+    m = budgeter.metrics()
+    return {
+        "before": statistics.mean(before), "after": statistics.mean(after),
+        "before_p95": percentile(before, 0.95), "after_p95": percentile(after, 0.95),
+        "docs": (m["docs_in"] / m["assembled"], m["docs_out"] / m["assembled"]),
+        "duplicates": m["duplicates"] / m["assembled"],
+        "cpu_ms": percentile(cpu, 0.5) * 1000,
+        "ttft": (statistics.mean(ttft(t) for t in before), statistics.mean(ttft(t, c) for t, c in zip(after, cpu))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, action="append", help="token budgets to compare (repeatable)")
+    parser.add_argument("--ttft-base-ms", type=float, default=400.0)
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=40.0)
+    args = parser.parse_args()
+    budgets = args.budget or [None, 6000, 4000]
+
+    queries = load_queries()
+    print(f"tokenizer: {'tiktoken ' + context.ENCODING if context._encoder() else 'chars/4 estimate (tiktoken BPE file unavailable)'}")
+    print(f"TTFT model: {args.ttft_base_ms:.0f}ms + {args.prefill_ms_per_1k:.0f}ms per 1k prompt tokens\n")
+    print(f"{'backend':<16}{'budget':>8}{'tokens before':>15}{'after':>8}{'p95 before':>12}{'after':>8}"
+          f"{'docs':>11}{'dups':>6}{'CPU':>8}{'TTFT before':>13}{'after':>8}")
+    bph = [lookups for _, lookups in bph_lookups(queries["bph"])]
+    for backend, lookups in (("bph", bph), ("all_guidelines", all_guidelines_lookups(queries["all_guidelines"]))):
+        for budget in budgets:
+            r = measure(lookups, budget, args)
+            print(f"{backend:<16}{budget or '-':>8}{r['before']:>15.0f}{r['after']:>8.0f}{r['before_p95']:>12.0f}{r['after_p95']:>8.0f}"
+                  f"{r['docs'][0]:>6.1f}->{r['docs'][1]:<3.1f}{r['duplicates']:>6.1f}{r['cpu_ms']:>6.2f}ms"
+                  f"{r['ttft'][0]:>11.0f}ms{r['ttft'][1]:>6.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
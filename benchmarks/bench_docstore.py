@@ -0,0 +1,108 @@
+"""Docstore load time, memory and lookups: the shipped pickles vs. docstore.bin (shared/mapped_docstore.py).
+
+For each corpus (the BPH summaries and parent docs, the docs_vector and titles_vector docstores),
+a fresh process opens the store and then looks up --lookups random ids. Reported: time to open,
+Python heap allocated by opening it (tracemalloc), RSS growth, and per-lookup latency.
+
+    python -m benchmarks.bench_docstore [--repeats 5] [--lookups 1000]
+
+docstore.bin files are written by `python -m shared.convert_docstores`.
+"""
+import argparse
+import multiprocessing
+import pickle
+import random
+import statistics
+import time
+import tracemalloc
+
+from shared.mapped_docstore import MappedDocstore
+from shared.persisted_index import LEGACY_DOCSTORE_FILE
+
+from .common import ROOT
+
+AUA = ROOT / "bph_backend" / "aua"
+GUIDELINES = ROOT / "all_guidelines_backend"
+
+# ------------------------------------------------------------------- #
+
+def unpickle(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def pickled(corpus: str):
+    """(lookup by ids, ids) as the backends read the pickles before."""
+    if corpus == "aua/summaries":
+        docs = {str(i): d for i, d in enumerate(unpickle(AUA / "summary_docs.pkl"))}
+    elif corpus == "aua/parents":
+        docs = dict(zip(unpickle(AUA / "doc_ids.pkl"), unpickle(AUA / "docs.pkl")))
+    else:
+        docstore, _ = unpickle(GUIDELINES / corpus / LEGACY_DOCSTORE_FILE)
+        docs = docstore._dict
+    return (lambda ids: [docs.get(i) for i in ids]), list(docs)
+
+
+def mapped(corpus: str):
+    store = MappedDocstore((AUA if corpus.startswith("aua/") else GUIDELINES) / corpus.removeprefix("aua/"))
+    return store.mget, store.ids
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(fmt: str, corpus: str, lookups: int, results):
+    rss = rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    mget, ids = (pickled if fmt == "pickle" else mapped)(corpus)
+    load_s = time.perf_counter() - start
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss = rss_kb() - rss
+
+    keys = random.Random(0).choices(ids, k=lookups)
+    start = time.perf_counter()
+    for key in keys:
+        mget([key])[0].page_content
+    lookup_s = time.perf_counter() - start
+    results.put({"load_ms": load_s * 1000, "heap_mb": heap / 2 ** 20, "rss_mb": rss / 1024,
+                 "lookup_us": lookup_s / lookups * 1e6, "count": len(ids)})
+
+
+def run(fmt: str, corpus: str, lookups: int) -> dict:
+    # a fresh interpreter each time: nothing cached from an earlier load, and RSS starts clean
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure, args=(fmt, corpus, lookups, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'corpus':<16}{'docs':>6}{'format':>8}{'load p50':>11}{'heap':>9}{'RSS':>9}{'lookup':>10}")
+    for corpus in ("aua/summaries", "aua/parents", "docs_vector", "titles_vector"):
+        for fmt in ("pickle", "mapped"):
+            samples = [run(fmt, corpus, args.lookups) for _ in range(args.repeats)]
+            print(f"{corpus:<16}{samples[0]['count']:>6}{fmt:>8}"
+                  f"{statistics.median(s['load_ms'] for s in samples):>9.2f}ms"
+                  f"{statistics.median(s['heap_mb'] for s in samples):>7.2f}MB"
+                  f"{statistics.median(s['rss_mb'] for s in samples):>7.2f}MB"
+                  f"{statistics.median(s['lookup_us'] for s in samples):>8.1f}us")
+    print("heap: Python allocations made by opening the store; lookup: one id, decoded to a Document")
+
+
+if __name__ == "__main__":
+    main()
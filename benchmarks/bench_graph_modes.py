@@ -0,0 +1,166 @@
+"""Time to first token of the BPH graph, sequential vs. speculative mode, against stubbed upstreams.
+
+Every upstream (rewrite LLM, treatment-choice LLM, embeddings, reranker, response LLM) is replaced
+by a local stub with a fixed delay, so the numbers isolate how the graph orders its calls.
+
+    python -m benchmarks.bench_graph_modes --llm-ms 600 --rerank-ms 250 --embed-ms 150 --runs 5
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+import bph_backend.main_graph as main_graph
+from bph_backend.response import prompt as response_prompt
+from shared.embeddings import HashingEmbeddings
+
+ANSWER = "TURP and HoLEP both relieve obstruction; the right choice depends on prostate size and your priorities. " * 4
+
+SCENARIOS = {
+    "first turn": [{"role": "ai", "content": ""}, {"role": "human", "content": "What are my options for an enlarged prostate of 60cc?"}],
+    "self-contained follow-up": [{"role": "ai", "content": ANSWER}, {"role": "human", "content": "How long does recovery take after HoLEP surgery?"}],
+    "dependent follow-up": [{"role": "ai", "content": ANSWER}, {"role": "human", "content": "is it reversible?"}],
+}
+
+# ------------------------------------------------------------------- #
+
+class StubChatModel(BaseChatModel):
+    text: str
+    first_token_ms: float
+    token_ms: float = 5.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.text))])
+
+    async def _astream(self, messages, stop=None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs):
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for token in self.text.split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.token_ms / 1000)
+
+
+class SlowEmbeddings(HashingEmbeddings):
+    def __init__(self, latency_ms: float):
+        super().__init__()
+        self.latency_ms = latency_ms
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self.embed_query(text)
+
+
+class SlowReranker(BaseDocumentCompressor):
+    top_n: int
+    latency_ms: float
+
+    def compress_documents(self, documents, query, callbacks=None):
+        time.sleep(self.latency_ms / 1000)
+        return list(documents)[:self.top_n]
+
+    async def acompress_documents(self, documents, query, callbacks=None):
+        await asyncio.sleep(self.latency_ms / 1000)
+        return list(documents)[:self.top_n]
+
+
+def stub_chains(llm_ms: float):
+    async def rewrite(inputs):
+        await asyncio.sleep(llm_ms / 1000)
+        return f"Regarding HoLEP and TURP: {inputs['query']}"
+
+    async def choose(inputs):
+        await asyncio.sleep(llm_ms / 1000)
+        return {"treatments_to_discuss": ["TURP", "Endoscopic Enucleation (e.g. HoLEP, ThuLEP)"]}
+
+    main_graph.query_from_history_chain = RunnableLambda(lambda x: x, afunc=rewrite)
+    main_graph.choose_tx_chain = RunnableLambda(lambda x: x, afunc=choose)
+    respond = response_prompt | StubChatModel(text=ANSWER, first_token_ms=llm_ms) | StrOutputParser()
+    main_graph.response_chains = {"big": respond, "small": respond}
+
+
+def clear_caches(g: main_graph.MainGraph):
+    # every run should pay for its upstream calls; cache effects are measured elsewhere
+    for retriever in (g.big_retriever, g.small_retriever):
+        retriever.base_compressor.cache.clear()
+        retriever.base_retriever.vectorstore.embedding_function.cache.clear()
+
+
+async def time_to_first_token(graph, messages) -> tuple[float, float]:
+    start = time.perf_counter()
+    first = None
+    async for event in graph.astream_events({"messages": messages}, version="v2"):
+        if event["event"] == "on_chat_model_stream" and event["metadata"]["langgraph_node"] == "respond":
+            if first is None and event["data"]["chunk"].content:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def run(args):
+    stub_chains(args.llm_ms)
+    main_graph.RESPONSE_CACHE_BACKEND = None
+    main_graph.PREWARM_TREATMENT_QUERIES = args.prewarm
+
+    index_dir = Path(tempfile.mkdtemp(prefix="bench-modes-"))
+    try:
+        instances = {
+            mode: main_graph.MainGraph(
+                mode=mode,
+                embeddings=SlowEmbeddings(args.embed_ms),
+                make_reranker=lambda top_n: SlowReranker(top_n=top_n, latency_ms=args.rerank_ms),
+                index_dir=index_dir,
+            )
+            for mode in ("sequential", "speculative")
+        }
+        for g in instances.values():
+            if g.prewarming is not None:
+                g.prewarming.join()
+        print(f"stub latencies: llm {args.llm_ms:.0f}ms, rerank {args.rerank_ms:.0f}ms, embed {args.embed_ms:.0f}ms; {args.runs} runs")
+        print(f"{'scenario':<26}{'mode':<13}{'TTFT p50':>10}{'TTFT max':>10}{'total p50':>11}")
+        for scenario, messages in SCENARIOS.items():
+            for mode, g in instances.items():
+                samples = []
+                for _ in range(args.runs):
+                    if not args.prewarm:
+                        clear_caches(g)
+                    samples.append(await time_to_first_token(g.graph, messages))
+                ttft = [s[0] * 1000 for s in samples]
+                total = [s[1] * 1000 for s in samples]
+                print(f"{scenario:<26}{mode:<13}{statistics.median(ttft):>8.0f}ms{max(ttft):>8.0f}ms{statistics.median(total):>9.0f}ms")
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm-ms", type=float, default=600.0, help="latency of each LLM call / first token")
+    parser.add_argument("--rerank-ms", type=float, default=250.0)
+    parser.add_argument("--embed-ms", type=float, default=150.0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--prewarm", action="store_true", help="pre-warm the treatment-name rerank cache")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Corpus hot swap (shared/corpus.py) under load, vs. a restart.
+
+Each app runs as in benchmarks/suite.py: the real MainGraph behind its server's run_graph, with
+offline upstream fakes at fixed latencies. --concurrency clients ask the app's queries back to back
+for --seconds. A third of the way in, the corpus is swapped the way POST /admin/reload and the file
+watcher do it (CorpusRegistry.reload).
+
+    python -m benchmarks.bench_hot_swap [--app bph] [--concurrency 16] [--seconds 12]
+
+Reported per app:
+- requests completed and failed;
+- latency of the requests done before the swap, running across it, and started after it;
+- how long the new version took to load;
+- peak RSS while both versions were loaded, over the steady state before the swap;
+- RSS once the old version was released.
+A restart instead drops every stream in flight and serves nothing for the cold-start time.
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from .common import load_queries, percentile
+from .fakes import Fixtures, Latency
+from .suite import APPS, UPSTREAM_FIXTURES, App, rss_mb, stream
+
+# ------------------------------------------------------------------- #
+
+class Sampler(object):
+    """RSS every few milliseconds, in a thread, so the peak while the new version loads is seen."""
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval = interval_s
+        self.samples: list[tuple[float, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.perf_counter(), rss_mb()))
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def between(self, start: float, end: float) -> list[float]:
+        return [mb for t, mb in self.samples if start <= t < end] or [rss_mb()]
+
+
+def summary(samples: list[tuple]) -> str:
+    if not samples:
+        return f"{0:>5}{'-':>11}{'-':>10}{'-':>10}"
+    ttft = [s[1] * 1000 for s in samples]
+    e2e = [s[2] * 1000 for s in samples]
+    return f"{len(samples):>5}{statistics.median(ttft):>9.0f}ms{statistics.median(e2e):>8.0f}ms{percentile(e2e, 0.95):>8.0f}ms"
+
+
+async def warm_up(app: App, queries: list[str]):
+    await asyncio.gather(*[stream(app, q) for q in queries])
+
+
+async def load_with_swap(app: App, queries: list[str], args) -> dict:
+    corpus = app.main_graph.corpus
+    done, failed = [], []
+    stop = time.perf_counter() + args.seconds
+    swap = {}
+
+    async def client(offset: int):
+        i = offset
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            try:
+                ttft, e2e, _ = await stream(app, queries[i % len(queries)])
+                done.append((started, ttft, e2e))
+            except Exception as e:
+                failed.append((started, repr(e)))
+            i += args.concurrency
+
+    async def swapper():
+        await asyncio.sleep(args.seconds / 3)
+        swap["start"] = time.perf_counter()
+        swap["in_flight"] = corpus.current.in_flight
+        result = await corpus.reload()
+        swap["end"] = time.perf_counter()
+        swap["load_s"] = result["load_s"]
+        while corpus.retired:
+            await asyncio.sleep(0.005)
+        swap["released"] = time.perf_counter()
+
+    await asyncio.gather(swapper(), *[client(c) for c in range(args.concurrency)])
+    return {"done": done, "failed": failed, **swap}
+
+
+def run_app(name: str, args) -> None:
+    app = App(name, Fixtures(UPSTREAM_FIXTURES), Latency(), args.tokens)
+    corpus = app.main_graph.corpus
+    corpus.load = lambda timings: app.make()
+    try:
+        start = time.perf_counter()
+        corpus.get()
+        cold_s = time.perf_counter() - start
+        queries = load_queries()[name]
+        # one warm-up round, so "before" is a steady state and not the first requests' cold caches
+        asyncio.run(warm_up(app, queries))
+
+        with Sampler() as sampler:
+            began = time.perf_counter()
+            r = asyncio.run(load_with_swap(app, queries, args))
+            time.sleep(0.2)
+            ended = time.perf_counter()
+        before = statistics.median(sampler.between(began, r["start"]))
+        peak = max(sampler.between(r["start"], r["released"] + 0.05))
+        after = statistics.median(sampler.between(r["released"] + 0.05, ended))
+
+        phases = {"before": [], "across": [], "after": []}
+        for sample in r["done"]:
+            started, _, e2e = sample
+            phases["before" if started + e2e < r["start"] else "across" if started < r["end"] else "after"].append(sample)
+        print(f"\n[{name}] {args.concurrency} clients for {args.seconds:.0f}s: {len(r['done'])} requests, {len(r['failed'])} failed"
+              + (f" (first: {r['failed'][0][1]})" if r["failed"] else ""))
+        print(f"  swap: new version loaded in {r['load_s']:.2f}s with {r['in_flight']} streams in flight; "
+              f"old version released {(r['released'] - r['end']) * 1000:.0f}ms after the switch")
+        print(f"  {'swap':<10}{'reqs':>5}{'TTFT p50':>11}{'e2e p50':>10}{'e2e p95':>10}")
+        for phase, samples in phases.items():
+            print(f"  {phase:<10}{summary(samples)}")
+        print(f"  RSS: {before:.0f}MB steady, {peak:.0f}MB peak during the swap (+{peak - before:.0f}MB), {after:.0f}MB after release")
+        print(f"  a restart instead: {r['in_flight']} streams dropped, then {cold_s:.2f}s (cold load) with no service on this port")
+    finally:
+        app.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, action="append")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=12.0)
+    parser.add_argument("--tokens", type=int, default=150)
+    args = parser.parse_args()
+    for name in args.app or APPS:
+        run_app(name, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Dense-only vs. BM25-only vs. hybrid (RRF) candidate retrieval on the all_guidelines corpus.
+
+For every query in fixtures/queries.json with labelled guideline sources, reports how many of the
+candidates handed to the reranker come from a relevant guideline (hit@k: at least one does;
+precision: share that do) and the retrieval latency.
+
+    python -m benchmarks.bench_hybrid_retrieval [--embeddings hashing|openai] [--k 10 25 50]
+
+The default hashing embeddings are an offline, purely lexical stand-in, so the dense column is a
+lower bound of what text-embedding-3-large achieves; run with --embeddings openai for real numbers.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain_core.retrievers import BaseRetriever
+
+from shared.embeddings import get_embeddings
+from shared.retrieval_cache import CachedEmbeddings
+from shared.sparse_index import FusedRetriever, SparseIndex
+
+from .common import guideline_index, load_queries, percentile
+
+# ------------------------------------------------------------------- #
+
+def retrievers(vectorstore, sparse: SparseIndex, k: int) -> dict[str, BaseRetriever]:
+    return {
+        "dense": vectorstore.as_retriever(search_kwargs={"k": k}),
+        # a fused retriever with the dense side switched off is plain BM25
+        "sparse": FusedRetriever(vectorstore=vectorstore, sparse=sparse, k=k, dense_k=0, sparse_k=k),
+        "hybrid": FusedRetriever(vectorstore=vectorstore, sparse=sparse, k=k, dense_k=max(k, 30), sparse_k=max(k, 30)),
+    }
+
+
+async def evaluate(retriever: BaseRetriever, relevant: dict[str, list[str]]) -> dict:
+    hits, precision, latencies = [], [], []
+    for query, sources in relevant.items():
+        start = time.perf_counter()
+        docs = await retriever.ainvoke(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        matching = [d for d in docs if d.metadata.get("source") in sources]
+        hits.append(bool(matching))
+        precision.append(len(matching) / max(len(docs), 1))
+    return {
+        "hit": statistics.mean(hits),
+        "precision": statistics.mean(precision),
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+    }
+
+
+async def run(args):
+    embeddings = CachedEmbeddings(get_embeddings(args.embeddings, "text-embedding-3-large"))
+    vectorstore = guideline_index(embeddings)
+    start = time.perf_counter()
+    sparse = SparseIndex.from_vectorstore(vectorstore)
+    build_ms = (time.perf_counter() - start) * 1000
+    relevant = load_queries()["all_guidelines_relevant_sources"]
+    # warm the query embeddings so latency compares search cost, not the embedding endpoint
+    await embeddings.aembed_documents(list(relevant))
+
+    print(f"{len(relevant)} labelled queries, {len(vectorstore.index_to_docstore_id)} pages, "
+          f"BM25 index built in {build_ms:.0f}ms ({len(sparse.terms)} terms)")
+    print(f"{'k':>4}  {'mode':<8}{'hit@k':>7}{'precision':>11}{'p50':>9}{'p95':>9}")
+    for k in args.k:
+        for mode, retriever in retrievers(vectorstore, sparse, k).items():
+            r = await evaluate(retriever, relevant)
+            print(f"{k:>4}  {mode:<8}{r['hit']:>7.2f}{r['precision']:>11.2f}{r['p50']:>7.2f}ms{r['p95']:>7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", choices=["hashing", "openai"], default="hashing")
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 25, 50])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
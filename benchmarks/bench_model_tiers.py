@@ -0,0 +1,137 @@
+"""Respond model tiering (shared/model_tiers.py): every answer from CONV_LLM vs. routed by query class.
+
+Each app runs as in benchmarks/suite.py: the real MainGraph behind its server's run_graph, with
+offline upstream fakes. CONV_SMALL_LLM streams at --small-llm-ms / --small-token-ms, CONV_LLM at
+--llm-ms / --token-ms. The recorded mix of fixtures/tier_queries.json (each query `weight` times)
+is asked --rounds times by --concurrency clients, once with RESPOND_TIERING off and once on, each
+from a freshly built graph. bph's treatment choice answers with the treatments the query names.
+
+    python -m benchmarks.bench_model_tiers [--app bph] [--concurrency 8] [--rounds 2]
+
+Reported per app: the classifier's agreement with the fixture labels (and its misses), then per
+tier: requests, time to first token and end-to-end latency (p50, at the client), streaming rate
+(p50), prompt and completion tokens per request and cost per 1000 requests at PRICES (list
+prices); and the whole mix's cost and TTFT against the all-CONV_LLM run.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter, defaultdict
+
+from .common import FIXTURES
+from .fakes import Fixtures, Latency
+from .suite import APPS, UPSTREAM_FIXTURES, App
+
+TIER_QUERIES = FIXTURES / "tier_queries.json"
+# USD per million prompt / completion tokens
+PRICES = {"big": (2.00, 8.00), "small": (0.15, 0.60)}
+
+# ------------------------------------------------------------------- #
+
+def named_treatments(messages) -> dict:
+    from bph_backend.choose_tx import TREATMENT_OPTIONS
+    query = messages[-1].content.lower()
+    return {"treatments_to_discuss": [t for t in TREATMENT_OPTIONS if any(name.strip().lower() in query for name in t.split("/"))]}
+
+
+async def ask(app: App, query: str) -> tuple[float, float]:
+    start = time.perf_counter()
+    first = None
+    async for _ in app.server.run_graph([{"role": "human", "content": query}]):
+        if first is None:
+            first = time.perf_counter() - start
+    return (first if first is not None else float("nan")), time.perf_counter() - start
+
+
+async def play(app: App, graph, mix: list[str], args) -> list[tuple]:
+    gate = asyncio.Semaphore(args.concurrency)
+    decisions = {}
+    route = graph.tiers.route
+
+    def recording(query, docs, complex_signals=0):
+        decisions[query] = route(query, docs, complex_signals)
+        return decisions[query]
+    graph.tiers.route = recording
+
+    async def one(query):
+        async with gate:
+            return query, *await ask(app, query)
+    samples = await asyncio.gather(*[one(q) for q in mix * args.rounds])
+    return [(query, decisions[query], ttft, e2e) for query, ttft, e2e in samples]
+
+
+def cost(usage: dict, tier: str) -> float:
+    prompt, completion = PRICES[tier]
+    return (usage["input_tokens"] * prompt + usage["output_tokens"] * completion) / 1e6
+
+
+def run_app(name: str, args) -> None:
+    app = App(name, Fixtures(UPSTREAM_FIXTURES), Latency(args.llm_ms, args.token_ms, args.embed_ms, args.rerank_ms), args.tokens)
+    app.constants.CONV_SMALL_LLM.latency = Latency(args.small_llm_ms, args.small_token_ms, args.embed_ms, args.rerank_ms)
+    if name == "bph":
+        app.constants.CHOOSE_TX_LLM.synthesize = named_treatments
+    with open(TIER_QUERIES) as file:
+        labelled = json.load(file)[name]
+    mix = [q["query"] for q in labelled for _ in range(q["weight"])]
+    try:
+        results, usage = {}, {}
+        for mode in ("big", "tiered"):
+            graph = app.build()
+            if mode == "big":
+                graph.tiers.tiers = dict.fromkeys(graph.tiers.tiers, "big")
+            results[mode] = asyncio.run(play(app, graph, mix, args))
+            usage[mode] = {tier: graph.tiers.usage[tier].metrics() for tier in PRICES}
+
+        print(f"\n[{name}] {len(mix) * args.rounds} requests ({len(labelled)} distinct queries), {args.concurrency} at a time")
+        decided = {query: decision for query, decision, _, _ in results["tiered"]}
+        agree = sum(decided[q["query"]].reason == q["class"] for q in labelled)
+        print(f"  classifier: {agree}/{len(labelled)} queries as labelled, "
+              f"{sum(app.constants.RESPOND_TIERS[q['class']] == decided[q['query']].tier for q in labelled)}/{len(labelled)} on the labelled tier")
+        for q in labelled:
+            if decided[q["query"]].reason != q["class"]:
+                print(f"    {q['class']:>13} -> {decided[q['query']].reason:<13} {q['query'][:70]}")
+
+        print(f"  {'mode':<8}{'tier':<7}{'requests':>9}{'TTFT p50':>10}{'e2e p50':>9}{'tok/s':>8}{'prompt tok':>12}{'compl. tok':>12}{'$/1k req':>10}")
+        totals = {}
+        for mode in ("big", "tiered"):
+            by_tier = defaultdict(list)
+            for _, decision, ttft, e2e in results[mode]:
+                by_tier[decision.tier].append((ttft * 1000, e2e * 1000))
+            totals[mode] = sum(cost(usage[mode][tier], tier) for tier in PRICES)
+            for tier in PRICES:
+                samples, u = by_tier.get(tier), usage[mode][tier]
+                if not samples:
+                    continue
+                print(f"  {mode:<8}{tier:<7}{len(samples):>9}{statistics.median(s[0] for s in samples):>8.0f}ms"
+                      f"{statistics.median(s[1] for s in samples):>7.0f}ms{u['tokens_per_s_p50'] or 0:>8.0f}"
+                      f"{u['input_tokens'] / u['calls']:>12.0f}{u['output_tokens'] / u['calls']:>12.0f}"
+                      f"{cost(u, tier) / u['calls'] * 1000:>10.2f}")
+        ttft = {mode: statistics.median(r[2] * 1000 for r in results[mode]) for mode in results}
+        print(f"  whole mix: ${totals['big'] / len(results['big']) * 1000:.2f} -> ${totals['tiered'] / len(results['tiered']) * 1000:.2f} "
+              f"per 1k requests ({totals['tiered'] / totals['big'] - 1:+.0%}), TTFT p50 {ttft['big']:.0f} -> {ttft['tiered']:.0f}ms")
+        print(f"  decisions: {json.dumps(Counter(f'{d.tier}:{d.reason}' for _, d, _, _ in results['tiered']))}")
+    finally:
+        app.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, action="append")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=2, help="times the mix is asked per mode")
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--llm-ms", type=float, default=600.0, help="CONV_LLM (and the other models') time to first token")
+    parser.add_argument("--token-ms", type=float, default=12.0)
+    parser.add_argument("--small-llm-ms", type=float, default=350.0, help="CONV_SMALL_LLM time to first token")
+    parser.add_argument("--small-token-ms", type=float, default=6.0)
+    parser.add_argument("--embed-ms", type=float, default=80.0)
+    parser.add_argument("--rerank-ms", type=float, default=150.0)
+    args = parser.parse_args()
+    for name in args.app or APPS:
+        run_app(name, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Provider prompt-cache hits of the respond prompt: "original" vs. "cache-prefix" layout.
+
+The respond chains run unchanged against a stub of the OpenAI chat completions endpoint that
+caches like the hosted one: a prompt reuses the longest prefix it shares with an earlier prompt,
+once that is at least 1024 tokens, in 128-token steps. The stub reports the cached tokens in the
+usage of each streamed response, and the numbers below are what shared/prompt_cache.py recorded
+from those responses. Context comes from offline retrieval, as in bench_context.
+
+    python -m benchmarks.bench_prompt_cache [--budget 6000] [--rounds 2] [--prefill-ms-per-1k 40]
+
+Uncached prompt tokens are what is billed at the full input rate; the prefill estimate counts only
+those (cached prefixes are served without recomputation).
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import time
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY', 'OPENAI_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+import all_guidelines_backend.constants as all_guidelines_constants
+import all_guidelines_backend.response as all_guidelines_response
+import bph_backend.constants as bph_constants
+import bph_backend.response as bph_response
+from shared.context import ContextBudgeter, count_tokens
+from shared.prompt_cache import PromptCacheStats
+
+from .bench_context import all_guidelines_lookups, bph_lookups
+from .common import load_queries
+
+MIN_CACHED = 1024
+CACHE_STEP = 128
+
+# ------------------------------------------------------------------- #
+
+class StubCompletions(object):
+    """Streams a short answer; usage.prompt_tokens_details.cached_tokens follows the prefix rules above."""
+
+    def __init__(self):
+        self.seen: list[str] = []
+
+    def _cached(self, prompt: str) -> int:
+        shared = max((len(os.path.commonprefix([prompt, earlier])) for earlier in self.seen), default=0)
+        self.seen.append(prompt)
+        tokens = count_tokens(prompt[:shared])
+        return tokens // CACHE_STEP * CACHE_STEP if tokens >= MIN_CACHED else 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in body["messages"])
+        usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": 3, "total_tokens": count_tokens(prompt) + 3,
+                 "prompt_tokens_details": {"cached_tokens": self._cached(prompt)}}
+        chunk = lambda choices, **extra: "data: " + json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": 0,
+                                                                 "model": body["model"], "choices": choices, **extra}) + "\n\n"
+        events = [chunk([{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}])
+                  for text in ("An ", "answer", ".")]
+        events.append(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        events.append(chunk([], usage=usage))
+        events.append("data: [DONE]\n\n")
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content="".join(events).encode())
+
+
+def stub_llm(stub: StubCompletions) -> ChatOpenAI:
+    return ChatOpenAI(model="gpt-4.1", api_key="stub", stream_usage=True, max_retries=0,
+                      http_async_client=httpx.AsyncClient(transport=httpx.MockTransport(stub.handle)))
+
+
+def response_chain(backend: str, layout: str, stub: StubCompletions):
+    constants, module = {"bph": (bph_constants, bph_response), "all_guidelines": (all_guidelines_constants, all_guidelines_response)}[backend]
+    constants.PROMPT_LAYOUT = layout
+    constants.CONV_LLM = stub_llm(stub)
+    return importlib.reload(module).response_chain
+
+
+async def run(backend: str, layout: str, requests: list, args) -> dict:
+    stub = StubCompletions()
+    chain = response_chain(backend, layout, stub)
+    budgeter = ContextBudgeter(args.budget, stable_order=layout == "cache-prefix")
+    stats = PromptCacheStats()
+    start = time.perf_counter()
+    for query, treatments, lookups in requests:
+        order = None
+        if layout == "cache-prefix" and treatments:
+            # as bph_backend's respond does
+            order = [1 + i for i in sorted(range(len(treatments)), key=lambda i: treatments[i])] + [0]
+        inputs = {"query": query, "context": budgeter.assemble(lookups, layout=order)}
+        if backend == "bph":
+            inputs["context_hint"] = f"You should include a discussion of the following: {', '.join(treatments)}"
+        async for _ in chain.with_config(callbacks=[stats]).astream(inputs):
+            pass
+    m = stats.metrics()
+    uncached = m["prompt_tokens"] - m["cached_tokens"]
+    return {**m, "uncached": uncached / m["usage_reported"], "prompt": m["prompt_tokens"] / m["usage_reported"],
+            "prefill_ms": uncached / m["usage_reported"] / 1000 * args.prefill_ms_per_1k, "elapsed": time.perf_counter() - start}
+
+
+def main(args):
+    queries = load_queries()
+    rng = random.Random(0)
+    print(f"prompt cache: prefixes of >= {MIN_CACHED} tokens, in {CACHE_STEP}-token steps; context budget {args.budget}; "
+          f"each query asked {args.rounds}x, shuffled")
+    print(f"{'backend':<16}{'layout':<14}{'calls':>6}{'prompt tokens':>15}{'cached':>8}{'hit calls':>11}"
+          f"{'uncached/call':>15}{'prefill est.':>14}")
+    bph = bph_lookups(queries["bph"])
+    no_treatments = [[]] * len(queries["all_guidelines"])
+    for backend, treatments, lookups in (("bph", [t for t, _ in bph], [l for _, l in bph]),
+                                         ("all_guidelines", no_treatments, all_guidelines_lookups(queries["all_guidelines"]))):
+        requests = list(zip(queries[backend], treatments, lookups)) * args.rounds
+        rng.shuffle(requests)
+        for layout in ("original", "cache-prefix"):
+            r = asyncio.run(run(backend, layout, requests, args))
+            print(f"{backend:<16}{layout:<14}{r['usage_reported']:>6}{r['prompt']:>15.0f}{r['cached_ratio']:>8.0%}"
+                  f"{r['cache_hit_calls']:>11.0%}{r['uncached']:>15.0f}{r['prefill_ms']:>12.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=6000)
+    parser.add_argument("--rounds", type=int, default=2, help="times each query is asked")
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=40.0)
+    main(parser.parse_args())
@@ -0,0 +1,131 @@
+"""Flat vs. compressed (sq8 / ivfpq / mrl) vector indexes: memory per worker, latency and recall@k.
+
+Each index kind is loaded the way the backends load it (flat vectors memory-mapped, compressed
+codes on the heap) in a fresh process, which reports its resident memory growth split into
+anonymous pages (private to each worker) and file-backed pages (page cache, shared by every worker
+mapping the same index), then runs the query set. "flat (heap)" is the index as FAISS.load_local
+reads it, a private copy per worker.
+
+    python -m benchmarks.bench_quantized_index [--replicate 20] [--recall-target 0.95] [--k 10]
+
+The shipped corpus is only 671 pages (8MB of float32 vectors); --replicate tiles it with
+perturbed copies to approximate a larger guideline set. recall@k is measured against exact flat
+search, over all queries and over the labelled (real) queries alone. Hashing embeddings are not Matryoshka-trained, so "mrl" needs far more re-scoring here than
+with text-embedding-3-large.
+"""
+import argparse
+import multiprocessing
+import statistics
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from shared.embeddings import HashingEmbeddings
+from shared.persisted_index import INDEX_FILE, _read_index
+from shared.quantized_index import QUANTIZED_KINDS, RescoredIndex
+
+from .common import CACHE_DIR, guideline_index, load_queries, percentile
+
+# ------------------------------------------------------------------- #
+
+def memory() -> dict[str, int]:
+    fields = {}
+    with open("/proc/self/status") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def worker(directory: str, kind: str, queries: np.ndarray, k: int, results):
+    before = memory()
+    if kind == "flat (heap)":
+        # how FAISS.load_local reads the index: every worker copies the vectors onto its heap
+        index = faiss.read_index(str(Path(directory) / INDEX_FILE))
+    else:
+        exact = _read_index(Path(directory))
+        index = exact if kind == "flat" else RescoredIndex.load(Path(directory), exact, kind)
+    latencies, labels = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(found[0])
+    after = memory()
+    results.put({
+        "anon_mb": (after["RssAnon"] - before["RssAnon"]) / 1024,
+        "file_mb": (after["RssFile"] - before["RssFile"]) / 1024,
+        "latencies": latencies,
+        "labels": np.asarray(labels),
+    })
+
+
+def measure(directory: Path, kind: str, queries: np.ndarray, k: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=worker, args=(str(directory), kind, queries, k, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def scaled_index(replicate: int, seed: int = 0) -> Path:
+    vectors = guideline_index(HashingEmbeddings()).index.reconstruct_n(0, 671)
+    directory = CACHE_DIR / "quantized" / f"x{replicate}-v2"
+    if not (directory / INDEX_FILE).exists():
+        directory.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(seed)
+        tiled = np.concatenate([vectors] + [vectors + rng.normal(0, 0.5 / np.sqrt(vectors.shape[1]), vectors.shape).astype(np.float32) for _ in range(replicate - 1)])
+        tiled /= np.linalg.norm(tiled, axis=1, keepdims=True)
+        flat = faiss.IndexFlatL2(tiled.shape[1])
+        flat.add(tiled)
+        faiss.write_index(flat, str(directory / INDEX_FILE))
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicate", type=int, default=20)
+    parser.add_argument("--kinds", choices=QUANTIZED_KINDS, nargs="+", default=list(QUANTIZED_KINDS))
+    parser.add_argument("--mrl-dims", type=int, default=1024)
+    parser.add_argument("--recall-target", type=float, default=0.95)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="perturbed stored vectors added to the labelled queries")
+    args = parser.parse_args()
+
+    directory = scaled_index(args.replicate)
+    exact = faiss.read_index(str(directory / INDEX_FILE))
+    for kind in args.kinds:
+        start = time.perf_counter()
+        index = RescoredIndex.build(exact, kind, args.mrl_dims, args.recall_target)
+        index.save(directory)
+        print(f"built {kind} in {time.perf_counter() - start:.1f}s: calibrated recall@10 {index.recall:.3f} "
+              f"(nprobe {index.nprobe}, oversample {index.oversample})")
+
+    embeddings = HashingEmbeddings()
+    rng = np.random.default_rng(1)
+    picks = rng.choice(exact.ntotal, size=args.queries, replace=False).astype(np.int64)
+    sampled = exact.reconstruct_batch(picks) + rng.normal(0, 2 / np.sqrt(exact.d), (args.queries, exact.d)).astype(np.float32)
+    labelled = np.asarray(embeddings.embed_documents(list(load_queries()["all_guidelines_relevant_sources"])), dtype=np.float32)
+    queries = np.concatenate([labelled, sampled / np.linalg.norm(sampled, axis=1, keepdims=True)])
+
+    print(f"\n{exact.ntotal} vectors x {exact.d} dims, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<12}{'heap MB':>9}{'mapped MB':>11}{'p50':>9}{'p95':>9}{'recall@k':>10}{'labelled':>10}")
+    truth = None
+    for kind in ["flat (heap)", "flat"] + args.kinds:
+        r = measure(directory, kind, queries, args.k)
+        if truth is None:
+            truth = r["labels"]
+        recalls = [len(set(f) & set(t)) / args.k for f, t in zip(r["labels"], truth)]
+        print(f"{kind:<12}{r['anon_mb']:>9.1f}{r['file_mb']:>11.1f}{statistics.median(r['latencies']):>7.2f}ms"
+              f"{percentile(r['latencies'], 0.95):>7.2f}ms{statistics.mean(recalls):>10.3f}{statistics.mean(recalls[:len(labelled)]):>10.3f}")
+    print("heap MB is per worker; mapped MB is page cache shared by every worker on the host, and only\n"
+          "the pages a search touches need to stay resident (all of them for flat, the short lists otherwise)")
+
+
+if __name__ == "__main__":
+    main()
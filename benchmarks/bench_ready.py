@@ -0,0 +1,153 @@
+"""Process start to port-bound and to ready for run_services.py, eager vs. background loading.
+
+"eager" builds both graphs one after the other before the servers start, as importing the
+backend servers used to; "lazy" is the current startup, where both backends load concurrently in
+worker threads after the ports are bound. Each run starts run_services in a fresh process with
+the embedding endpoint and reranker replaced by stubs with fixed delays, then polls /health and
+/ready on both apps.
+
+    python -m benchmarks.bench_ready [--embed-ms 300] [--rerank-ms 150] [--runs 3]
+
+"cold" starts with an empty BPH summary-index cache (first boot: embed every summary); "warm"
+reuses it (later boots: memory-map the cached build).
+"""
+import argparse
+import asyncio
+import functools
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from .common import ROOT
+
+# ------------------------------------------------------------------- #
+
+def child(args):
+    for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+        os.environ.setdefault(var, 'offline-benchmark')
+    os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+    import langchain_openai
+    from langchain_core.documents.compressor import BaseDocumentCompressor
+    from shared.embeddings import HashingEmbeddings
+    from shared.persisted_index import load_index
+    from .common import guideline_index_dir
+
+    class SlowEmbeddings(HashingEmbeddings):
+        def embed_documents(self, texts):
+            time.sleep(args.embed_ms / 1000)
+            return super().embed_documents(texts)
+
+        def embed_query(self, text):
+            time.sleep(args.embed_ms / 1000)
+            return super().embed_query(text)
+
+    class SlowReranker(BaseDocumentCompressor):
+        top_n: int
+
+        def compress_documents(self, documents, query, callbacks=None):
+            time.sleep(args.rerank_ms / 1000)
+            return list(documents)[:self.top_n]
+
+    docs_dir = guideline_index_dir(HashingEmbeddings())
+    langchain_openai.OpenAIEmbeddings = lambda model=None, **kwargs: SlowEmbeddings()
+
+    sys.path.insert(0, str(ROOT))
+    import run_services
+    import bph_backend.main_graph as bph
+    import all_guidelines_backend.main_graph as all_guidelines
+    stub_reranker = lambda kind, top_n, model, embeddings=None, vectors=None: SlowReranker(top_n=top_n)
+    bph.default_reranker = all_guidelines.default_reranker = stub_reranker
+    bph.MainGraph = functools.partial(bph.MainGraph, index_dir=Path(args.index_dir))
+    # the shipped docs_vector has no index.faiss; serve the benchmark's hashing build instead
+    all_guidelines.load_index = lambda path, embeddings: load_index(docs_dir, embeddings)
+
+    if args.child == "eager":
+        bph.get_main_graph()
+        all_guidelines.get_main_graph()
+    asyncio.run(run_services.run_servers(*args.ports))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure(mode: str, index_dir: Path, args) -> dict:
+    ports = [free_port(), free_port()]
+    command = [sys.executable, "-m", "benchmarks.bench_ready", "--child", mode, "--ports", *map(str, ports),
+               "--index-dir", str(index_dir), "--embed-ms", str(args.embed_ms), "--rerank-ms", str(args.rerank_ms)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    bound, ready, status = {}, {}, {}
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while len(ready) < len(ports):
+                if process.poll() is not None:
+                    raise RuntimeError(f"run_services exited with {process.returncode}")
+                if time.perf_counter() - start > args.timeout:
+                    raise TimeoutError("backends did not become ready")
+                for port in ports:
+                    if port in ready:
+                        continue
+                    try:
+                        response = client.get(f"http://127.0.0.1:{port}/ready")
+                    except httpx.TransportError:
+                        continue
+                    bound.setdefault(port, time.perf_counter() - start)
+                    if response.status_code == 200:
+                        ready[port] = time.perf_counter() - start
+                        status.update({k: v for k, v in response.json().items() if k != "ready"})
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return {"bound": max(bound.values()), "ready": max(ready.values()), "status": status}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-ms", type=float, default=300.0, help="latency of each embedding request")
+    parser.add_argument("--rerank-ms", type=float, default=150.0)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--child", choices=["eager", "lazy"], help=argparse.SUPPRESS)
+    parser.add_argument("--ports", type=int, nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--index-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    print(f"stub latencies: embed {args.embed_ms:.0f}ms, rerank {args.rerank_ms:.0f}ms; {args.runs} runs")
+    print(f"{'mode':<8}{'cache':<7}{'bound p50':>11}{'ready p50':>11}{'ready max':>11}")
+    for mode in ("eager", "lazy"):
+        for cache in ("cold", "warm"):
+            samples = []
+            for _ in range(args.runs):
+                index_dir = Path(tempfile.mkdtemp(prefix="bench-ready-"))
+                try:
+                    if cache == "warm":
+                        measure(mode, index_dir, args)
+                    samples.append(measure(mode, index_dir, args))
+                finally:
+                    shutil.rmtree(index_dir, ignore_errors=True)
+            print(f"{mode:<8}{cache:<7}{statistics.median(s['bound'] for s in samples):>9.2f}s"
+                  f"{statistics.median(s['ready'] for s in samples):>9.2f}s{max(s['ready'] for s in samples):>9.2f}s")
+            if mode == "lazy":
+                for name, status in samples[-1]["status"].items():
+                    steps = ", ".join(f"{k} {v:.2f}s" for k, v in status["steps"].items())
+                    print(f"{'':<15}{name}: load {status['load_s']:.2f}s ({steps})")
+
+
+if __name__ == "__main__":
+    main()
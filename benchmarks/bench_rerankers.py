@@ -0,0 +1,145 @@
+"""Local rerankers vs. Cohere: latency and recall@k on a recorded query set.
+
+Candidates for each query in fixtures/queries.json are drawn deterministically from the shipped
+corpora (BM25 top-n over the aua parent docs and the docs_vector docstore). Cohere's ordering of those
+candidates is recorded once, with network access:
+
+    COHERE_API_KEY=... python -m benchmarks.bench_rerankers --record
+
+after which the comparison runs offline:
+
+    python -m benchmarks.bench_rerankers [--reranker hybrid|cross-encoder] [--dense hashing]
+
+recall@k is the fraction of Cohere's top-k that the local reranker also puts in its top-k.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import statistics
+import time
+from pathlib import Path
+
+from shared.embeddings import HashingEmbeddings
+from shared.mapped_docstore import MappedDocstore
+from shared.rerankers import CrossEncoderReranker, HybridReranker
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+RECORDINGS = FIXTURES / "rerank_recordings.json"
+
+# (corpus, cohere model, candidates per query, top_n used by the backend)
+CORPORA = {
+    "bph": ("rerank-v3.5", 20, 7),
+    "all_guidelines": ("rerank-english-v3.0", 50, 10),
+}
+
+# ------------------------------------------------------------------- #
+
+def load_corpus(name: str):
+    if name == "bph":
+        return MappedDocstore(ROOT / "bph_backend" / "aua" / "parents").documents()
+    return MappedDocstore(ROOT / "all_guidelines_backend" / "docs_vector").documents()
+
+
+def content_key(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def candidate_sets() -> dict:
+    with open(FIXTURES / "queries.json") as file:
+        queries = json.load(file)
+    sets = {}
+    for corpus, (_, n_candidates, _) in CORPORA.items():
+        docs = load_corpus(corpus)
+        selector = HybridReranker(top_n=n_candidates)
+        sets[corpus] = [(q, selector.compress_documents(docs, q)) for q in queries[corpus]]
+    return sets
+
+
+def record(sets: dict):
+    import cohere
+    client = cohere.ClientV2()
+    recordings = []
+    for corpus, pairs in sets.items():
+        model, _, _ = CORPORA[corpus]
+        for query, docs in pairs:
+            start = time.perf_counter()
+            response = client.rerank(model=model, query=query, documents=[d.page_content for d in docs], top_n=len(docs))
+            recordings.append({
+                "corpus": corpus,
+                "query": query,
+                "candidates": [content_key(d.page_content) for d in docs],
+                "ranking": [r.index for r in response.results],
+                "latency_ms": (time.perf_counter() - start) * 1000,
+            })
+    with open(RECORDINGS, 'w') as file:
+        json.dump(recordings, file, indent=1)
+    print(f"recorded {len(recordings)} Cohere rankings to {RECORDINGS}")
+
+
+def recall_at_k(local: list[int], reference: list[int], k: int) -> float:
+    return len(set(local[:k]) & set(reference[:k])) / min(k, len(reference))
+
+
+async def compare(sets: dict, reranker, k_values: list[int]):
+    recordings = {}
+    if RECORDINGS.exists():
+        with open(RECORDINGS) as file:
+            recordings = {(r["corpus"], r["query"]): r for r in json.load(file)}
+    else:
+        print(f"no recordings at {RECORDINGS}; reporting local latency only (run with --record first)")
+
+    for corpus, pairs in sets.items():
+        _, _, top_n = CORPORA[corpus]
+        latencies, cohere_latencies, recalls = [], [], {k: [] for k in k_values}
+        for query, docs in pairs:
+            start = time.perf_counter()
+            ranked = (await reranker.arerank_many([(query, docs, len(docs))]))[0]
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            recording = recordings.get((corpus, query))
+            if recording is None or recording["candidates"] != [content_key(d.page_content) for d in docs]:
+                continue
+            positions = {d.page_content: i for i, d in enumerate(docs)}
+            local = [positions[d.page_content] for d in ranked]
+            cohere_latencies.append(recording["latency_ms"])
+            for k in k_values:
+                recalls[k].append(recall_at_k(local, recording["ranking"], k))
+
+        # one BPH chat request reranks the query plus each chosen treatment; a local reranker does it in one pass
+        batch = [(q, docs, top_n) for q, docs in pairs[:4]]
+        start = time.perf_counter()
+        await reranker.arerank_many(batch)
+        batched_ms = (time.perf_counter() - start) * 1000
+
+        print(f"\n[{corpus}] {len(pairs)} queries x {len(pairs[0][1])} candidates")
+        print(f"  local p50 {statistics.median(latencies):.1f}ms  p95 {sorted(latencies)[int(0.95 * (len(latencies) - 1))]:.1f}ms"
+              f"  | {len(batch)} lookups in one pass: {batched_ms:.1f}ms")
+        if cohere_latencies:
+            print(f"  cohere (recorded) p50 {statistics.median(cohere_latencies):.1f}ms  p95 {sorted(cohere_latencies)[int(0.95 * (len(cohere_latencies) - 1))]:.1f}ms")
+            print("  " + "  ".join(f"recall@{k} {statistics.mean(recalls[k]):.2f}" for k in k_values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="record Cohere rankings (needs COHERE_API_KEY)")
+    parser.add_argument("--reranker", choices=["hybrid", "cross-encoder"], default="hybrid")
+    parser.add_argument("--dense", choices=["none", "hashing"], default="none",
+                        help="dense half of the hybrid scorer; production uses the backend's cached OpenAI embeddings")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 10])
+    args = parser.parse_args()
+
+    sets = candidate_sets()
+    if args.record:
+        record(sets)
+        return
+    if args.reranker == "cross-encoder":
+        reranker = CrossEncoderReranker()
+    else:
+        reranker = HybridReranker(embeddings=HashingEmbeddings() if args.dense == "hashing" else None)
+    asyncio.run(compare(sets, reranker, args.k))
+
+
+if __name__ == "__main__":
+    main()
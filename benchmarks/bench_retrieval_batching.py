@@ -0,0 +1,119 @@
+"""Cross-request retrieval micro-batching (shared/batching.py) under concurrent load.
+
+N concurrent lookups run through the all-guidelines vector retriever: embed the query, then one
+faiss search over the shipped guideline pages. The embeddings endpoint is simulated: each call
+takes --embed-ms plus --embed-ms-per-text per input and holds one of the embeddings upstream
+budget's slots (shared/admission.py's UPSTREAM_MAX_CONCURRENT), as in production. Window 0 is
+the unbatched path.
+
+    python -m benchmarks.bench_retrieval_batching [--requests 256] [--window-ms 0 --window-ms 3]
+
+Also: faiss search time per query, one at a time vs. in one batched call.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+
+from shared.admission import UPSTREAM_MAX_CONCURRENT
+from shared.batching import BatchedEmbeddings, BatchedIndex
+from shared.embeddings import HashingEmbeddings
+
+from .common import guideline_index, load_queries, percentile
+
+# ------------------------------------------------------------------- #
+
+class SimulatedEmbeddings(HashingEmbeddings):
+    def __init__(self, args):
+        super().__init__()
+        self.base_ms = args.embed_ms
+        self.per_text_ms = args.embed_ms_per_text
+        self.budget = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENT["embeddings"] or 1 << 30)
+        self.calls = 0
+
+    async def aembed_documents(self, texts):
+        async with self.budget:
+            self.calls += 1
+            await asyncio.sleep((self.base_ms + self.per_text_ms * len(texts)) / 1000)
+            return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+async def load(vectorstore, index, window_ms: float, concurrency: int, queries: list[str], args) -> dict:
+    api = SimulatedEmbeddings(args)
+    embeddings, searched = api, index
+    if window_ms:
+        embeddings = BatchedEmbeddings(api, window_ms, args.max_batch)
+        searched = BatchedIndex(index, window_ms, args.max_batch)
+    vectorstore.embedding_function, vectorstore.index = embeddings, searched
+    retriever = vectorstore.as_retriever(search_kwargs={"k": args.k})
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(query):
+        async with gate:
+            start = time.perf_counter()
+            await retriever.ainvoke(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(q) for q in queries])
+    wall = time.perf_counter() - start
+    ms = [s * 1000 for s in latencies]
+    return {"per_s": len(queries) / wall, "p50": statistics.median(ms), "p95": percentile(ms, 0.95), "api_calls": api.calls,
+            "embed_batch": embeddings.metrics()["mean_batch"] if window_ms else 1.0,
+            "search_batch": searched.metrics()["mean_batch"] if window_ms else 1.0}
+
+
+def search_cost(index, vectors: np.ndarray, k: int) -> tuple[float, float]:
+    """Milliseconds per query: one search per vector vs. one search for all of them."""
+    start = time.perf_counter()
+    for i in range(len(vectors)):
+        index.search(vectors[i:i + 1], k)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    index.search(vectors, k)
+    batched = time.perf_counter() - start
+    return single / len(vectors) * 1000, batched / len(vectors) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, action="append", help="concurrent lookups (repeatable; default 1, 16, 64)")
+    parser.add_argument("--window-ms", type=float, action="append", help="batching windows (repeatable; default 0, 2, 5)")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--embed-ms", type=float, default=120.0, help="simulated embeddings call latency")
+    parser.add_argument("--embed-ms-per-text", type=float, default=1.0)
+    parser.add_argument("--k", type=int, default=50)
+    args = parser.parse_args()
+    concurrency = args.concurrency or [1, 16, 64]
+    windows = args.window_ms or [0.0, 2.0, 5.0]
+
+    embeddings = HashingEmbeddings()
+    vectorstore = guideline_index(embeddings)
+    index = vectorstore.index
+    corpus = load_queries()["all_guidelines"]
+    # distinct texts, so batches cannot shrink by deduplication
+    queries = [f"{corpus[i % len(corpus)]} ({i})" for i in range(args.requests)]
+
+    print(f"{index.ntotal} vectors, k={args.k}; simulated embeddings: {args.embed_ms:.0f}ms + {args.embed_ms_per_text:.1f}ms/text, "
+          f"{UPSTREAM_MAX_CONCURRENT['embeddings']} concurrent calls; {args.requests} lookups")
+    print(f"{'streams':>8}{'window':>8}{'lookups/s':>11}{'p50':>9}{'p95':>9}{'API calls':>11}{'embed batch':>13}{'search batch':>14}")
+    for streams in concurrency:
+        for window in windows:
+            r = asyncio.run(load(vectorstore, index, window, streams, queries, args))
+            print(f"{streams:>8}{window:>6.0f}ms{r['per_s']:>11.1f}{r['p50']:>7.0f}ms{r['p95']:>7.0f}ms"
+                  f"{r['api_calls']:>11}{r['embed_batch']:>13.1f}{r['search_batch']:>14.1f}")
+
+    vectors = np.asarray(embeddings.embed_documents(queries[:64]), dtype=np.float32)
+    single, batched = search_cost(index, vectors, args.k)
+    print(f"\nfaiss search, 64 queries: {single:.3f}ms/query one by one, {batched:.3f}ms/query batched")
+
+
+if __name__ == "__main__":
+    main()
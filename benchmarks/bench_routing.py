@@ -0,0 +1,96 @@
+"""Global vs. title-routed two-stage candidate retrieval on the all_guidelines corpus.
+
+Routed retrieval picks the top-m guidelines (chunk centroids plus linked `titles_vector` entries)
+and searches only their chunks, handing fewer candidates to the reranker; queries whose best
+guideline scores below --min-score fall back to global search. For every labelled query in
+fixtures/queries.json it reports routing accuracy, the share of queries routed, context recall
+(hit@k: a relevant guideline is among the candidates; precision: share of candidates from one)
+and retrieval latency.
+
+    python -m benchmarks.bench_routing [--embeddings hashing|openai] [--top-m 2 3 5] [--min-score 0.15]
+
+Hashing embeddings score lower than text-embedding-3-large, hence the lower default --min-score
+(the backend's ROUTE_MIN_SCORE is set for OpenAI embeddings).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from shared.embeddings import get_embeddings
+from shared.retrieval_cache import CachedEmbeddings
+from shared.routing import GuidelineRouter, RoutedRetriever
+from shared.sparse_index import FusedRetriever, SparseIndex
+
+from .common import guideline_index, load_queries, percentile
+
+# ------------------------------------------------------------------- #
+
+async def evaluate(retriever, relevant: dict[str, list[str]]) -> dict:
+    hits, precision, latencies, sizes = [], [], [], []
+    for query, sources in relevant.items():
+        start = time.perf_counter()
+        docs = await retriever.ainvoke(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        matching = [d for d in docs if d.metadata.get("source") in sources]
+        hits.append(bool(matching))
+        precision.append(len(matching) / max(len(docs), 1))
+        sizes.append(len(docs))
+    return {
+        "hit": statistics.mean(hits),
+        "precision": statistics.mean(precision),
+        "candidates": statistics.mean(sizes),
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+    }
+
+
+def row(name: str, r: dict, routed: str = "-"):
+    print(f"{name:<22}{routed:>8}{r['candidates']:>6.0f}{r['hit']:>7.2f}{r['precision']:>11.2f}{r['p50']:>8.2f}ms{r['p95']:>7.2f}ms")
+
+
+async def run(args):
+    embeddings = CachedEmbeddings(get_embeddings(args.embeddings, "text-embedding-3-large"))
+    docs, titles = guideline_index(embeddings), guideline_index(embeddings, "titles")
+    sparse = SparseIndex.from_vectorstore(docs)
+    start = time.perf_counter()
+    router = GuidelineRouter(docs, titles)
+    build_ms = (time.perf_counter() - start) * 1000
+    relevant = load_queries()["all_guidelines_relevant_sources"]
+    vectors = dict(zip(relevant, await embeddings.aembed_documents(list(relevant))))
+
+    print(f"{len(relevant)} labelled queries, {len(router.sources)} guidelines, "
+          f"{len(router.title_sources)}/{titles.index.ntotal} titles linked, router built in {build_ms:.0f}ms")
+    for m in args.top_m:
+        correct = [any(s in sources for s, _ in router.route(vectors[q], m)) for q, sources in relevant.items()]
+        print(f"  routing accuracy (relevant guideline in top-{m}): {statistics.mean(correct):.2f}")
+
+    print(f"\n{'retriever':<22}{'routed':>8}{'k':>6}{'hit@k':>7}{'precision':>11}{'p50':>10}{'p95':>9}")
+    global_dense = docs.as_retriever(search_kwargs={"k": 50})
+    global_hybrid = FusedRetriever(vectorstore=docs, sparse=sparse, k=25)
+    row("global dense", await evaluate(global_dense, relevant))
+    row("global hybrid", await evaluate(global_hybrid, relevant))
+    for m in args.top_m:
+        for mode, fallback, routed_sparse in (("dense", global_dense, None), ("hybrid", global_hybrid, sparse)):
+            retriever = RoutedRetriever(
+                router=router,
+                retriever=FusedRetriever(vectorstore=docs, sparse=routed_sparse, k=args.k),
+                fallback=fallback,
+                top_m=m,
+                min_score=args.min_score,
+            )
+            r = await evaluate(retriever, relevant)
+            row(f"routed {mode} m={m}", r, f"{retriever.routed}/{len(relevant)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", choices=["hashing", "openai"], default="hashing")
+    parser.add_argument("--top-m", type=int, nargs="+", default=[2, 3, 5])
+    parser.add_argument("--k", type=int, default=15, help="candidates per routed query")
+    parser.add_argument("--min-score", type=float, default=0.15)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
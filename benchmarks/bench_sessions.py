@@ -0,0 +1,113 @@
+"""Multi-turn conversations, stateless vs. server-side sessions (shared/sessions.py).
+
+Each app runs as in benchmarks/suite.py: the real MainGraph behind its server's run_graph, with
+offline upstream fakes at fixed latencies. The conversations of fixtures/conversations.json (a first
+question, follow-ups leaning on it, and some changes of subject) are played --rounds times by
+--concurrency clients, each turn sending the last exchange as the frontend does. Follow-ups are
+rewritten into the self-contained query the fixture lists, standing in for the rewrite LLM.
+
+    python -m benchmarks.bench_sessions [--app bph] [--concurrency 8] [--rounds 3] [--min-similarity 0.45]
+
+Reported per app and turn: time to first token and end-to-end latency (p50), stateless vs. with a
+session_id; then the share of follow-ups that reranked the previous turn's candidates instead of
+searching, and the size of a stored session. Each mode starts from a freshly built graph.
+The offline HashingEmbeddings score paraphrases lower than text-embedding-3-large, hence a lower
+--min-similarity than SESSION_REUSE_MIN_SIMILARITY.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from .common import FIXTURES, percentile
+from .fakes import Fixtures, Latency
+from .suite import APPS, UPSTREAM_FIXTURES, App
+
+CONVERSATIONS = FIXTURES / "conversations.json"
+
+# ------------------------------------------------------------------- #
+
+def fixture_rewrites(conversations: list[list[dict]]):
+    rewrites = {turn["query"]: turn["rewrite"] for conversation in conversations for turn in conversation if "rewrite" in turn}
+
+    def rewrite(messages) -> str:
+        query = next(m.content for m in messages if m.type == "human")
+        return rewrites.get(query, query)
+    return rewrite
+
+
+async def converse(app: App, conversation: list[dict], session_id) -> list[tuple[float, float]]:
+    samples, last_response = [], ""
+    for turn in conversation:
+        start = time.perf_counter()
+        first, text = None, []
+        messages = [{"role": "ai", "content": last_response}, {"role": "human", "content": turn["query"]}]
+        async for event in app.server.run_graph(messages, session_id):
+            if first is None:
+                first = time.perf_counter() - start
+            text.append(event["text"])
+        samples.append((first if first is not None else float("nan"), time.perf_counter() - start))
+        last_response = "".join(text)
+    return samples
+
+
+async def play(app: App, conversations: list[list[dict]], args, sessions: bool) -> list[list[tuple]]:
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def one(i, conversation):
+        async with gate:
+            return await converse(app, conversation, f"bench-{i}" if sessions else None)
+    return await asyncio.gather(*[one(i, c) for i, c in enumerate(conversations * args.rounds)])
+
+
+def run_app(name: str, args) -> None:
+    app = App(name, Fixtures(UPSTREAM_FIXTURES), Latency(args.llm_ms, 5.0, args.embed_ms, args.rerank_ms), args.tokens)
+    with open(CONVERSATIONS) as file:
+        conversations = json.load(file)[name]
+    app.constants.QUERY_FROM_HISTORY_LLM.synthesize = fixture_rewrites(conversations)
+    try:
+        results = {}
+        for mode in ("stateless", "session"):
+            graph = app.build()
+            graph.reuse.min_similarity = args.min_similarity
+            results[mode] = asyncio.run(play(app, conversations, args, mode == "session"))
+        store = graph.sessions
+        stored = sum(len(value[1]) for value in store.blobs.values() if value[0] != "empty")
+
+        print(f"\n[{name}] {len(conversations) * args.rounds} conversations of {len(conversations[0])} turns, {args.concurrency} at a time")
+        print(f"  {'turn':<6}{'stateless TTFT':>15}{'e2e':>8}{'session TTFT':>15}{'e2e':>8}{'TTFT change':>13}")
+        for turn in range(len(conversations[0])):
+            row = []
+            for mode in ("stateless", "session"):
+                ttft = [c[turn][0] * 1000 for c in results[mode]]
+                e2e = [c[turn][1] * 1000 for c in results[mode]]
+                row.append((statistics.median(ttft), statistics.median(e2e)))
+            (s_ttft, s_e2e), (c_ttft, c_e2e) = row
+            print(f"  {turn + 1:<6}{s_ttft:>13.0f}ms{s_e2e:>6.0f}ms{c_ttft:>13.0f}ms{c_e2e:>6.0f}ms{(c_ttft - s_ttft) / s_ttft:>+13.0%}")
+        follow_ups = {mode: [t[0] * 1000 for c in results[mode] for t in c[1:]] for mode in results}
+        print(f"  follow-ups TTFT p50/p95: stateless {statistics.median(follow_ups['stateless']):.0f}/{percentile(follow_ups['stateless'], 0.95):.0f}ms, "
+              f"session {statistics.median(follow_ups['session']):.0f}/{percentile(follow_ups['session'], 0.95):.0f}ms")
+        print(f"  reuse: {json.dumps(graph.reuse.metrics())} at min similarity {args.min_similarity}")
+        print(f"  store: {json.dumps(store.metrics())}, {stored / max(len(store._used), 1) / 1024:.0f}KB per session")
+    finally:
+        app.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, action="append")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3, help="times each conversation is played per mode")
+    parser.add_argument("--min-similarity", type=float, default=0.45)
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--llm-ms", type=float, default=300.0)
+    parser.add_argument("--embed-ms", type=float, default=80.0)
+    parser.add_argument("--rerank-ms", type=float, default=150.0)
+    args = parser.parse_args()
+    for name in args.app or APPS:
+        run_app(name, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cold vs. warm start of the BPH summary-doc index.
+
+Runs offline: the embedding endpoint is replaced by a deterministic fake with a per-call delay,
+so "cold" approximates a first boot (embed everything) and "warm" a restart (mmap the cached build).
+
+    python -m benchmarks.bench_startup --latency-ms 400 --repeats 5
+"""
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from shared.mapped_docstore import DOCS_FILE, MappedDocstore
+from shared.persisted_index import fingerprint, load_or_build_index
+
+SUMMARY_DOCS = Path(__file__).resolve().parent.parent / "bph_backend" / "aua" / "summaries"
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    latency_ms: float = 0.0
+    batch_size: int = 1000  # mirrors OpenAIEmbeddings.chunk_size
+
+    def embed_documents(self, texts):
+        for _ in range(0, len(texts), self.batch_size):
+            time.sleep(self.latency_ms / 1000)
+        return super().embed_documents(texts)
+
+
+def load_docs():
+    return MappedDocstore(SUMMARY_DOCS).documents()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="simulated embedding round-trip")
+    parser.add_argument("--dims", type=int, default=3072)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    embeddings = SlowFakeEmbedding(size=args.dims, latency_ms=args.latency_ms)
+    key = fingerprint([SUMMARY_DOCS / DOCS_FILE], f"fake-{args.dims}")
+
+    rebuild, cold, warm = [], [], []
+    cache_dir = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+    try:
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            FAISS.from_documents(load_docs(), embeddings)
+            rebuild.append(time.perf_counter() - start)
+
+            shutil.rmtree(cache_dir / key, ignore_errors=True)
+            start = time.perf_counter()
+            load_or_build_index(cache_dir, key, load_docs, embeddings)
+            cold.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            load_or_build_index(cache_dir, key, load_docs, embeddings)
+            warm.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"summary docs: {len(load_docs())}, dims: {args.dims}, embedding latency: {args.latency_ms:.0f}ms")
+    for label, samples in [("re-embed every boot (old)", rebuild), ("cold build + persist", cold), ("warm mmap load", warm)]:
+        print(f"{label:<28} median {statistics.median(samples) * 1000:8.1f}ms   max {max(samples) * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Cost of pulling the respond tokens out of the BPH graph: astream_events vs. stream_mode="messages".
+
+The graph runs end to end with zero-latency stubs for every upstream (the stubs from
+bench_graph_modes), so what is left is the work of running the graph and of producing and filtering
+its stream. Each run streams one answer of --tokens tokens.
+
+    python -m benchmarks.bench_stream_events [--runs 32] [--tokens 300] [--concurrency 8]
+
+"astream_events" is run_graph as it was; "messages" is bph_backend/server.py's run_graph.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.output_parsers import StrOutputParser
+
+import bph_backend.main_graph as main_graph
+import bph_backend.server as server
+from bph_backend.response import prompt as response_prompt
+from shared.response_cache import replay_chunks
+
+from .bench_graph_modes import SCENARIOS, SlowEmbeddings, SlowReranker, StubChatModel, stub_chains
+
+# ------------------------------------------------------------------- #
+
+class Counted(object):
+    def __init__(self):
+        self.events = 0
+
+
+async def legacy_run_graph(graph, input, counted: Counted):
+    async for event in graph.astream_events({"messages": input}, version="v2"):
+        counted.events += 1
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            node = event["metadata"]["langgraph_node"]
+            if content and node == "respond":
+                id = event["run_id"]
+                yield {"id": id, "text": content, "type": "text"}
+        elif kind == "on_custom_event" and event["name"] == "cached_response":
+            id = event["run_id"]
+            for content in replay_chunks(event["data"]["text"]):
+                yield {"id": id, "text": content, "type": "text"}
+
+
+def counting(graph, counted: Counted):
+    """The compiled graph, with every item its astream yields counted."""
+    class Graph(object):
+        def astream(self, *args, **kwargs):
+            async def stream():
+                async for item in graph.astream(*args, **kwargs):
+                    counted.events += 1
+                    yield item
+            return stream()
+    return Graph()
+
+
+async def measure(label: str, g, messages, args) -> dict:
+    counted = Counted()
+    chunks = 0
+    if label == "messages":
+        server.corpus.install(argparse.Namespace(graph=counting(g.graph, counted), session_graph=None, turn_input=g.turn_input))
+
+    async def one():
+        nonlocal chunks
+        events = legacy_run_graph(g.graph, messages, counted) if label == "astream_events" else server.run_graph(messages)
+        async for _ in events:
+            chunks += 1
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(args.runs // args.concurrency):
+        await asyncio.gather(*[one() for _ in range(args.concurrency)])
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    runs = args.runs // args.concurrency * args.concurrency
+    return {"events": counted.events / runs, "chunks": chunks / runs, "events_per_s": counted.events / wall,
+            "cpu_ms": cpu / runs * 1000, "wall_ms": wall / runs * 1000}
+
+
+async def run(args):
+    stub_chains(0)
+    answer = " ".join(f"tok{i}" for i in range(args.tokens))
+    respond = response_prompt | StubChatModel(text=answer, first_token_ms=0, token_ms=0) | StrOutputParser()
+    main_graph.response_chains = {"big": respond, "small": respond}
+    main_graph.RESPONSE_CACHE_BACKEND = None
+
+    index_dir = Path(tempfile.mkdtemp(prefix="bench-stream-events-"))
+    try:
+        g = main_graph.MainGraph(mode="sequential", embeddings=SlowEmbeddings(0),
+                                 make_reranker=lambda top_n: SlowReranker(top_n=top_n, latency_ms=0), index_dir=index_dir)
+        messages = SCENARIOS["first turn"]
+        # warm up imports, caches and the graph's first compile-time work
+        for label in ("astream_events", "messages"):
+            await measure(label, g, messages, argparse.Namespace(runs=2, concurrency=1))
+
+        print(f"{args.runs} runs, {args.concurrency} at a time; {args.tokens}-token answers, zero-latency stubs")
+        print(f"{'run_graph':<16}{'events/answer':>15}{'chunks':>8}{'events/s':>10}{'CPU/answer':>12}{'wall/answer':>13}")
+        for label in ("astream_events", "messages"):
+            r = await measure(label, g, messages, args)
+            print(f"{label:<16}{r['events']:>15.0f}{r['chunks']:>8.0f}{r['events_per_s']:>10.0f}"
+                  f"{r['cpu_ms']:>10.1f}ms{r['wall_ms']:>11.1f}ms")
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Streaming /chat: tokens generated after the client disconnects, and frames per answer with batching.
+
+run_services.bph_app is served by uvicorn on a local port with the graph replaced by a stub that
+behaves like `astream_events` over a streaming LLM: the run happens in a background task that
+pushes tokens into an unbounded buffer, after --think-ms of retrieval. Clients are real HTTP
+connections that hang up either mid-answer or while the graph is still retrieving.
+
+    python -m benchmarks.bench_streaming [--token-ms 20] [--tokens 400] [--think-ms 1500]
+
+"before" streams the graph events straight into the response as the handlers used to; "after"
+frames them through shared/streaming.py, which cancels the run when the client goes away.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+import httpx
+import uvicorn
+
+import run_services
+from shared.readiness import Component
+from shared.streaming import framed
+
+BODY = {"messages": [{"role": "human", "content": [{"type": "text", "text": "What are my options for an enlarged prostate?"}]}]}
+
+# ------------------------------------------------------------------- #
+
+class StubRun(object):
+    """Token timestamps of the one run in flight."""
+
+    def __init__(self):
+        self.generated: list[float] = []
+        self.finished = threading.Event()
+
+
+def stub_graph(run: StubRun, args):
+    async def run_graph(payload, session_id=None):
+        buffer: asyncio.Queue = asyncio.Queue()
+
+        async def model():
+            try:
+                await asyncio.sleep(args.think_ms / 1000)
+                for i in range(args.tokens):
+                    await asyncio.sleep(args.token_ms / 1000)
+                    run.generated.append(time.perf_counter())
+                    await buffer.put(f"tok{i} ")
+                await buffer.put(None)
+            finally:
+                run.finished.set()
+
+        # like astream_events: the run is a task of its own, cancelled when this generator is
+        task = asyncio.create_task(model())
+        try:
+            while (token := await buffer.get()) is not None:
+                yield {"id": "run", "text": token, "type": "text"}
+        finally:
+            task.cancel()
+    return run_graph
+
+
+async def legacy_framed(events, format, *args, **kwargs):
+    async for event in events:
+        yield json.dumps(event)
+
+
+def reports_asgi_24(app):
+    """Servers speaking ASGI 2.4 (and Starlette under them) only notice a disconnect on a failed write."""
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "asgi": {**scope.get("asgi", {}), "spec_version": "2.4"}}
+        await app(scope, receive, send)
+    return wrapped
+
+
+class Server(object):
+    def __init__(self, app):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                                    log_level="warning", lifespan="off"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+
+def hang_up(port: int, after_frames: int, format: str) -> float:
+    """Read `after_frames` chunks (0: just the headers), drop the connection, return when."""
+    with httpx.Client(timeout=None) as client:
+        with client.stream("POST", f"http://127.0.0.1:{port}/chat", params={"format": format}, json=BODY) as response:
+            if after_frames:
+                for i, _ in enumerate(response.iter_raw()):
+                    if i + 1 >= after_frames:
+                        break
+            else:
+                time.sleep(0.2)
+            return time.perf_counter()
+
+
+def full(port: int, format: str) -> dict:
+    start = time.perf_counter()
+    body, first = b"", None
+    with httpx.Client(timeout=None) as client:
+        with client.stream("POST", f"http://127.0.0.1:{port}/chat", params={"format": format}, json=BODY) as response:
+            for chunk in response.iter_raw():
+                first = first or time.perf_counter() - start
+                body += chunk
+    frames = {"sse": body.count(b"\n\n"), "ndjson": body.count(b"\n"), "raw": body.count(b'{"id"')}[format]
+    return {"frames": frames, "bytes": len(body), "first": first, "total": time.perf_counter() - start}
+
+
+def wasted(port: int, args, after_frames: int) -> tuple[int, float]:
+    run = StubRun()
+    run_services.run_graph_bph = stub_graph(run, args)
+    disconnected = hang_up(port, after_frames, "sse")
+    stopped = run.finished.wait(timeout=(args.think_ms + args.tokens * args.token_ms) / 1000 + 5)
+    tokens = sum(1 for t in run.generated if t > disconnected)
+    return tokens, (run.generated[-1] - disconnected if run.generated and stopped else float("nan"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--think-ms", type=float, default=1500.0)
+    args = parser.parse_args()
+
+    print(f"stub answer: {args.tokens} tokens, one per {args.token_ms:.0f}ms after {args.think_ms:.0f}ms of retrieval\n")
+    run_services.bph_backend = Component("bph", lambda timings: None)
+    servers = {"ASGI 2.3": Server(run_services.bph_app), "ASGI 2.4": Server(reports_asgi_24(run_services.bph_app))}
+    server = servers["ASGI 2.3"]
+    rows = []
+    for spec, spec_server in servers.items():
+        for label, framer in (("before", legacy_framed), ("after", framed)):
+            run_services.framed = framer
+            for scenario, after_frames in (("mid-answer", 20), ("during retrieval", 0)):
+                tokens, tail = wasted(spec_server.port, args, after_frames)
+                rows.append((spec, label, scenario, tokens, tail))
+
+    run_services.framed = framed
+    flush_rows = []
+    fast = argparse.Namespace(**{**vars(args), "think_ms": 0.0, "token_ms": 5.0})
+    for format, flush_ms in (("raw", None), ("sse", 0), ("sse", 40), ("ndjson", 40)):
+        if flush_ms is not None:
+            run_services.bph_constants.STREAM_FLUSH_MS = flush_ms
+        run_services.run_graph_bph = stub_graph(StubRun(), fast)
+        flush_rows.append((format, flush_ms, full(server.port, format)))
+    for s in servers.values():
+        s.server.should_exit = True
+
+    print(f"{'server':<10}{'handler':<8}{'client hangs up':<19}{'tokens after disconnect':>25}{'run stopped':>14}")
+    for spec, label, scenario, tokens, tail in rows:
+        stopped = "before 1st" if tail != tail else f"+{max(tail, 0) * 1000:.0f}ms"
+        print(f"{spec:<10}{label:<8}{scenario:<19}{tokens:>16}/{args.tokens:<8}{stopped:>14}")
+    print(f"\nfull answers at one token per 5ms:\n{'format':<8}{'flush':>7}{'frames':>8}{'bytes':>8}{'first frame':>13}{'last':>8}")
+    for format, flush_ms, r in flush_rows:
+        print(f"{format:<8}{'-' if flush_ms is None else f'{flush_ms}ms':>7}{r['frames']:>8}{r['bytes']:>8}"
+              f"{r['first'] * 1000:>11.0f}ms{r['total'] * 1000:>6.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
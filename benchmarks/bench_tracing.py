@@ -0,0 +1,114 @@
+"""Overhead of per-request tracing (shared/tracing.py) on bph_backend/server.py's run_graph.
+
+The BPH graph runs end to end with zero-latency stubs for every upstream (as in
+bench_stream_events), so the CPU per answer is the graph's own work plus, for sampled requests,
+recording the node, retriever, LLM, embedding, search and rerank spans.
+
+    python -m benchmarks.bench_tracing [--runs 192] [--tokens 300] [--concurrency 8] [--rate 0 --rate 1]
+
+After the table, one sampled request's JSON log line and an excerpt of GET /metrics?format=prometheus.
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from langchain_core.output_parsers import StrOutputParser
+
+import bph_backend.main_graph as main_graph
+import bph_backend.server as server
+from bph_backend.response import prompt as response_prompt
+from shared import tracing
+
+from .bench_graph_modes import SCENARIOS, SlowEmbeddings, SlowReranker, StubChatModel, stub_chains
+
+# ------------------------------------------------------------------- #
+
+async def measure(rate: float, messages, args) -> dict:
+    server.TRACE_SAMPLE_RATE = rate
+    traced_before = sum(tracing.TRACED_REQUESTS._series.values())
+
+    async def one():
+        async for _ in server.run_graph(messages):
+            pass
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(args.runs // args.concurrency):
+        await asyncio.gather(*[one() for _ in range(args.concurrency)])
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    runs = args.runs // args.concurrency * args.concurrency
+    return {"traced": (sum(tracing.TRACED_REQUESTS._series.values()) - traced_before) / runs,
+            "cpu_ms": cpu / runs * 1000, "wall_ms": wall / runs * 1000}
+
+
+async def sample_log(messages) -> str:
+    """The JSON line logged for one traced request."""
+    server.TRACE_SAMPLE_RATE, server.TRACE_JSON_LOG = 1.0, True
+    stream = io.StringIO()
+    # log_json keeps a handler that is already there
+    tracing.logger.addHandler(logging.StreamHandler(stream))
+    tracing.logger.setLevel(logging.INFO)
+    tracing.logger.propagate = False
+    async for _ in server.run_graph(messages):
+        pass
+    server.TRACE_JSON_LOG = False
+    return stream.getvalue().strip().splitlines()[-1]
+
+
+async def run(args):
+    stub_chains(0)
+    answer = " ".join(f"tok{i}" for i in range(args.tokens))
+    respond = response_prompt | StubChatModel(text=answer, first_token_ms=0, token_ms=0) | StrOutputParser()
+    main_graph.response_chains = {"big": respond, "small": respond}
+    main_graph.RESPONSE_CACHE_BACKEND = None
+
+    index_dir = Path(tempfile.mkdtemp(prefix="bench-tracing-"))
+    try:
+        g = main_graph.MainGraph(mode="sequential", embeddings=SlowEmbeddings(0),
+                                 make_reranker=lambda top_n: SlowReranker(top_n=top_n, latency_ms=0), index_dir=index_dir)
+        server.corpus.install(g)
+        messages = SCENARIOS["first turn"]
+        for rate in args.rate:
+            await measure(rate, messages, argparse.Namespace(runs=4, concurrency=1))
+
+        print(f"{args.runs} runs, {args.concurrency} at a time; {args.tokens}-token answers, zero-latency stubs")
+        print(f"{'sample rate':<13}{'traced':>8}{'CPU/answer':>12}{'wall/answer':>13}{'CPU vs first':>14}")
+        baseline = None
+        for rate in args.rate:
+            r = await measure(rate, messages, args)
+            baseline = baseline or r["cpu_ms"]
+            print(f"{rate:<13g}{r['traced']:>8.0%}{r['cpu_ms']:>10.2f}ms{r['wall_ms']:>11.2f}ms"
+                  f"{(r['cpu_ms'] / baseline - 1):>+14.1%}")
+
+        print("\nJSON log line of a traced request:")
+        print(await sample_log(messages))
+        print("\nGET /metrics?format=prometheus (excerpt):")
+        for line in tracing.render_prometheus({"bph": {}}).splitlines():
+            if "_count" in line or "tli_llm_tokens_total{" in line or "tli_traced_requests_total{" in line:
+                print(line)
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=192)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, action="append", help="sample rates to compare (repeatable)")
+    args = parser.parse_args()
+    args.rate = args.rate or [0.0, 0.1, 1.0]
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
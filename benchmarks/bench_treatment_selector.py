@@ -0,0 +1,113 @@
+"""Local treatment selector (bph_backend/treatment_selector.py) vs. the choose_tx LLM call.
+
+Runs the held-out queries of fixtures/treatment_queries.json through the selector: the share it
+decides locally, its latency, and how often its choice matches the reference. The reference is the
+fixture's labels (the prompt's algorithm applied by hand) and, once recorded, the LLM's own answers:
+
+    OPENAI_API_KEY=... python -m benchmarks.bench_treatment_selector --record
+
+after which the comparison runs offline:
+
+    python -m benchmarks.bench_treatment_selector [--embeddings hashing|openai] [--min-confidence 0.7]
+
+Agreement is an exact match of the two sets, with the prompt's two Urolift names taken as one;
+the LLM may also name drugs, which the local selector never does, so those are left out.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY', 'OPENAI_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from bph_backend.constants import CHOOSE_TX_MIN_CONFIDENCE, LARGE_EMBD
+from bph_backend.choose_tx import TREATMENT_ALIASES, TREATMENT_OPTIONS, choose_tx_chain
+from bph_backend.treatment_selector import load_treatment_selector
+from shared.embeddings import get_embeddings
+
+from .common import FIXTURES, percentile
+
+QUERIES = FIXTURES / "treatment_queries.json"
+RECORDINGS = FIXTURES / "choose_tx_recordings.json"
+
+# ------------------------------------------------------------------- #
+
+def options(treatments) -> frozenset:
+    return frozenset(TREATMENT_ALIASES.get(t, t) for t in treatments if t in TREATMENT_OPTIONS)
+
+
+async def record(queries: list[dict]):
+    recordings = []
+    for q in queries:
+        start = time.perf_counter()
+        answer = await choose_tx_chain.ainvoke({"query": q["query"]})
+        recordings.append({"query": q["query"], "treatments": answer["treatments_to_discuss"],
+                           "latency_ms": (time.perf_counter() - start) * 1000})
+    with open(RECORDINGS, 'w') as file:
+        json.dump(recordings, file, indent=1)
+    print(f"recorded {len(recordings)} choose_tx answers to {RECORDINGS}")
+
+
+def agreement(decided: list[tuple[dict, list]], reference) -> str:
+    pairs = [(reference(q), local) for q, local in decided]
+    pairs = [(ref, local) for ref, local in pairs if ref is not None]
+    if not pairs:
+        return "n/a"
+    return f"{sum(options(ref) == options(local) for ref, local in pairs) / len(pairs):.2f} of {len(pairs)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="record the LLM selector's answers (needs OPENAI_API_KEY)")
+    parser.add_argument("--embeddings", choices=["hashing", "openai"], default="hashing")
+    parser.add_argument("--min-confidence", type=float, default=CHOOSE_TX_MIN_CONFIDENCE)
+    parser.add_argument("--llm-ms", type=float, default=900.0, help="LLM selector latency when none is recorded")
+    args = parser.parse_args()
+
+    with open(QUERIES) as file:
+        queries = json.load(file)["queries"]
+    if args.record:
+        asyncio.run(record(queries))
+        return
+
+    embeddings = get_embeddings(args.embeddings, LARGE_EMBD)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        selector = load_treatment_selector(cache_dir, embeddings, args.min_confidence)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        decided, deferred, latencies = [], [], []
+        for q in queries:
+            start = time.perf_counter()
+            treatments, reason = selector.select(q["query"], embeddings.embed_query(q["query"]))
+            latencies.append((time.perf_counter() - start) * 1000)
+            (deferred if treatments is None else decided).append((q, treatments if treatments is not None else reason))
+
+    recordings = {}
+    if RECORDINGS.exists():
+        with open(RECORDINGS) as file:
+            recordings = {r["query"]: r for r in json.load(file)}
+    llm_ms = statistics.median(r["latency_ms"] for r in recordings.values()) if recordings else args.llm_ms
+    share = len(decided) / len(queries)
+
+    print(f"{len(queries)} queries, {args.embeddings} embeddings, min confidence {args.min_confidence}; selector trained in {load_ms:.0f}ms")
+    print(f"decided locally  {len(decided)} ({share:.0%}); deferred to the LLM: "
+          + ", ".join(f"{reason} {sum(r == reason for _, r in deferred)}" for reason in sorted({r for _, r in deferred})))
+    print(f"local latency    p50 {statistics.median(latencies):.2f}ms  p95 {percentile(latencies, 0.95):.2f}ms (embedding + classifier + rules)")
+    print(f"LLM latency      p50 {llm_ms:.0f}ms ({'recorded' if recordings else 'assumed, --llm-ms'})")
+    print(f"expected         {statistics.median(latencies) + (1 - share) * llm_ms:.0f}ms per request vs. {llm_ms:.0f}ms always calling the LLM")
+    print(f"agreement with the labels           {agreement(decided, lambda q: q['treatments'])}")
+    print(f"labels the LLM should decide, decided locally: {sum(q['treatments'] is None for q, _ in decided)}")
+    if recordings:
+        print(f"agreement with the recorded LLM     {agreement(decided, lambda q: recordings.get(q['query'], {}).get('treatments'))}")
+    else:
+        print(f"no recordings at {RECORDINGS}; run with --record to compare with the LLM itself")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Upstream connections and calls: one client per SDK object vs. the shared pool, with and without single-flight.
+
+A local stub serves the OpenAI embeddings and Cohere rerank endpoints. Each simulated chat request
+embeds its query and reranks a fixed candidate list, through the real SDK clients. Queries come
+from a small pool, so concurrent requests often ask the same thing (popular questions, the BPH
+treatment queries). The first request on every new connection waits --handshake-ms to stand in for
+the TCP + TLS setup a hosted API costs.
+
+    python -m benchmarks.bench_upstream_clients [--users 24] [--rounds 5] [--instances 9]
+
+"per-object": every OpenAIEmbeddings / CohereRerank keeps its own client and pool, as each
+constants.py and MainGraph used to; requests spread over --instances of them.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import threading
+import time
+
+import cohere
+import uvicorn
+from fastapi import FastAPI, Request
+from langchain_openai import OpenAIEmbeddings
+
+from shared.admission import UpstreamBudget
+from shared.upstream import UpstreamClients
+
+from .common import load_queries, percentile
+
+CANDIDATES = [f"candidate passage {i} about benign prostatic hyperplasia treatment" for i in range(25)]
+
+# ------------------------------------------------------------------- #
+
+class StubServer(object):
+    def __init__(self, latency_ms: float, handshake_ms: float):
+        self.latency_ms = latency_ms
+        self.handshake_ms = handshake_ms
+        self.connections: set = set()
+        self.calls = {"embeddings": 0, "rerank": 0}
+        app = FastAPI()
+
+        async def serve(request: Request, kind: str):
+            if request.client not in self.connections:
+                self.connections.add(request.client)
+                await asyncio.sleep(self.handshake_ms / 1000)
+            self.calls[kind] += 1
+            await asyncio.sleep(self.latency_ms / 1000)
+            return await request.json()
+
+        @app.post("/v1/embeddings")
+        async def embeddings(request: Request):
+            body = await serve(request, "embeddings")
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return {"object": "list", "model": body["model"], "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                    "data": [{"object": "embedding", "index": i, "embedding": [0.1] * 8} for i in range(len(inputs))]}
+
+        @app.post("/v2/rerank")
+        async def rerank(request: Request):
+            body = await serve(request, "rerank")
+            return {"id": "stub", "results": [{"index": i, "relevance_score": 1.0 / (i + 1)} for i in range(body.get("top_n", 3))]}
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def reset(self):
+        self.connections.clear()
+        self.calls = {"embeddings": 0, "rerank": 0}
+
+
+def clients(mode: str, server: StubServer, instances: int) -> tuple[list, list, list]:
+    base = f"http://127.0.0.1:{server.port}"
+    if mode == "per-object":
+        embedders = [OpenAIEmbeddings(model="stub", base_url=f"{base}/v1", api_key="stub", check_embedding_ctx_length=False)
+                     for _ in range(instances)]
+        rerankers = [cohere.ClientV2("stub", base_url=base) for _ in range(instances)]
+        return embedders, rerankers, []
+    coalesce = mode == "shared + single-flight"
+    pools = [UpstreamClients(name, UpstreamBudget(name, None), coalesce) for name in ("embeddings", "rerank")]
+    embedder = OpenAIEmbeddings(model="stub", base_url=f"{base}/v1", api_key="stub", check_embedding_ctx_length=False, **pools[0].kwargs())
+    reranker = cohere.ClientV2("stub", base_url=base, httpx_client=pools[1].http_client)
+    return [embedder] * instances, [reranker] * instances, pools
+
+
+async def run(mode: str, server: StubServer, queries: list[str], args) -> dict:
+    server.reset()
+    embedders, rerankers, pools = clients(mode, server, args.instances)
+    rng = random.Random(0)
+    latencies = []
+
+    async def chat(user: int, query: str):
+        start = time.perf_counter()
+        await embedders[user % args.instances].aembed_query(query)
+        # CohereRerank runs the sync client in a worker thread
+        await asyncio.to_thread(rerankers[user % args.instances].rerank, model="stub", query=query, documents=CANDIDATES, top_n=3)
+        latencies.append(time.perf_counter() - start)
+
+    for _ in range(args.rounds):
+        await asyncio.gather(*[chat(user, rng.choice(queries)) for user in range(args.users)])
+        await asyncio.sleep(args.pause_ms / 1000)
+    coalesced = sum(p.stats.coalesced for p in pools)
+    return {
+        "calls": dict(server.calls),
+        "connections": len(server.connections),
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "coalesced": coalesced,
+        "requests": args.users * args.rounds * 2,
+    }
+
+
+async def main(args):
+    corpus = load_queries()
+    queries = (corpus["bph"] + corpus["all_guidelines"])[:args.distinct]
+    server = StubServer(args.latency_ms, args.handshake_ms)
+    print(f"{args.users} concurrent chat requests x {args.rounds} rounds over {len(queries)} distinct queries; "
+          f"upstream {args.latency_ms:.0f}ms, new connection +{args.handshake_ms:.0f}ms")
+    print(f"{'clients':<24}{'upstream calls':>16}{'connections':>13}{'p50':>9}{'p99':>9}{'coalesced':>11}")
+    for mode in ("per-object", "shared pool", "shared + single-flight"):
+        r = await run(mode, server, queries, args)
+        calls = r["calls"]["embeddings"] + r["calls"]["rerank"]
+        print(f"{mode:<24}{calls:>9}/{r['requests']:<6}{r['connections']:>13}{r['p50'] * 1000:>7.0f}ms{r['p99'] * 1000:>7.0f}ms"
+              f"{r['coalesced'] / r['requests']:>10.0%}")
+    server.server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=24)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--instances", type=int, default=9, help="SDK objects in per-object mode")
+    parser.add_argument("--distinct", type=int, default=8, help="distinct queries in the pool")
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--handshake-ms", type=float, default=60.0)
+    parser.add_argument("--pause-ms", type=float, default=200.0, help="idle time between rounds")
+    asyncio.run(main(parser.parse_args()))
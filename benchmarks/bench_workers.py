@@ -0,0 +1,144 @@
+"""Index and docstore memory across worker processes: pickled (private heap) vs. memory-mapped.
+
+Starts 1, 4 and 8 worker processes that each load what the two backends load (the docs_vector
+index and docstore, the BPH summary index and its parent documents), run a few searches, then
+report load time, private (anonymous) memory growth and proportional set size while all workers
+are alive. PSS splits shared page-cache pages between the processes mapping them, so total PSS is
+what N workers really cost the host.
+
+    python -m benchmarks.bench_workers [--workers 1 4 8] [--searches 50]
+
+Indexes are embedded with the offline hashing embeddings and kept under benchmarks/.cache/.
+"""
+import argparse
+import multiprocessing
+import pickle
+import statistics
+import time
+from pathlib import Path
+
+import faiss
+from langchain.storage import InMemoryByteStore
+from langchain.storage._lc_store import create_kv_docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from shared.embeddings import HashingEmbeddings
+from shared.mapped_docstore import DOCS_FILE, MappedDocstore
+from shared.persisted_index import INDEX_FILE, LEGACY_DOCSTORE_FILE, fingerprint, load_index, load_or_build_index
+
+from .common import CACHE_DIR, ROOT, guideline_index_dir, load_queries
+
+AUA = ROOT / "bph_backend" / "aua"
+
+# ------------------------------------------------------------------- #
+
+def read_kb(path: str, fields: tuple) -> dict[str, int]:
+    values = {}
+    with open(path) as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if name in fields:
+                values[name] = int(value.split()[0])
+    return values
+
+
+def memory() -> dict[str, int]:
+    return {**read_kb("/proc/self/status", ("VmRSS", "RssAnon", "RssFile")), **read_kb("/proc/self/smaps_rollup", ("Pss",))}
+
+
+def prepare() -> tuple[Path, Path]:
+    embeddings = HashingEmbeddings()
+    docs_dir = guideline_index_dir(embeddings)
+
+    key = fingerprint([AUA / "summaries" / DOCS_FILE], embeddings.model)
+    load_or_build_index(CACHE_DIR / "bph", key, MappedDocstore(AUA / "summaries").documents, embeddings)
+    return docs_dir, CACHE_DIR / "bph" / key
+
+
+def unpickle(path: Path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def pickled_index(index_dir: Path, embeddings, docstore, index_to_docstore_id) -> FAISS:
+    return FAISS(embedding_function=embeddings, index=faiss.read_index(str(index_dir / INDEX_FILE)),
+                 docstore=docstore, index_to_docstore_id=index_to_docstore_id)
+
+
+def load(mode: str, docs_dir: Path, bph_dir: Path):
+    embeddings = HashingEmbeddings()
+    if mode == "pickle":
+        # as the backends loaded them before: FAISS.load_local (heap index, unpickled docstore),
+        # the unpickled aua summaries and an in-memory parent store
+        docs = pickled_index(docs_dir, embeddings, *unpickle(ROOT / "all_guidelines_backend" / "docs_vector" / LEGACY_DOCSTORE_FILE))
+        summary_docs = unpickle(AUA / "summary_docs.pkl")
+        summaries = pickled_index(bph_dir, embeddings, InMemoryDocstore({str(i): d for i, d in enumerate(summary_docs)}),
+                                  {i: str(i) for i in range(len(summary_docs))})
+        parents = create_kv_docstore(InMemoryByteStore())
+        parents.mset(list(zip(unpickle(AUA / "doc_ids.pkl"), unpickle(AUA / "docs.pkl"))))
+    else:
+        docs = load_index(docs_dir, embeddings)
+        summaries = load_index(bph_dir, embeddings)
+        parents = MappedDocstore(AUA / "parents")
+    return docs, summaries, parents
+
+
+def worker(mode: str, docs_dir: Path, bph_dir: Path, queries: list[str], ready, results):
+    before = memory()
+    start = time.perf_counter()
+    docs, summaries, parents = load(mode, docs_dir, bph_dir)
+    load_ms = (time.perf_counter() - start) * 1000
+    for query in queries:
+        docs.similarity_search(query, k=20)
+        hits = summaries.similarity_search(query, k=20)
+        parents.mget([d.metadata["doc_id"] for d in hits])
+    # measure while every worker still holds its mappings, so shared pages are split between them
+    ready.wait()
+    after = memory()
+    results.put({
+        "load_ms": load_ms,
+        "private_mb": (after["RssAnon"] - before["RssAnon"]) / 1024,
+        "rss_mb": after["VmRSS"] / 1024,
+        "pss_mb": after["Pss"] / 1024,
+    })
+    ready.wait()
+
+
+def run(mode: str, workers: int, docs_dir: Path, bph_dir: Path, queries: list[str]) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, docs_dir, bph_dir, queries, ready, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--searches", type=int, default=50)
+    args = parser.parse_args()
+
+    docs_dir, bph_dir = prepare()
+    corpus = load_queries()
+    queries = (corpus["all_guidelines"] + corpus["bph"]) * (args.searches // 30 + 1)
+    queries = queries[:args.searches]
+
+    print(f"{'mode':<8}{'workers':>8}{'load p50':>10}{'private/worker':>16}{'RSS/worker':>12}{'total PSS':>11}")
+    for workers in args.workers:
+        for mode in ("pickle", "mmap"):
+            samples = run(mode, workers, docs_dir, bph_dir, queries)
+            print(f"{mode:<8}{workers:>8}{statistics.median(s['load_ms'] for s in samples):>8.0f}ms"
+                  f"{statistics.mean(s['private_mb'] for s in samples):>14.1f}MB"
+                  f"{statistics.mean(s['rss_mb'] for s in samples):>10.1f}MB"
+                  f"{sum(s['pss_mb'] for s in samples):>9.1f}MB")
+    print("private/worker: heap growth from loading and searching; total PSS: memory all workers cost the host")
+
+
+if __name__ == "__main__":
+    main()
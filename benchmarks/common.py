@@ -0,0 +1,48 @@
+"""Shared setup for the offline retrieval benchmarks.
+
+The shipped `docs_vector` carries only its docstore (`docstore.bin`), so the benchmarks embed the same
+671 guideline pages (and 61 titles) once with the chosen embeddings and keep the build under `benchmarks/.cache/`.
+"""
+import json
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from shared.embeddings import embedding_model_name
+from shared.mapped_docstore import DOCS_FILE, MappedDocstore
+from shared.persisted_index import fingerprint, load_or_build_index
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+DOCSTORES = {
+    "docs": ROOT / "all_guidelines_backend" / "docs_vector",
+    "titles": ROOT / "all_guidelines_backend" / "titles_vector",
+}
+
+# ------------------------------------------------------------------- #
+
+def load_queries() -> dict:
+    with open(FIXTURES / "queries.json") as file:
+        return json.load(file)
+
+
+def guideline_documents(name: str = "docs") -> list[Document]:
+    return MappedDocstore(DOCSTORES[name]).documents()
+
+
+def guideline_index(embeddings: Embeddings, name: str = "docs"):
+    """FAISS index over the shipped guideline pages (or titles), built once per embedding model."""
+    key = fingerprint([DOCSTORES[name] / DOCS_FILE], embedding_model_name(embeddings))
+    return load_or_build_index(CACHE_DIR / name, key, lambda: guideline_documents(name), embeddings)
+
+
+def guideline_index_dir(embeddings: Embeddings, name: str = "docs") -> Path:
+    guideline_index(embeddings, name)
+    return CACHE_DIR / name / fingerprint([DOCSTORES[name] / DOCS_FILE], embedding_model_name(embeddings))
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[int(q * (len(ordered) - 1))]
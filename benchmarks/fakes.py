@@ -0,0 +1,186 @@
+"""Record/replay stand-ins for the upstream clients, used by benchmarks/suite.py.
+
+Chat models and rerankers answer from a JSON fixture file, keyed by a hash of the request (model
+role, messages / query and candidate ids). With `record=True` a miss is sent to the real client
+and its answer stored; otherwise a miss is answered by a deterministic synthesizer, so a run never
+touches the network and always produces the same output. Embeddings are not recorded: vectors
+are only comparable with an index embedded by the same model, and the offline indexes are built
+with HashingEmbeddings, so queries are embedded with them too.
+
+Every fake waits for its configured latency before answering (LLMs stream token by token).
+"""
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from shared.context import count_tokens
+from shared.embeddings import HashingEmbeddings
+from shared.retrieval_cache import document_key
+
+FIXTURE_VERSION = 1
+
+# ------------------------------------------------------------------- #
+
+class Latency(object):
+    def __init__(self, llm_ms: float = 300.0, token_ms: float = 5.0, embed_ms: float = 80.0, rerank_ms: float = 150.0):
+        self.llm_ms = llm_ms            # LLM call to first token (whole call, for structured output)
+        self.token_ms = token_ms        # between streamed tokens
+        self.embed_ms = embed_ms
+        self.rerank_ms = rerank_ms
+
+    def settings(self) -> dict:
+        return dict(vars(self))
+
+
+class Fixtures(object):
+    """Recorded upstream answers: {key: answer}, stored as JSON at `path`."""
+
+    def __init__(self, path: Path, record: bool = False):
+        self.path = Path(path)
+        self.record = record
+        self.entries: dict[str, Any] = {}
+        if self.path.exists():
+            with open(self.path) as file:
+                stored = json.load(file)
+            if stored.get("version") == FIXTURE_VERSION:
+                self.entries = stored["entries"]
+        self.replayed = 0
+        self.recorded = 0
+        self.synthesized = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def answer(self, key: str, fetch: Optional[Callable], synthesize: Callable) -> Any:
+        if key in self.entries:
+            self.replayed += 1
+            return self.entries[key]
+        if self.record and fetch is not None:
+            self.recorded += 1
+            self.entries[key] = await fetch()
+            return self.entries[key]
+        self.synthesized += 1
+        return synthesize()
+
+    def save(self):
+        if self.recorded:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as file:
+                json.dump({"version": FIXTURE_VERSION, "entries": self.entries}, file, indent=1, sort_keys=True)
+
+    def metrics(self) -> dict:
+        return {"replayed": self.replayed, "recorded": self.recorded, "synthesized": self.synthesized}
+
+
+def seed(*parts) -> int:
+    """Stable across processes, unlike hash()."""
+    return int(Fixtures.key(*parts)[:12], 16)
+
+
+def _payload(messages) -> list:
+    return [(m.type, m.content) for m in messages]
+
+# ------------------------------------------------------------------- #
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model `role` (e.g. "bph.CONV_LLM"), replayed from `fixtures`; `inner` is the real model,
+    used when recording. `synthesize(messages)` answers misses: text, or a dict for structured output."""
+    role: str
+    fixtures: Any
+    latency: Any
+    synthesize: Callable
+    inner: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    async def _text(self, messages, **kwargs) -> str:
+        async def fetch():
+            return (await self.inner.ainvoke(messages, **kwargs)).content
+        return await self.fixtures.answer(self.fixtures.key("chat", self.role, _payload(messages)),
+                                          fetch if self.inner is not None else None, lambda: self.synthesize(messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = asyncio.run(self._text(messages, **kwargs))
+        time.sleep((self.latency.llm_ms + self.latency.token_ms * len(text.split(" "))) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop=None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs):
+        text = await self._text(messages, **kwargs)
+        await asyncio.sleep(self.latency.llm_ms / 1000)
+        tokens = text.split(" ")
+        for i, token in enumerate(tokens):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token if i == len(tokens) - 1 else token + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.latency.token_ms / 1000)
+        prompt_tokens = count_tokens("".join(str(content) for _, content in _payload(messages)))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}))
+
+    def with_structured_output(self, schema, **kwargs):
+        async def invoke(prompt):
+            messages = prompt.to_messages()
+
+            async def fetch():
+                return await self.inner.with_structured_output(schema, **kwargs).ainvoke(messages)
+            key = self.fixtures.key("structured", self.role, _payload(messages))
+            answer = await self.fixtures.answer(key, fetch if self.inner is not None else None, lambda: self.synthesize(messages))
+            await asyncio.sleep(self.latency.llm_ms / 1000)
+            return answer
+        return RunnableLambda(lambda prompt: asyncio.run(invoke(prompt)), afunc=invoke, name=f"{self.role}.structured")
+
+
+class ReplayReranker(BaseDocumentCompressor):
+    """Reranker `role` replayed from `fixtures` (the chosen candidates, by position). Misses keep the
+    retrieval order, or are sent to `inner` when recording."""
+    role: str
+    fixtures: Any
+    latency: Any
+    top_n: int
+    inner: Optional[Any] = None
+
+    def compress_documents(self, documents, query, callbacks=None):
+        return asyncio.run(self.acompress_documents(documents, query, callbacks))
+
+    async def acompress_documents(self, documents, query, callbacks=None):
+        documents = list(documents)
+        keys = [document_key(d) for d in documents]
+
+        async def fetch():
+            chosen = await self.inner.acompress_documents(documents, query)
+            return [keys.index(document_key(d)) for d in chosen]
+        positions = await self.fixtures.answer(self.fixtures.key("rerank", self.role, query, keys, self.top_n),
+                                               fetch if self.inner is not None else None,
+                                               lambda: list(range(min(self.top_n, len(documents)))))
+        await asyncio.sleep(self.latency.rerank_ms / 1000)
+        return [documents[i] for i in positions]
+
+
+class DelayedEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that take `latency.embed_ms` per call, like a remote endpoint."""
+
+    def __init__(self, latency: Latency):
+        super().__init__()
+        self.latency = latency
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency.embed_ms / 1000)
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency.embed_ms / 1000)
+        return self.embed_documents(texts)
@@ -0,0 +1,265 @@
+"""End-to-end benchmark of both apps, offline and deterministic, compared against a stored baseline.
+
+Each app's MainGraph runs unchanged behind its server's run_graph, with the upstream clients
+replaced by the record/replay fakes of benchmarks/fakes.py (fixed, configurable latencies). Every
+query of benchmarks/fixtures/queries.json is asked as a first turn, `--rounds` times, by N
+concurrent streams; each concurrency level starts from a freshly built graph, so retrieval caches
+start cold. Reported per app: load time and the resident memory it added (apps load one after the
+other in one process), then per level: time to first token and end-to-end latency (p50/p95),
+requests/s and streamed chunks/s.
+
+    python -m benchmarks.suite [--app bph] [--concurrency 1 --concurrency 8] [--rounds 2]
+    python -m benchmarks.suite --save-baseline          # store this run as the baseline
+    python -m benchmarks.suite --record                 # fill fixture misses from the real APIs
+
+Results are compared with --baseline (benchmarks/fixtures/baseline.json) when it was recorded with
+the same settings; a metric more than --tolerance worse is a regression, and the exit status is 1.
+Misses in --fixtures (benchmarks/fixtures/upstream.json) are answered by seeded synthesizers.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+for var in ('OPENAI_KEY_ALL_GUIDELINES', 'LANGCHAIN_PROJECT_ALL_GUIDELINES', 'COHERE_API_KEY', 'OPENAI_API_KEY'):
+    os.environ.setdefault(var, 'offline-benchmark')
+os.environ['LANGCHAIN_TRACING_V2'] = 'false'
+
+from .common import CACHE_DIR, FIXTURES, guideline_index_dir, load_queries, percentile
+from .fakes import DelayedEmbeddings, Fixtures, Latency, ReplayChatModel, ReplayReranker, seed
+
+APPS = ("bph", "all_guidelines")
+BASELINE = FIXTURES / "baseline.json"
+UPSTREAM_FIXTURES = FIXTURES / "upstream.json"
+# lower is better for these; higher for the rest
+LOWER_IS_BETTER = ("load_s", "rss_mb", "ttft_p50_ms", "ttft_p95_ms", "e2e_p50_ms", "e2e_p95_ms")
+
+_WORD = re.compile(r"[A-Za-z]+")
+
+# ------------------------------------------------------------------- #
+# deterministic answers for fixture misses
+
+def answer_text(tokens: int):
+    def synthesize(messages) -> str:
+        words = _WORD.findall(messages[-1].content)[-400:] or ["answer"]
+        rng = random.Random(seed(messages[-1].content))
+        return " ".join(rng.choice(words) for _ in range(tokens))
+    return synthesize
+
+
+def rewritten_query(messages) -> str:
+    return messages[-1].content.strip().splitlines()[-1]
+
+
+def treatments(messages) -> dict:
+    from bph_backend.choose_tx import TREATMENT_OPTIONS
+    rng = random.Random(seed(messages[-1].content))
+    return {"treatments_to_discuss": rng.sample(TREATMENT_OPTIONS, rng.randint(0, 3))}
+
+
+def synthesizers(app: str, tokens: int) -> dict:
+    llms = {"CONV_LLM": answer_text(tokens), "CONV_SMALL_LLM": answer_text(tokens), "QUERY_FROM_HISTORY_LLM": rewritten_query}
+    if app == "bph":
+        llms["CHOOSE_TX_LLM"] = treatments
+    return llms
+
+# ------------------------------------------------------------------- #
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # peak, not current, where /proc is unavailable
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class App(object):
+    """One backend, its modules imported only after the fakes are in place."""
+
+    def __init__(self, name: str, fixtures: Fixtures, latency: Latency, tokens: int):
+        self.name = name
+        self.fixtures = fixtures
+        self.latency = latency
+        package = f"{name}_backend"
+        if f"{package}.main_graph" in sys.modules:
+            raise RuntimeError(f"{package}.main_graph was imported before its upstream clients were replaced")
+        constants = importlib.import_module(f"{package}.constants")
+        for attr, synthesize in synthesizers(name, tokens).items():
+            setattr(constants, attr, ReplayChatModel(role=f"{name}.{attr}", fixtures=fixtures, latency=latency, synthesize=synthesize,
+                                                     inner=getattr(constants, attr) if fixtures.record else None))
+        # every request should reach the graph's upstream calls, and nothing is sampled
+        constants.RESPONSE_CACHE_BACKEND = None
+        constants.TRACE_SAMPLE_RATE = 0.0
+        self.constants = constants
+        self.main_graph = importlib.import_module(f"{package}.main_graph")
+        self.server = importlib.import_module(f"{package}.server")
+        self.index_dir = None
+
+    def make_reranker(self, embeddings):
+        from shared.rerankers import make_reranker
+        model = "rerank-v3.5" if self.name == "bph" else "rerank-english-v3.0"
+
+        def make(top_n: int):
+            inner = make_reranker(self.constants.RERANKER, top_n, model, embeddings) if self.fixtures.record else None
+            return ReplayReranker(role=f"{self.name}.reranker", fixtures=self.fixtures, latency=self.latency, top_n=top_n, inner=inner)
+        return make
+
+    def make(self):
+        embeddings = DelayedEmbeddings(self.latency)
+        if self.name == "bph":
+            return self.main_graph.MainGraph(embeddings=embeddings, make_reranker=self.make_reranker(embeddings),
+                                             index_dir=CACHE_DIR / "bph_summary")
+        if self.index_dir is None:
+            # the shipped docs_vector has no vectors: point at the benchmark builds instead
+            self.index_dir = Path(tempfile.mkdtemp(prefix="bench-suite-"))
+            for name in ("docs", "titles"):
+                (self.index_dir / f"{name}_vector").symlink_to(guideline_index_dir(embeddings, name))
+        return self.main_graph.MainGraph(embeddings=embeddings, make_reranker=self.make_reranker(embeddings), index_dir=self.index_dir)
+
+    def build(self):
+        g = self.make()
+        # measure from a warm start, as a server that has been up a while
+        if getattr(g, "prewarming", None) is not None:
+            g.prewarming.join()
+        self.main_graph.corpus.install(g)
+        return g
+
+    def close(self):
+        if self.index_dir is not None:
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+
+
+async def stream(app: App, query: str) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    first, chunks = None, 0
+    async for _ in app.server.run_graph([{"role": "ai", "content": ""}, {"role": "human", "content": query}]):
+        if first is None:
+            first = time.perf_counter() - start
+        chunks += 1
+    return first if first is not None else float("nan"), time.perf_counter() - start, chunks
+
+
+async def load_test(app: App, queries: list[str], concurrency: int) -> dict:
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(query):
+        async with gate:
+            return await stream(app, query)
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*[one(q) for q in queries])
+    wall = time.perf_counter() - start
+    ttft = [s[0] * 1000 for s in samples]
+    e2e = [s[1] * 1000 for s in samples]
+    return {
+        "ttft_p50_ms": round(statistics.median(ttft), 1), "ttft_p95_ms": round(percentile(ttft, 0.95), 1),
+        "e2e_p50_ms": round(statistics.median(e2e), 1), "e2e_p95_ms": round(percentile(e2e, 0.95), 1),
+        "requests_per_s": round(len(samples) / wall, 2), "chunks_per_s": round(sum(s[2] for s in samples) / wall, 1),
+    }
+
+
+def run_app(name: str, fixtures: Fixtures, latency: Latency, args) -> dict:
+    before = rss_mb()
+    app = App(name, fixtures, latency, args.tokens)
+    try:
+        start = time.perf_counter()
+        app.build()
+        results = {"load": {"load_s": round(time.perf_counter() - start, 2), "rss_mb": round(rss_mb() - before, 1)}}
+        queries = load_queries()[name] * args.rounds
+        for concurrency in args.concurrency:
+            app.build()
+            results[f"c{concurrency}"] = asyncio.run(load_test(app, queries, concurrency))
+        results["load"]["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1)
+        return results
+    finally:
+        app.close()
+
+# ------------------------------------------------------------------- #
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print every metric next to its baseline value; returns the regressions."""
+    regressions = []
+    print(f"\n{'app':<16}{'run':<6}{'metric':<16}{'baseline':>11}{'now':>11}{'change':>9}")
+    for app, runs in results.items():
+        for run, metrics in runs.items():
+            for metric, value in metrics.items():
+                old = baseline.get(app, {}).get(run, {}).get(metric)
+                if old is None or metric == "peak_rss_mb":
+                    continue
+                change = (value - old) / old if old else 0.0
+                worse = change if metric in LOWER_IS_BETTER else -change
+                flag = "  REGRESSION" if worse > tolerance else ""
+                if flag:
+                    regressions.append(f"{app} {run} {metric}: {old} -> {value}")
+                print(f"{app:<16}{run:<6}{metric:<16}{old:>11g}{value:>11g}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, action="append", help="apps to run (repeatable; default both)")
+    parser.add_argument("--concurrency", type=int, action="append", help="concurrent streams (repeatable; default 1 and 8)")
+    parser.add_argument("--rounds", type=int, default=2, help="times each query is asked per concurrency level")
+    parser.add_argument("--tokens", type=int, default=150, help="tokens per synthesized answer")
+    parser.add_argument("--llm-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--embed-ms", type=float, default=80.0)
+    parser.add_argument("--rerank-ms", type=float, default=150.0)
+    parser.add_argument("--fixtures", type=Path, default=UPSTREAM_FIXTURES)
+    parser.add_argument("--record", action="store_true", help="send fixture misses to the real APIs and store the answers")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    args.app = args.app or list(APPS)
+    args.concurrency = args.concurrency or [1, 8]
+
+    latency = Latency(args.llm_ms, args.token_ms, args.embed_ms, args.rerank_ms)
+    settings = {**latency.settings(), "tokens": args.tokens, "rounds": args.rounds}
+    fixtures = Fixtures(args.fixtures, record=args.record)
+    print(f"settings: {json.dumps(settings)}")
+    print(f"{'app':<16}{'run':<6}{'TTFT p50':>10}{'p95':>8}{'e2e p50':>10}{'p95':>8}{'req/s':>8}{'chunks/s':>10}")
+    results = {}
+    for name in args.app:
+        results[name] = run_app(name, fixtures, latency, args)
+        load = results[name]["load"]
+        print(f"{name:<16}{'load':<6}{load['load_s']:>9.2f}s  rss {load['rss_mb']:+.0f}MB, peak {load['peak_rss_mb']:.0f}MB")
+        for run, r in results[name].items():
+            if run != "load":
+                print(f"{name:<16}{run:<6}{r['ttft_p50_ms']:>8.0f}ms{r['ttft_p95_ms']:>6.0f}ms{r['e2e_p50_ms']:>8.0f}ms"
+                      f"{r['e2e_p95_ms']:>6.0f}ms{r['requests_per_s']:>8.2f}{r['chunks_per_s']:>10.0f}")
+    print(f"upstream fixtures: {json.dumps(fixtures.metrics())}")
+    fixtures.save()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({"settings": settings, "results": results}, file, indent=1)
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print("no baseline to compare with (--save-baseline stores one)")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline["settings"] != settings:
+        print(f"baseline settings differ, not compared: {json.dumps(baseline['settings'])}")
+        return
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
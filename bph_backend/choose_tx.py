@@ -7,6 +7,32 @@ from typing import TypedDict, Union, Literal
 class ChooseTxResponse(TypedDict):
     treatments_to_discuss: list[str]
 
+# every treatment name the prompt below can steer the model towards
+TREATMENT_OPTIONS = [
+    'Endoscopic Enucleation (e.g. HoLEP, ThuLEP)',
+    'Greenlight Photovaporization',
+    'Transurethral Incision of the Prostate',
+    'TURP',
+    'iTIND/Temporarily Implanted Prostate Device',
+    'Urolift/Prostatic Urethral Lift',
+    'Urolift/PUL',
+    'Rezum/Water Vapor Thermal Therapy WVTT',
+    'Aquablation RWT',
+    'Simple Prostatectomy (Open, Laparoscopic, Robotic)',
+]
+
+# the prompt's <surgical considerations> table, for the local selector (treatment_selector.py)
+SURGICAL_RULES = {
+    'size_under_30': ['Endoscopic Enucleation (e.g. HoLEP, ThuLEP)', 'Greenlight Photovaporization', 'Transurethral Incision of the Prostate', 'TURP', 'iTIND/Temporarily Implanted Prostate Device'],
+    'size_30_80': ['Endoscopic Enucleation (e.g. HoLEP, ThuLEP)', 'Greenlight Photovaporization', 'TURP', 'Urolift/Prostatic Urethral Lift', 'Rezum/Water Vapor Thermal Therapy WVTT', 'Aquablation RWT', 'iTIND/Temporarily Implanted Prostate Device'],
+    'size_over_80': ['Simple Prostatectomy (Open, Laparoscopic, Robotic)', 'Endoscopic Enucleation (e.g. HoLEP, ThuLEP)'],
+    'sexual_preservation': ['Urolift/PUL', 'Rezum/Water Vapor Thermal Therapy WVTT', 'iTIND/Temporarily Implanted Prostate Device', 'Aquablation RWT'],
+    'comorbid': ['Endoscopic Enucleation (e.g. HoLEP, ThuLEP)', 'Greenlight Photovaporization'],
+}
+
+# the prompt names the prostatic urethral lift two ways
+TREATMENT_ALIASES = {'Urolift/PUL': 'Urolift/Prostatic Urethral Lift'}
+
 template = """Given the patient's query about BPH - use your knowledge of BPH to select relevant treatments to read about (including e.g. conservative, medical, and surgical options). After your selection, I will provide you with the most updated guidelines for the selected treatments.
 
 If you believe the patient's query warrants information about procedural therapy (e.g. surgery, endoscopic treatment, minimally invasive surgical therapy, etc.), use the following algorithm to choose the precise surgical options:
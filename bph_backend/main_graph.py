@@ -1,29 +1,61 @@
 from dotenv import load_dotenv
 load_dotenv('.env', override=True)
 import os
+import asyncio
+import logging
+import threading
 from pathlib import Path
 
 os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_KEY_ALL_GUIDELINES')
 os.environ['LANGCHAIN_PROJECT'] = os.getenv('LANGCHAIN_PROJECT_ALL_GUIDELINES')
 
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_cohere import CohereRerank
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain_core.messages import AnyMessage
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableConfig
 
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Send
 
 from operator import add
-from typing_extensions import TypedDict, Annotated
+from typing_extensions import TypedDict, Annotated, Callable, Optional
 
-from .constants import LARGE_EMBD
+from .constants import LARGE_EMBD, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_S
+from .constants import EMBEDDING_CACHE_MAX_ENTRIES, RERANK_CACHE_MAX_ENTRIES, PREWARM_TREATMENT_QUERIES, GRAPH_MODE, RERANKER
+from .constants import INDEX_KIND, INDEX_MRL_DIMS, INDEX_RECALL_TARGET
+from .constants import CONTEXT_MAX_TOKENS, CONTEXT_MMR_LAMBDA, CONTEXT_NEAR_DUPLICATE, PROMPT_LAYOUT
+from .constants import RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX, CHOOSE_TX, CHOOSE_TX_MIN_CONFIDENCE
+from .constants import SESSION_BACKEND, SESSION_MAX, SESSION_TTL_S, SESSION_REUSE_MIN_SIMILARITY
+from .constants import RESPOND_TIERING, RESPOND_TIERS, RESPOND_TIER_CONTEXT_TOKENS, RESPOND_SMALL_MAX_WORDS
+from .constants import RESPOND_OFF_TOPIC_RELEVANCE, RESPOND_MIN_COVERAGE, RESPOND_TIER_LOG
+from shared.context import ContextBudgeter
+from shared.prompt_cache import PromptCacheStats
+from shared.tracing import TracedIndex
+from shared.batching import BatchedEmbeddings, BatchedIndex
+from shared.corpus import CorpusRegistry
+from shared.embeddings import embedding_model_name
+from shared.mapped_docstore import DOCS_FILE, MappedDocstore
+from shared.upstream import openai_embeddings
+from shared.readiness import timed
+from shared.persisted_index import fingerprint, load_or_build_index
+from shared.quantized_index import load_or_build_quantized
+from shared.response_cache import make_response_cache
+from shared.retrieval_cache import CachedEmbeddings, CachedReranker
+from shared.rerankers import IndexVectors, aretrieve_many, arerank, make_reranker as default_reranker
+from shared.sessions import RetrievalReuse, in_session, make_session_store
+from shared.model_tiers import TierRouter
 from .subquestions import subqueries_chain
 from .answer_subq import answer_subq_chain
-from .response import response_chain
-from .query_from_history import query_from_history_chain
-from .choose_tx import choose_tx_chain
+from .response import response_chains
+from .query_from_history import query_from_history_chain, needs_rewrite
+from .choose_tx import choose_tx_chain, TREATMENT_OPTIONS
+from .treatment_selector import EXAMPLES_FILE, load_treatment_selector
+
+logger = logging.getLogger("tli.bph")
 # ------------------------------------------------------------------- #
 
 class MainState(TypedDict):
@@ -31,6 +63,15 @@ class MainState(TypedDict):
 
     treatments_to_discuss: list[str]
 
+    query_embedding: list[float]
+    cached_response: str
+
+    context: list[list[Document]]       # rank-ordered results, one list per lookup
+    candidates: list[Document]          # the query lookup's candidates, before reranking
+
+    follows_on: bool                    # same subject as the session's last turn: its candidates are reused
+    last_turn: dict                     # kept by the session checkpointer for the next turn (RetrievalReuse)
+
     subqueries: list[str]
     user_goal: str
 
@@ -44,49 +85,133 @@ class SubquestionState(TypedDict):
 
 # ------------------------------------------------------------------- #
 
-import pickle
-from langchain.storage import InMemoryByteStore
 from langchain_community.vectorstores import FAISS  
 from langchain.retrievers.multi_vector import MultiVectorRetriever
 from langchain.retrievers.multi_vector import SearchType
-from langchain_openai import OpenAIEmbeddings
-pickle_directory = "aua"
+# docstore.bin files converted from the aua pickles (python -m shared.convert_docstores)
+aua_directory = "aua"
+summary_index_directory = "summary_vector"
+treatment_index_directory = "treatment_vector"
 
 class MainGraph(object):
-    def __init__(self):
+    def __init__(self, mode: str = GRAPH_MODE, embeddings: Optional[Embeddings] = None,
+                 make_reranker: Optional[Callable] = None, index_dir: Optional[Path] = None,
+                 timings: Optional[dict] = None, sessions: Optional[BaseCheckpointSaver] = None):
+        """`mode` is "sequential" or "speculative" (see build_graph). `embeddings`, `make_reranker(top_n)`
+        and `index_dir` replace the OpenAI embeddings, Cohere reranker and summary index location;
+        `sessions`, the SESSION_BACKEND checkpointer. Per-step load times (seconds) are recorded in `timings`, if given."""
         current_dir = Path(__file__).resolve().parent
+        self.mode = mode
 
-        with open(f'{current_dir}/{pickle_directory}/doc_ids.pkl', 'rb') as file:
-            doc_ids = pickle.load(file)
-        with open(f'{current_dir}/{pickle_directory}/summary_docs.pkl', 'rb') as file:
-            summary_docs = pickle.load(file)
-        with open(f'{current_dir}/{pickle_directory}/docs.pkl', 'rb') as file:
-            docs = pickle.load(file)
+        embeddings = embeddings or openai_embeddings(LARGE_EMBD)
+        self.batching = {}
+        if RETRIEVAL_BATCH_WINDOW_MS:
+            embeddings = self.batching["embed"] = BatchedEmbeddings(embeddings, RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX)
+        embeddings = self.embeddings = CachedEmbeddings(embeddings, maxsize=EMBEDDING_CACHE_MAX_ENTRIES)
+        model = embedding_model_name(embeddings)
+        make_reranker = make_reranker or (lambda top_n: default_reranker(RERANKER, top_n, "rerank-v3.5", embeddings, vectors))
+        summaries_dir, parents_dir = current_dir / aua_directory / "summaries", current_dir / aua_directory / "parents"
 
-        vectorstore = FAISS.from_documents(summary_docs, OpenAIEmbeddings(model=LARGE_EMBD))
-        store = InMemoryByteStore()
+        # embedded once per (aua summaries, embedding model) and memory-mapped on every later boot
+        cache_dir = index_dir or current_dir / summary_index_directory
+        index_key = fingerprint([summaries_dir / DOCS_FILE], model)
+        with timed(timings, "summary_index"):
+            vectorstore = load_or_build_index(
+                cache_dir=cache_dir,
+                key=index_key,
+                load_documents=lambda: MappedDocstore(summaries_dir).documents(),
+                embeddings=embeddings,
+            )
+            # the in-process reranker scores parent documents by their summaries' stored vectors
+            vectors = IndexVectors(vectorstore, id_key="doc_id") if RERANKER == "hybrid" else None
+            if INDEX_KIND != "flat":
+                load_or_build_quantized(vectorstore, cache_dir / index_key, INDEX_KIND, INDEX_MRL_DIMS, INDEX_RECALL_TARGET)
+            if RETRIEVAL_BATCH_WINDOW_MS:
+                vectorstore.index = self.batching["search"] = BatchedIndex(vectorstore.index, RETRIEVAL_BATCH_WINDOW_MS, RETRIEVAL_BATCH_MAX)
+            vectorstore.index = TracedIndex(vectorstore.index, "summary_index")
+        # parent documents are served straight from the shipped memory-mapped docstore
+        with timed(timings, "parent_docstore"):
+            store = MappedDocstore(parents_dir)
         id_key = 'doc_id'
         retriever = MultiVectorRetriever(
             vectorstore=vectorstore,
-            byte_store=store,
+            docstore=store,
             id_key=id_key,
             search_type=SearchType.similarity,
             search_kwargs={'k': 20}
         )
-        retriever.docstore.mset(list(zip(doc_ids, docs)))
 
         self.big_retriever = ContextualCompressionRetriever(
-            base_compressor=CohereRerank(model="rerank-v3.5", top_n=7), 
+            base_compressor=CachedReranker(make_reranker(7), maxsize=RERANK_CACHE_MAX_ENTRIES), 
             base_retriever=retriever
         )
 
         self.small_retriever = ContextualCompressionRetriever(
-            base_compressor=CohereRerank(model="rerank-v3.5", top_n=3), 
+            base_compressor=CachedReranker(make_reranker(3), maxsize=RERANK_CACHE_MAX_ENTRIES), 
             base_retriever=retriever
         )
 
+        self.treatment_selector = None
+        self.choose_tx = choose_tx_chain
+        if CHOOSE_TX == "local":
+            with timed(timings, "treatment_selector"):
+                treatment_dir = Path(index_dir).with_name(treatment_index_directory) if index_dir else current_dir / treatment_index_directory
+                self.choose_tx = self.treatment_selector = load_treatment_selector(treatment_dir, embeddings, CHOOSE_TX_MIN_CONFIDENCE)
+
+        # answers are only valid for the corpus they were grounded in: the summaries searched, the parent
+        # text put in the prompt and the examples treatments are chosen by
+        index_version = fingerprint(corpus_files(), model)
+        with timed(timings, "response_cache"):
+            self.response_cache = make_response_cache(
+                embeddings, namespace="bph", version=index_version, backend=RESPONSE_CACHE_BACKEND,
+                threshold=RESPONSE_CACHE_THRESHOLD, maxsize=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL_S,
+            )
 
+        self.context = ContextBudgeter(CONTEXT_MAX_TOKENS, CONTEXT_MMR_LAMBDA, CONTEXT_NEAR_DUPLICATE,
+                                       stable_order=PROMPT_LAYOUT == "cache-prefix")
+        self.prompt_cache = PromptCacheStats()
+        # relevance scores are only comparable across queries for the hosted reranker
+        self.tiers = TierRouter("bph", RESPOND_TIERS, RESPOND_TIER_CONTEXT_TOKENS, RESPOND_SMALL_MAX_WORDS,
+                                RESPOND_OFF_TOPIC_RELEVANCE if RERANKER == "cohere" else None, RESPOND_MIN_COVERAGE,
+                                enabled=RESPOND_TIERING, log=RESPOND_TIER_LOG)
+        # requests with a session id run on session_graph, which keeps each session's last turn
+        self.sessions = sessions if sessions is not None else make_session_store(SESSION_BACKEND, SESSION_MAX, SESSION_TTL_S)
+        self.reuse = RetrievalReuse(store, SESSION_REUSE_MIN_SIMILARITY)
         self.graph = self.build_graph()
+        self.session_graph = self.build_graph(self.sessions) if self.sessions is not None else None
+
+        # respond looks these up on nearly every request; warmed in the background, so a slow or
+        # failing upstream neither delays nor fails the build
+        self.prewarming = None
+        if PREWARM_TREATMENT_QUERIES:
+            self.prewarming = threading.Thread(target=self.prewarm, args=(timings,), name="bph-prewarm", daemon=True)
+            self.prewarming.start()
+
+    def prewarm(self, timings: Optional[dict] = None):
+        """Rerank every TREATMENT_OPTIONS query once, so later lookups are memory hits; best effort."""
+        try:
+            with timed(timings, "prewarm"):
+                self.small_retriever.batch(TREATMENT_OPTIONS)
+        except Exception:
+            logger.warning("treatment query prewarm failed", exc_info=True)
+
+    def turn_input(self, messages: list) -> dict:
+        """Graph input for one chat turn: in a session, it also clears what the previous turn left in the state."""
+        return {"messages": messages, "cached_response": None, "query_embedding": None, "treatments_to_discuss": None,
+                "context": None, "candidates": None, "follows_on": False}
+
+    async def _reusable(self, state: MainState, query: str) -> Optional[list[Document]]:
+        """The session's last candidates, if `query` is on the same subject."""
+        if not state.get("last_turn"):
+            return None
+        embedding = state.get("query_embedding") or await self.embeddings.aembed_query(query)
+        return self.reuse.candidates(state["last_turn"], embedding)
+
+    async def _big_lookup(self, query: str, candidates: Optional[list[Document]] = None) -> tuple[list[Document], list[Document]]:
+        """The query's candidates (searched for unless given) and their reranking."""
+        if candidates is None:
+            candidates = await self.big_retriever.base_retriever.ainvoke(query)
+        return candidates, await arerank(self.big_retriever, query, candidates)
 
     async def query_from_history(self, state: MainState):
         query = state["messages"][-1]['content']
@@ -99,6 +224,73 @@ class MainGraph(object):
         query = await query_from_history_chain.ainvoke({"query": query, "last_response": last_response})
         return {"messages": [{"role": "human", "content": query}]}
     
+    async def _lookup_cache(self, query: str):
+        cached_response, query_embedding = await self.response_cache.lookup(query)
+        if cached_response is None:
+            return {"query_embedding": query_embedding}
+        # picked up by run_graph through stream_mode="custom"
+        get_stream_writer()({"cached_response": cached_response})
+        return {"cached_response": cached_response, "messages": [{"role": "ai", "content": cached_response}]}
+
+    async def check_cache(self, state: MainState):
+        if self.response_cache is None:
+            return
+        return await self._lookup_cache(state["messages"][-1]['content'])
+
+    def route_after_cache(self, state: MainState):
+        if state.get("cached_response"):
+            return END
+        return 'respond' if self.mode == "speculative" else 'get_treatments_to_discuss'
+
+    async def prepare(self, state: MainState):
+        """Speculative mode: query rewrite, cache lookup, treatment selection and retrieval in one overlapped step."""
+        raw_query = state["messages"][-1]['content']
+        try:
+            last_response = state["messages"][-2]['content']
+        except IndexError:
+            last_response = ""
+
+        # retrieval on the raw query starts before we know whether the rewrite will change it
+        big_retrieval, choosing = asyncio.create_task(self._big_lookup(raw_query)), None
+        try:
+            query = raw_query
+            if needs_rewrite(raw_query, last_response):
+                query = await query_from_history_chain.ainvoke({"query": raw_query, "last_response": last_response})
+                if query.strip() != raw_query.strip():
+                    big_retrieval.cancel()
+                    big_retrieval = asyncio.create_task(self._big_lookup(query))
+            update = {"messages": [{"role": "human", "content": query}]}
+
+            choosing = asyncio.create_task(self.choose_tx.ainvoke({"query": query}))
+            reused = await self._reusable(state, query)
+            if reused is not None:
+                # the same subject as the session's last turn: its candidates are reranked and its treatments kept
+                big_retrieval.cancel()
+                choosing.cancel()
+                big_retrieval = asyncio.create_task(self._big_lookup(query, reused))
+                update["follows_on"] = True
+            if self.response_cache is not None:
+                cached = await self._lookup_cache(query)
+                if cached.get("cached_response"):
+                    return cached
+                update.update(cached)
+
+            treatments_to_discuss = state["last_turn"]["treatments"] if reused is not None else (await choosing)["treatments_to_discuss"]
+            if treatments_to_discuss:
+                (candidates, refined_context), extra_context = await asyncio.gather(
+                    big_retrieval, aretrieve_many([(self.small_retriever, t) for t in treatments_to_discuss])
+                )
+            else:
+                (candidates, refined_context), extra_context = await big_retrieval, []
+        finally:
+            # a cache hit, or any failure above, leaves the speculative work unused
+            for task in (big_retrieval, choosing):
+                if task is not None:
+                    task.cancel()
+        update.update({"treatments_to_discuss": treatments_to_discuss, "context": [refined_context] + extra_context,
+                       "candidates": candidates})
+        return update
+
     async def get_subquestions(self, state: MainState):
         return
         prompt = state["messages"][-1]['content']
@@ -120,50 +312,93 @@ class MainGraph(object):
     
     async def get_treatments_to_discuss(self, state: MainState):
         prompt = state["messages"][-1]['content']
-        treatments_to_discuss = await choose_tx_chain.ainvoke({"query": prompt})
+        if (reused := await self._reusable(state, prompt)) is not None:
+            # the same subject as the session's last turn: its treatments still apply, and respond reranks its candidates
+            return {"treatments_to_discuss": state["last_turn"]["treatments"], "candidates": reused, "follows_on": True}
+        treatments_to_discuss = await self.choose_tx.ainvoke({"query": prompt})
         treatments_to_discuss = treatments_to_discuss["treatments_to_discuss"]
         return {"treatments_to_discuss": treatments_to_discuss}
 
-    async def respond(self, state: MainState):
+    async def respond(self, state: MainState, config: RunnableConfig):
         prompt = state["messages"][-1]['content']
         treatments_to_discuss = state["treatments_to_discuss"]
 
+        candidates = state.get("candidates")
+        if state.get("context") is not None:
+            lookups = state["context"]
+        else:
+            if candidates is None:
+                candidates = await self.big_retriever.base_retriever.ainvoke(prompt)
+            # with a local reranker all of these lookups are scored in one pass
+            lookups = await aretrieve_many(
+                [(self.big_retriever, prompt, candidates)] + [(self.small_retriever, t) for t in treatments_to_discuss]
+            )
+
         if treatments_to_discuss == []:
-            refined_context = await self.big_retriever.ainvoke(prompt)
             context_hint = "Please use patient friendly, non-technical language in your response."
         else:
-            refined_context = await self.big_retriever.ainvoke(prompt)
-            extra_context = await self.small_retriever.abatch(treatments_to_discuss)
-            flattened_context = []
-            for context_list in [refined_context]+extra_context:
-                flattened_context.extend(context_list)
-            refined_context = flattened_context
             context_hint = f"Please use patient friendly, non-technical language in your response.\n\nYou should include a discussion of the following in your response, given their particular relevance to the user's current query: {', '.join(treatments_to_discuss)}"
 
-        formatted_context = "\n\n".join([c.page_content for c in refined_context])
-        response = await response_chain.ainvoke({"query": prompt, "context": formatted_context, "context_hint": context_hint})
-        return {"messages": [response]}
-        prompt = state["messages"][-1]['content']
-        formatted_responses = "\n\n".join([f"<subquestion_{i+1}>:\n{subquery}\n{subresponse}</subquestion_{i+1}>" for i, (subquery, subresponse) in enumerate(zip(state["subqueries"], state["subresponses"]))])
-        response = await response_chain.ainvoke({"query": prompt, "subresponses": formatted_responses})
+        # several treatments to weigh up always go to the big model
+        tier = self.tiers.route(prompt, lookups[0], complex_signals=len(treatments_to_discuss) > 1)
+        layout = None
+        if PROMPT_LAYOUT == "cache-prefix":
+            # a treatment's lookup returns the same documents whatever the query: those are written first,
+            # in a fixed order; which documents are kept still follows retrieval order (the query's first)
+            layout = [1 + i for i in sorted(range(len(treatments_to_discuss)), key=lambda i: treatments_to_discuss[i])] + [0]
+        # the same parent document comes back from several lookups: deduplicated and packed to a token budget
+        formatted_context = self.context.assemble(lookups, tier.context_tokens, layout)
+        response = await response_chains[tier.tier].with_config(callbacks=[self.prompt_cache, self.tiers.usage[tier.tier]]).ainvoke(
+            {"query": prompt, "context": formatted_context, "context_hint": context_hint}, config)
+        if self.response_cache is not None:
+            await self.response_cache.store(state.get("query_embedding"), response)
+        if in_session(config):
+            # the turn's documents are not kept, only their ids; reused candidates stay paired with the query
+            # they were retrieved for, so a conversation drifting away from it searches again
+            update = {"messages": [response], "context": None, "candidates": None}
+            if not state.get("follows_on"):
+                embedding = state.get("query_embedding") or await self.embeddings.aembed_query(prompt)
+                update["last_turn"] = self.reuse.remember(prompt, embedding, candidates, treatments=treatments_to_discuss)
+            return update
         return {"messages": [response]}
     
-    def build_graph(self):
+    def build_graph(self, checkpointer: Optional[BaseCheckpointSaver] = None):
+        """sequential: query_from_history -> check_cache -> get_treatments_to_discuss -> respond.
+        speculative: prepare -> respond, where prepare overlaps the upstream calls (lower time to first token)."""
         builder = StateGraph(MainState)
+        builder.add_node('respond', self.respond)
+        if self.mode == "speculative":
+            builder.add_node('prepare', self.prepare)
+            builder.add_edge(START, 'prepare')
+            builder.add_conditional_edges('prepare', self.route_after_cache, ['respond', END])
+            builder.add_edge('respond', END)
+            return builder.compile(checkpointer=checkpointer)
+
         builder.add_node('query_from_history', self.query_from_history)
+        builder.add_node('check_cache', self.check_cache)
         #builder.add_node('get_subquestions', self.get_subquestions)
         #builder.add_node('answer_subquestion', self.answer_subquestion)
         builder.add_node('get_treatments_to_discuss', self.get_treatments_to_discuss)
-        builder.add_node('respond', self.respond)
 
         builder.add_edge(START, 'query_from_history')
-        builder.add_edge('query_from_history', 'get_treatments_to_discuss')
+        builder.add_edge('query_from_history', 'check_cache')
+        builder.add_conditional_edges('check_cache', self.route_after_cache, ['get_treatments_to_discuss', END])
         builder.add_edge('get_treatments_to_discuss', 'respond')
         #builder.add_conditional_edges('get_subquestions', self.send_subquestions, ['answer_subquestion'])
         #builder.add_edge('answer_subquestion', 'respond')
         builder.add_edge('respond', END)
-        graph = builder.compile()
+        graph = builder.compile(checkpointer=checkpointer)
         return graph
-    
-g = MainGraph()
-graph = g.graph
\ No newline at end of file
+
+def corpus_files() -> list[Path]:
+    """What a graph is built from: replacing any of these is picked up by a corpus swap."""
+    current_dir = Path(__file__).resolve().parent
+    return [current_dir / aua_directory / "summaries" / DOCS_FILE, current_dir / aua_directory / "parents" / DOCS_FILE,
+            EXAMPLES_FILE]
+
+# the process-wide graph, one version per corpus: requests run on the version they started on (see server.py)
+corpus = CorpusRegistry("bph", lambda timings: MainGraph(timings=timings), corpus_files)
+
+def get_main_graph(timings: Optional[dict] = None) -> MainGraph:
+    """The current graph, built on first use, so importing this module loads nothing."""
+    return corpus.get(timings)
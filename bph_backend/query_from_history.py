@@ -1,3 +1,4 @@
+import re
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from .constants import QUERY_FROM_HISTORY_LLM
@@ -11,3 +12,16 @@ prompt = ChatPromptTemplate.from_messages([
 ])
 
 query_from_history_chain = prompt | QUERY_FROM_HISTORY_LLM | StrOutputParser()
+
+
+# follow-ups that lean on the previous turn ("what about the side effects?", "is it reversible?")
+_REFERS_BACK = re.compile(r"\b(it|its|this|that|these|those|they|them|their|there|one|ones|same|above|former|latter|previous|option|options|instead|else)\b", re.I)
+_CONTINUES = re.compile(r"^\s*(and|or|but|also|so|then|what about|how about|why|why not)\b", re.I)
+
+def needs_rewrite(query: str, last_response: str) -> bool:
+    """Cheap check for whether the query depends on the conversation; if not, the rewrite LLM call can be skipped."""
+    if not last_response:
+        return False
+    if len(query.split()) <= 4:
+        return True
+    return bool(_CONTINUES.search(query) or _REFERS_BACK.search(query))
@@ -1,12 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from .constants import CONV_LLM
+from .constants import CONV_LLM, CONV_SMALL_LLM, PROMPT_LAYOUT, PROMPT_CACHE_KEY
 
-template = """<context>
-{context}
-</context>
-
-You are a smart and helpful assistant who is an expert in BPH.
+instructions = """You are a smart and helpful assistant who is an expert in BPH.
 
 Given the query, use the provided context to create an accurate and succinct response.
 
@@ -17,30 +13,37 @@ Follow these instructions:
 4. Remember that the context does not have any organizational structure, so you must extract information systematically into your planned response structure. 
 5. Your plan should include ALL the entities that are needed to answer the query, but you should NOT exclude any.
 
-The provided context is very long and dense. Please be sure to use it to inform your response, but keep it concise and to the point. 
+The provided context is very long and dense. Please be sure to use it to inform your response, but keep it concise and to the point. """
 
-<REMEMBER>
+remember = """<REMEMBER>
 Think carefully before you answer, making sure your answer is complete and does not miss any important and relevant considerations.
-
 {context_hint}
-
 **IF THE USER'S QUERY IS NONSENSICAL, IRRELEVANT, OR NOT RELATED TO BPH, POLITELY RESPOND AND STEER THE CONVERSATION BACK ON TRACK.**
 
 Do not use any markdown tables in your response - the formatting currently does not support tables. 
-</REMEMBER>
-
+</REMEMBER>"""
 
-<rules>
+rules = """<rules>
 - KEEP YOUR RESPONSE VERY CONCISE, TO THE POINT, AND EASY TO UNDERSTAND. FOCUS ON ANSWERING THE QUERY, NOT INFO DUMPING.
 - Use patient friendly, non-technical language in your response (without directly saying "patient friendly language")
 - If you are discussing multiple treatments, focus on the discussion on what considerations the patient should take into account when choosing a treatment (e.g. efficacy, side effects, prostate size, patient values and characteristics, etc.)
         i.e. - try to act like a helpful patient decision aid. 
 </rules>"""
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", template),
-    ("human", "<query>{query}</query>" ),
-])
+if PROMPT_LAYOUT == "cache-prefix":
+    # static instructions first, then the retrieved context, then what is specific to this query:
+    # the provider caches the longest previously seen prompt prefix
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", instructions + "\n\n" + remember.format(context_hint="") + "\n\n\n" + rules),
+        ("system", "<context>\n{context}\n</context>"),
+        ("human", "{context_hint}\n\n<query>{query}</query>"),
+    ])
+else:
+    template = "<context>\n{context}\n</context>\n\n" + instructions + "\n\n" + remember.replace("{context_hint}", "\n{context_hint}\n") + "\n\n\n" + rules
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", template),
+        ("human", "<query>{query}</query>" ),
+    ])
 
 #prompt = ChatPromptTemplate([
 #    ('system', template),
@@ -48,7 +51,10 @@ prompt = ChatPromptTemplate.from_messages([
 #    ('ai', 'scratchpad: Thinking about the user query, here are some subquestions and my thoughts:\n\n{context}'),
 #])
 
-response_chain = prompt | CONV_LLM | StrOutputParser()
+response_chain = prompt | CONV_LLM.bind(prompt_cache_key=PROMPT_CACHE_KEY) | StrOutputParser()
+# the same prompt for the queries shared/model_tiers.py sends to the small model
+small_response_chain = prompt | CONV_SMALL_LLM.bind(prompt_cache_key=PROMPT_CACHE_KEY + "-small") | StrOutputParser()
+response_chains = {"big": response_chain, "small": small_response_chain}
 
 
 """carefully consider each part of it as a subquestion in order to frame how you will answer the question.
@@ -0,0 +1,165 @@
+import json
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableConfig
+from sklearn.linear_model import LogisticRegression
+
+from shared.embeddings import embedding_model_name
+from shared.persisted_index import fingerprint, load_or_build_index
+from shared.tracing import span
+from .choose_tx import SURGICAL_RULES, TREATMENT_ALIASES, TREATMENT_OPTIONS, choose_tx_chain
+
+EXAMPLES_FILE = Path(__file__).resolve().parent / "treatment_examples.json"
+FALLBACK_REASONS = ("low_confidence", "medical", "no_factors", "conflicting_factors")
+
+# ------------------------------------------------------------------- #
+# the facts the prompt's surgical table is keyed on, read off the query
+
+_VOLUME = re.compile(r"(\d+(?:\.\d+)?)\s*(?:cc|ml|mls|milliliters?|millilitres?|g|gm|grams?|cubic centimet(?:er|re)s?)\b")
+_SMALL = re.compile(r"\b(?:small|smaller|little|tiny) (?:prostate|gland)\b")
+_LARGE = re.compile(r"\b(?:very (?:large|big|enlarged)|huge|massive|giant|enormous) (?:prostate|gland)\b")
+_SEXUAL = re.compile(r"erecti|ejaculat|sexual|sex life|libido|impoten|poten(?:cy|t)\b|orgasm")
+_COMORBID = re.compile(r"blood thinner|anticoagul|antiplatelet|warfarin|coumadin|eliquis|apixaban|xarelto|rivaroxaban|"
+                       r"clopidogrel|plavix|bleeding|anesthe|anaesthe|heart (?:failure|disease|condition)|comorbid|"
+                       r"frail|high[- ]risk|stent|pacemaker|copd|poor health")
+_NAMED = {
+    'Endoscopic Enucleation (e.g. HoLEP, ThuLEP)': r"holep|thulep|enucleation",
+    'Greenlight Photovaporization': r"green ?light|photovapori[sz]ation|\bpvp\b",
+    'Transurethral Incision of the Prostate': r"\btuip\b|incision of the prostate|transurethral incision",
+    'TURP': r"\bturp\b|transurethral resection",
+    'iTIND/Temporarily Implanted Prostate Device': r"\bitind\b|temporar(?:y|ily) implanted",
+    'Urolift/Prostatic Urethral Lift': r"uro ?lift|urethral lift|\bpul\b|prostate lift",
+    'Rezum/Water Vapor Thermal Therapy WVTT': r"rezum|water vapou?r|\bwvtt\b|\bsteam\b",
+    'Aquablation RWT': r"aquablation|waterjet|water jet",
+    'Simple Prostatectomy (Open, Laparoscopic, Robotic)': r"simple prostatectomy|open prostatectomy|robotic prostatectomy",
+}
+_NAMED = {name: re.compile(pattern) for name, pattern in _NAMED.items()}
+
+
+def _canonical(treatments) -> set[str]:
+    return {TREATMENT_ALIASES.get(t, t) for t in treatments}
+
+
+def query_factors(query: str) -> list[str]:
+    """SURGICAL_RULES keys that apply to `query`."""
+    query = query.lower()
+    factors = []
+    volume = _VOLUME.search(query)
+    if volume:
+        cc = float(volume.group(1))
+        factors.append('size_under_30' if cc < 30 else 'size_30_80' if cc <= 80 else 'size_over_80')
+    elif _SMALL.search(query):
+        factors.append('size_under_30')
+    elif _LARGE.search(query):
+        factors.append('size_over_80')
+    if _SEXUAL.search(query):
+        factors.append('sexual_preservation')
+    if _COMORBID.search(query):
+        factors.append('comorbid')
+    return factors
+
+
+def named_treatments(query: str) -> set[str]:
+    query = query.lower()
+    return {name for name, pattern in _NAMED.items() if pattern.search(query)}
+
+
+def rule_treatments(query: str) -> tuple[Optional[list[str]], str]:
+    """Treatments the surgical table gives for `query`, with how they were found; None when the
+    table cannot decide (no factor and no treatment named, or factors with nothing in common)."""
+    factors, named = query_factors(query), named_treatments(query)
+    if factors:
+        # every factor present has to be satisfied
+        chosen = set.intersection(*(_canonical(SURGICAL_RULES[f]) for f in factors))
+        if not chosen:
+            return None, "conflicting_factors"
+        chosen |= named
+    elif named:
+        chosen = named
+    else:
+        return None, "no_factors"
+    return [t for t in TREATMENT_OPTIONS if t in chosen], "rules" if factors else "named"
+
+
+class TreatmentSelector(object):
+    """choose_tx_chain's contract ({"query"} -> {"treatments_to_discuss"}) answered locally.
+
+    A logistic regression over the query embedding sorts the query into none (nothing to look up),
+    medical or procedural; a procedural query gets its treatments from the prompt's surgical table
+    (rule_treatments). Medical queries (free-form drug and lifestyle names), low-confidence
+    predictions and queries the table cannot decide go to the LLM selector.
+    """
+
+    def __init__(self, embeddings: Embeddings, vectors: np.ndarray, intents: list[str],
+                 min_confidence: float = 0.7, fallback=choose_tx_chain):
+        self.embeddings = embeddings
+        # unit-norm embeddings and a hundred examples: the default C=1 leaves every probability near 1/3
+        self.model = LogisticRegression(C=30.0, max_iter=2000, class_weight="balanced").fit(vectors, intents)
+        self.min_confidence = min_confidence
+        self.fallback = fallback
+        self.decisions = Counter()
+        self.local_seconds = 0.0
+
+    def predict(self, vector) -> tuple[str, float]:
+        probabilities = self.model.predict_proba(np.asarray(vector, dtype=np.float32)[None])[0]
+        best = int(np.argmax(probabilities))
+        return self.model.classes_[best], float(probabilities[best])
+
+    def select(self, query: str, vector) -> tuple[Optional[list[str]], str]:
+        """(treatments, reason); treatments is None when the LLM has to decide."""
+        intent, confidence = self.predict(vector)
+        if confidence < self.min_confidence:
+            return None, "low_confidence"
+        if intent == "none":
+            return [], "none"
+        if intent == "medical":
+            return None, "medical"
+        return rule_treatments(query)
+
+    async def ainvoke(self, inputs: dict, config: Optional[RunnableConfig] = None) -> dict:
+        query = inputs["query"]
+        start = time.perf_counter()
+        # the same query is embedded for the response cache and retrieval: a cache hit for one of them
+        vector = await self.embeddings.aembed_query(query)
+        with span("classify", "treatment_selector"):
+            treatments, reason = self.select(query, vector)
+        self.local_seconds += time.perf_counter() - start
+        self.decisions[reason] += 1
+        if treatments is None:
+            return await self.fallback.ainvoke(inputs, config)
+        return {"treatments_to_discuss": treatments}
+
+    def metrics(self) -> dict:
+        total = sum(self.decisions.values())
+        fallbacks = sum(self.decisions[reason] for reason in FALLBACK_REASONS)
+        return {
+            "requests": total,
+            "local": total - fallbacks,
+            "fallback_share": round(fallbacks / total, 3) if total else 0.0,
+            "mean_local_ms": round(self.local_seconds / total * 1000, 2) if total else 0.0,
+            "decisions": dict(self.decisions),
+        }
+
+
+def load_examples(path: Path = EXAMPLES_FILE) -> list[Document]:
+    with open(path) as file:
+        examples = json.load(file)["examples"]
+    return [Document(page_content=e["query"], metadata={"intent": e["intent"]}) for e in examples]
+
+
+def load_treatment_selector(cache_dir: Path, embeddings: Embeddings, min_confidence: float = 0.7,
+                            fallback=choose_tx_chain) -> TreatmentSelector:
+    """TreatmentSelector trained on treatment_examples.json, whose embeddings are built once per
+    (examples, embedding model) under `cache_dir` and memory-mapped afterwards."""
+    key = fingerprint([EXAMPLES_FILE], embedding_model_name(embeddings))
+    examples = load_or_build_index(cache_dir, key, load_examples, embeddings)
+    vectors = examples.index.reconstruct_n(0, examples.index.ntotal)
+    intents = [examples.docstore.search(examples.index_to_docstore_id[i]).metadata["intent"] for i in range(len(vectors))]
+    return TreatmentSelector(embeddings, vectors, intents, min_confidence, fallback)
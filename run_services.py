@@ -1,11 +1,29 @@
+import argparse
+import hmac
+import logging
+import multiprocessing
+import os
 import uvicorn
 import asyncio
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from bph_backend.server import run_graph as run_graph_bph
+from bph_backend.main_graph import corpus as bph_corpus
 from all_guidelines_backend.server import run_graph as run_graph_all_guidelines
+from all_guidelines_backend.main_graph import corpus as all_guidelines_corpus
+from bph_backend import constants as bph_constants
+from all_guidelines_backend import constants as all_guidelines_constants
+from shared.admission import AdmissionLimiter, Rejected
+from shared.corpus import CorpusRegistry
+from shared.readiness import Component
+from shared.streaming import MEDIA_TYPES, STREAM_HEADERS, StreamStats, framed, negotiate
+from shared.tracing import PROMETHEUS_MEDIA_TYPE, render_prometheus
+from shared.upstream import upstream_metrics
 
 origins = [
     "http://localhost:8501", 
@@ -13,8 +31,152 @@ origins = [
     "https://tli.koyeb.app",
 ]
 
-bph_app = FastAPI()
-all_guidelines_app = FastAPI()
+# chat requests that arrive while a backend is still loading wait this long, then get a 503
+READY_WAIT_S = 20
+RETRY_AFTER_S = 5
+
+# request summaries at debug level; message content (patient text) is never logged
+logger = logging.getLogger("tli.chat")
+
+# POST /admin/reload needs this in its X-Admin-Token header; unset, the endpoint is disabled
+ADMIN_TOKEN = os.getenv("TLI_ADMIN_TOKEN")
+
+# both backends load concurrently in worker threads once their server starts; ports bind immediately.
+# The component is the first corpus version; later versions are swapped in by the corpus registry
+bph_backend = Component("bph", lambda timings: bph_corpus.get(timings))
+all_guidelines_backend = Component("all_guidelines", lambda timings: all_guidelines_corpus.get(timings))
+
+
+# bounded concurrency per app; a slot is held for the whole streamed response
+bph_admission = AdmissionLimiter("bph", bph_constants.CHAT_MAX_CONCURRENT,
+                                 bph_constants.CHAT_MAX_QUEUE, bph_constants.CHAT_QUEUE_TIMEOUT_S)
+all_guidelines_admission = AdmissionLimiter("all_guidelines", all_guidelines_constants.CHAT_MAX_CONCURRENT,
+                                            all_guidelines_constants.CHAT_MAX_QUEUE, all_guidelines_constants.CHAT_QUEUE_TIMEOUT_S)
+
+
+def lifespan(component: Component, corpus: CorpusRegistry, watch_interval_s: Optional[float]):
+    @asynccontextmanager
+    async def start_loading(app: FastAPI):
+        component.start()
+        watcher = asyncio.create_task(corpus.watch(watch_interval_s)) if watch_interval_s else None
+        yield
+        if watcher is not None:
+            watcher.cancel()
+    return start_loading
+
+
+def log_chat(backend: str, body: dict):
+    messages = body.get("messages")
+    logger.debug("%s /chat: %d messages, session %s", backend, len(messages) if isinstance(messages, list) else 0,
+                 "yes" if body.get("session_id") else "no")
+
+
+async def not_ready(component: Component):
+    """None once `component` is ready; otherwise the 503 to send after waiting READY_WAIT_S."""
+    if await component.wait(READY_WAIT_S):
+        return None
+    return JSONResponse(
+        {"detail": f"{component.name} backend is {component.state}", "status": component.status()},
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_S)},
+    )
+
+
+async def admitted_stream(request: Request, format: Optional[str], limiter: AdmissionLimiter, component: Component,
+                          events, constants, stats: StreamStats):
+    """Admit the request, wait for the backend, then stream framed events; rejections come back as 429/503."""
+    try:
+        release = await limiter.admit()
+    except Rejected as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+    try:
+        if (response := await not_ready(component)) is not None:
+            release()
+            return response
+    except BaseException:
+        release()
+        raise
+
+    format = negotiate(format, request.headers.get("accept", ""))
+    stream = framed(events(), format, constants.STREAM_FLUSH_MS / 1000, constants.STREAM_MAX_BATCH_CHARS,
+                    constants.STREAM_HEARTBEAT_S, stats, disconnected=request.is_disconnected)
+
+    async def held():
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            release()
+
+    async def close():
+        # runs after the response, also when the client disconnected mid-stream: stops the graph run
+        release()
+        await stream.aclose()
+    return StreamingResponse(held(), media_type=MEDIA_TYPES[format], headers=STREAM_HEADERS, background=BackgroundTask(close))
+
+
+def add_health_routes(app: FastAPI, component: Component, limiter: AdmissionLimiter, stats: StreamStats, corpus: CorpusRegistry):
+    @app.get("/health")
+    async def health():
+        # liveness: the process is serving, whatever the load state
+        return {"status": "ok", component.name: component.status()}
+
+    @app.get("/ready")
+    async def ready():
+        return JSONResponse({"ready": component.ready, component.name: component.status()},
+                            status_code=200 if component.ready else 503)
+
+    @app.get("/metrics")
+    async def metrics(request: Request, format: Optional[str] = None):
+        # the graph serving new requests, which a corpus swap replaces
+        graph = corpus.current.value if component.ready else None
+        snapshot = {"admission": limiter.metrics(), "streams": stats.metrics(), "upstreams": upstream_metrics(),
+                    "corpus": corpus.metrics(),
+                    "context": graph.context.metrics() if graph else None,
+                    "response_cache": graph.response_cache.stats() if graph and graph.response_cache else None,
+                    "prompt_cache": graph.prompt_cache.metrics() if graph else None,
+                    "respond_tiers": graph.tiers.metrics() if graph else None,
+                    "batching": {name: b.metrics() for name, b in graph.batching.items()} if graph else None,
+                    "sessions": {**(graph.sessions.metrics() if hasattr(graph.sessions, "metrics") else {}), **graph.reuse.metrics()}
+                                if graph and graph.sessions is not None else None,
+                    "treatment_selector": selector.metrics() if (selector := getattr(graph, "treatment_selector", None)) else None}
+        # Prometheus scrapers ask for text/plain or OpenMetrics; everyone else gets the JSON
+        accept = request.headers.get("accept", "")
+        if format == "prometheus" or (format is None and ("text/plain" in accept or "openmetrics" in accept)):
+            return PlainTextResponse(render_prometheus({component.name: snapshot}), media_type=PROMETHEUS_MEDIA_TYPE)
+        return snapshot
+
+
+def add_admin_routes(app: FastAPI, component: Component, corpus: CorpusRegistry):
+    @app.get("/admin/corpus")
+    async def corpus_status():
+        return {"signature": corpus.signature(), **corpus.metrics()}
+
+    @app.post("/admin/reload")
+    async def reload(request: Request):
+        """Load the corpus files as they are now and switch new requests to them; streams in progress finish on the old version."""
+        if ADMIN_TOKEN is None:
+            return JSONResponse({"detail": "reload is disabled: set TLI_ADMIN_TOKEN"}, status_code=404)
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+            return JSONResponse({"detail": "bad admin token"}, status_code=403)
+        if not component.ready or corpus.loading:
+            return JSONResponse({"detail": f"{component.name} corpus is loading", "corpus": corpus.metrics()}, status_code=409)
+        try:
+            return await corpus.reload()
+        except Exception:
+            # the current version keeps serving
+            return JSONResponse({"detail": "reload failed", "error": corpus.last_error}, status_code=500)
+
+
+bph_app = FastAPI(lifespan=lifespan(bph_backend, bph_corpus, bph_constants.CORPUS_WATCH_INTERVAL_S))
+all_guidelines_app = FastAPI(lifespan=lifespan(all_guidelines_backend, all_guidelines_corpus,
+                                               all_guidelines_constants.CORPUS_WATCH_INTERVAL_S))
+bph_streams = StreamStats()
+all_guidelines_streams = StreamStats()
+add_health_routes(bph_app, bph_backend, bph_admission, bph_streams, bph_corpus)
+add_health_routes(all_guidelines_app, all_guidelines_backend, all_guidelines_admission, all_guidelines_streams, all_guidelines_corpus)
+add_admin_routes(bph_app, bph_backend, bph_corpus)
+add_admin_routes(all_guidelines_app, all_guidelines_backend, all_guidelines_corpus)
 
 bph_app.add_middleware(
     CORSMiddleware,
@@ -45,9 +207,11 @@ async def chat(input: dict):
 
 
 @bph_app.post("/chat")
-async def chat(input: dict):
-    print("BPH: ", input)
+async def chat(input: dict, request: Request, format: Optional[str] = None):
+    log_chat("bph", input)
     last_response = ""
+    # optional: a client that sends the same session_id on each turn gets its earlier retrieval reused
+    session_id = input.get("session_id")
     try:
         input = input.get("messages", [])
         query = input[-1]['content'][0]['text']
@@ -59,12 +223,15 @@ async def chat(input: dict):
         {"role": "ai", "content": last_response},
         {"role": "human", "content": query}
     ]
-    return StreamingResponse(run_graph_bph(payload))
+    return await admitted_stream(request, format, bph_admission, bph_backend, lambda: run_graph_bph(payload, session_id),
+                                 bph_constants, bph_streams)
 
 @all_guidelines_app.post("/chat")
-async def chat(input: dict):
-    print("CUA: ", input)
+async def chat(input: dict, request: Request, format: Optional[str] = None):
+    log_chat("all_guidelines", input)
     last_response = ""
+    # optional: a client that sends the same session_id on each turn gets its earlier retrieval reused
+    session_id = input.get("session_id")
     try:
         input = input.get("messages", [])
         query = input[-1]['content'][0]['text']
@@ -76,12 +243,13 @@ async def chat(input: dict):
         {"role": "ai", "content": last_response},
         {"role": "human", "content": query}
     ]
-    return StreamingResponse(run_graph_all_guidelines(payload))
+    return await admitted_stream(request, format, all_guidelines_admission, all_guidelines_backend,
+                                 lambda: run_graph_all_guidelines(payload, session_id), all_guidelines_constants, all_guidelines_streams)
 
 
-async def run_servers():
-    config_bph = uvicorn.Config(bph_app, host="0.0.0.0", port=8000)
-    config_all_guidelines = uvicorn.Config(all_guidelines_app, host="0.0.0.0", port=8001)
+async def run_servers(bph_port: int = 8000, all_guidelines_port: int = 8001):
+    config_bph = uvicorn.Config(bph_app, host="0.0.0.0", port=bph_port)
+    config_all_guidelines = uvicorn.Config(all_guidelines_app, host="0.0.0.0", port=all_guidelines_port)
 
     server_bph = uvicorn.Server(config_bph)
     server_all_guidelines = uvicorn.Server(config_all_guidelines)
@@ -91,5 +259,23 @@ async def run_servers():
         server_all_guidelines.serve(),
     )
 
+def serve(app: str, port: int, workers: int):
+    uvicorn.run(app, host="0.0.0.0", port=port, workers=workers)
+
+
 if __name__ == "__main__":
-    asyncio.run(run_servers())
+    parser = argparse.ArgumentParser()
+    # indexes and docstores are memory-mapped, so extra workers share one page-cache copy of them
+    parser.add_argument("--workers", type=int, default=1, help="worker processes per app")
+    args = parser.parse_args()
+    if args.workers == 1:
+        asyncio.run(run_servers())
+    else:
+        processes = [
+            multiprocessing.Process(target=serve, args=("run_services:bph_app", 8000, args.workers)),
+            multiprocessing.Process(target=serve, args=("run_services:all_guidelines_app", 8001, args.workers)),
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,314 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import httpx
+import numpy as np
+
+# ------------------------------------------------------------------- #
+# both backends call the same OpenAI and Cohere accounts, so upstream budgets are per process;
+# None disables a budget
+
+UPSTREAM_MAX_CONCURRENT = {
+    "llm": 24,          # chat completions, streamed responses hold their slot until the stream closes
+    "embeddings": 16,
+    "rerank": 8,
+}
+UPSTREAM_WAIT_TIMEOUT_S = 30        # then the call fails with httpx.PoolTimeout (the SDKs retry it)
+
+# ------------------------------------------------------------------- #
+
+class WaitStats(object):
+    """Counters and a sliding window of recent wait / service times (seconds)."""
+
+    def __init__(self, window: int = 1024):
+        self.waits = deque(maxlen=window)
+        self.services = deque(maxlen=window)
+        self.admitted = 0
+        self.rejected: dict[str, int] = {}
+        self.max_queued = 0
+
+    def reject(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def summary(self) -> dict:
+        waits, services = np.array(self.waits), np.array(self.services)
+        return {
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "max_queued": self.max_queued,
+            "wait_ms_p50": round(float(np.percentile(waits, 50)) * 1000, 1) if len(waits) else 0.0,
+            "wait_ms_p99": round(float(np.percentile(waits, 99)) * 1000, 1) if len(waits) else 0.0,
+            **({"service_ms_p50": round(float(np.percentile(services, 50)) * 1000, 1)} if len(services) else {}),
+        }
+
+
+class Rejected(Exception):
+    """Raised by AdmissionLimiter.admit; maps to an HTTP response with a Retry-After header."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionLimiter(object):
+    """At most `max_concurrent` requests in flight on one event loop, with a bounded FIFO wait queue.
+
+    A request that finds the queue full is rejected at once (429); one that waits longer than
+    `queue_timeout_s` is rejected with a 503. Retry-After is estimated from recent service times.
+    """
+
+    def __init__(self, name: str, max_concurrent: Optional[int], max_queue: int, queue_timeout_s: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self._queue: deque[asyncio.Future] = deque()
+        self.stats = WaitStats()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def retry_after(self) -> int:
+        service = float(np.median(self.stats.services)) if self.stats.services else 1.0
+        return max(1, math.ceil(service * (self.queued + 1) / (self.max_concurrent or 1)))
+
+    async def admit(self) -> Callable[[], None]:
+        """Wait for a slot; returns an idempotent release function. Raises Rejected."""
+        start = time.perf_counter()
+        if self.max_concurrent is not None and (self.in_flight >= self.max_concurrent or self._queue):
+            if len(self._queue) >= self.max_queue:
+                self.stats.reject("queue_full")
+                raise Rejected(429, self.retry_after(), f"{self.name}: too many requests queued")
+            future = asyncio.get_running_loop().create_future()
+            self._queue.append(future)
+            self.stats.max_queued = max(self.stats.max_queued, len(self._queue))
+            try:
+                await asyncio.wait_for(future, self.queue_timeout_s)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future in self._queue:
+                    self._queue.remove(future)
+                elif future.done() and not future.cancelled():
+                    self._release()     # a slot was handed over just as we gave up; pass it on
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats.reject("queue_timeout")
+                    raise Rejected(503, self.retry_after(), f"{self.name}: timed out waiting for capacity")
+                raise
+        else:
+            self.in_flight += 1
+        admitted = time.perf_counter()
+        self.stats.admitted += 1
+        self.stats.waits.append(admitted - start)
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.stats.services.append(time.perf_counter() - admitted)
+                self._release()
+        return release
+
+    def _release(self):
+        # hand the slot straight to the oldest waiter, so in_flight never dips below the limit
+        while self._queue:
+            future = self._queue.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def metrics(self) -> dict:
+        return {"in_flight": self.in_flight, "queued": self.queued, "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue, **self.stats.summary()}
+
+# ------------------------------------------------------------------- #
+
+class UpstreamBudget(object):
+    """Concurrency budget for one upstream API, shared by threads and the event loop.
+
+    Sync callers (SDK calls run in worker threads) block; async callers wait on a future. Slots are
+    handed over FIFO on release.
+    """
+
+    def __init__(self, name: str, max_concurrent: Optional[int], wait_timeout_s: float = UPSTREAM_WAIT_TIMEOUT_S):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.wait_timeout_s = wait_timeout_s
+        self.in_use = 0
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+        self.stats = WaitStats()
+
+    def _take(self) -> bool:
+        if self.max_concurrent is None or (self.in_use < self.max_concurrent and not self._waiters):
+            self.in_use += 1
+            self.stats.admitted += 1
+            return True
+        return False
+
+    def _queued(self, waiter):
+        self._waiters.append(waiter)
+        self.stats.max_queued = max(self.stats.max_queued, len(self._waiters))
+
+    def acquire(self):
+        start = time.perf_counter()
+        with self._lock:
+            if self._take():
+                self.stats.waits.append(0.0)
+                return
+            event = threading.Event()
+            self._queued(event)
+        if not event.wait(self.wait_timeout_s):
+            with self._lock:
+                if event in self._waiters:
+                    self._waiters.remove(event)
+                    self.stats.reject("timeout")
+                    raise TimeoutError(f"{self.name} budget: no slot after {self.wait_timeout_s}s")
+        self.stats.admitted += 1
+        self.stats.waits.append(time.perf_counter() - start)
+
+    async def aacquire(self):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                self.stats.waits.append(0.0)
+                return
+            future = loop.create_future()
+            self._queued((loop, future))
+        try:
+            await asyncio.wait_for(future, self.wait_timeout_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                waiting = (loop, future) in self._waiters
+                if waiting:
+                    self._waiters.remove((loop, future))
+            if not waiting and future.done() and not future.cancelled():
+                self.release()      # handed a slot just as we gave up; a cancelled future's slot is passed on by _wake
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats.reject("timeout")
+                raise TimeoutError(f"{self.name} budget: no slot after {self.wait_timeout_s}s") from None
+            raise
+        self.stats.admitted += 1
+        self.stats.waits.append(time.perf_counter() - start)
+
+    def _wake(self, future: asyncio.Future):
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._wake, future)
+                    return
+                except RuntimeError:
+                    continue    # that waiter's loop has closed
+            self.in_use -= 1
+
+    def metrics(self) -> dict:
+        return {"in_use": self.in_use, "queued": len(self._waiters), "max_concurrent": self.max_concurrent,
+                **self.stats.summary()}
+
+
+class _ReleasingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Response body that gives the budget slot back once the body is read or the response closed."""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def _done(self):
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._done()
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._done()
+
+
+def _hold_until_read(response: httpx.Response, budget: UpstreamBudget) -> httpx.Response:
+    if isinstance(response.stream, httpx.ByteStream):
+        budget.release()    # body already in memory
+    else:
+        response.stream = _ReleasingStream(response.stream, budget.release)
+    return response
+
+
+class BudgetedTransport(httpx.BaseTransport):
+    def __init__(self, budget: UpstreamBudget, transport: Optional[httpx.BaseTransport] = None):
+        self.budget = budget
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            self.budget.acquire()
+        except TimeoutError as e:
+            raise httpx.PoolTimeout(str(e), request=request)
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self.budget.release()
+            raise
+        return _hold_until_read(response, self.budget)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncBudgetedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, budget: UpstreamBudget, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.budget = budget
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            await self.budget.aacquire()
+        except TimeoutError as e:
+            raise httpx.PoolTimeout(str(e), request=request)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.budget.release()
+            raise
+        return _hold_until_read(response, self.budget)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+# ------------------------------------------------------------------- #
+
+# process-wide budgets; shared/upstream.py puts them in front of every upstream client
+UPSTREAMS = {name: UpstreamBudget(name, limit) for name, limit in UPSTREAM_MAX_CONCURRENT.items()}
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# ------------------------------------------------------------------- #
+# cross-request micro-batching of retrieval: query embeddings and single-vector index searches
+# that arrive within `window_ms` of each other, from any number of concurrent requests, go out as
+# one embeddings call and one faiss search; each caller gets its own row back
+
+class BatchStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.batches = 0
+        self.largest = 0
+        self.waited = 0.0
+
+    def record(self, size: int, waited: float):
+        self.calls += size
+        self.batches += 1
+        self.largest = max(self.largest, size)
+        self.waited += waited
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "batches": self.batches,
+            "mean_batch": round(self.calls / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest,
+            "mean_window_ms": round(self.waited / self.batches * 1000, 2) if self.batches else 0.0,
+        }
+
+
+class BatchedEmbeddings(Embeddings):
+    """Concurrent aembed_query calls on one event loop are sent as one aembed_documents call.
+
+    Only for models whose query and document embeddings are the same (OpenAI's are). The sync
+    methods, used when indexes are built, pass straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, window_ms: float = 3.0, max_batch: int = 64):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.stats = BatchStats()
+        self._pending: dict[asyncio.AbstractEventLoop, tuple[float, list]] = {}
+
+    @property
+    def model(self) -> str:
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if loop not in self._pending:
+            batch = []
+            self._pending[loop] = (time.perf_counter(), batch)
+            loop.call_later(self.window, self._flush, loop, batch)
+        batch = self._pending[loop][1]
+        batch.append((text, future))
+        if len(batch) >= self.max_batch:
+            self._flush(loop, batch)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop, batch: list):
+        pending = self._pending.get(loop)
+        # a full batch is flushed before its timer fires
+        if pending is not None and pending[1] is batch:
+            del self._pending[loop]
+            self.stats.record(len(batch), time.perf_counter() - pending[0])
+            loop.create_task(self._embed(batch))
+
+    async def _embed(self, batch: list):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = dict(zip(texts, await self.embeddings.aembed_documents(texts)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    def metrics(self) -> dict:
+        return self.stats.metrics()
+
+
+class _Search(object):
+    __slots__ = ("queries", "ks", "started", "full", "done", "results", "error")
+
+    def __init__(self):
+        self.queries: list[np.ndarray] = []
+        self.ks: list[int] = []
+        self.started = time.perf_counter()
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error: Optional[BaseException] = None
+
+
+class BatchedIndex(object):
+    """Wraps a faiss index (vectorstore.index): single-vector search() calls made concurrently
+    (langchain runs them in executor threads) within `window_ms` run as one search over all the
+    vectors, at the largest k asked for. Searches with params, or several vectors, pass through."""
+
+    def __init__(self, index, window_ms: float = 3.0, max_batch: int = 64):
+        self._index = index
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.stats = BatchStats()
+        self._lock = threading.Lock()
+        self._pending: Optional[_Search] = None
+
+    def search(self, x: np.ndarray, k: int, params=None, **kwargs):
+        if params is not None or kwargs or len(x) != 1:
+            return self._index.search(x, k, params=params, **kwargs)
+        with self._lock:
+            batch, leader = self._pending, self._pending is None
+            if leader:
+                batch = self._pending = _Search()
+            slot = len(batch.queries)
+            batch.queries.append(x[0])
+            batch.ks.append(k)
+            if len(batch.queries) >= self.max_batch:
+                self._pending = None
+                batch.full.set()
+        if leader:
+            # the first caller waits out the window, then searches for everyone
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        distances, labels = batch.results
+        return distances[slot:slot + 1, :k], labels[slot:slot + 1, :k]
+
+    def _run(self, batch: _Search):
+        self.stats.record(len(batch.queries), time.perf_counter() - batch.started)
+        try:
+            batch.results = self._index.search(np.stack(batch.queries), max(batch.ks))
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def metrics(self) -> dict:
+        return self.stats.metrics()
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._index, attr)
@@ -0,0 +1,185 @@
+import hashlib
+import itertools
+import re
+from typing import Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .lru import LRUCache
+from .retrieval_cache import document_key
+
+SEPARATOR = "\n\n"
+ENCODING = "o200k_base"             # gpt-4.1 / gpt-4o / gpt-4o-mini
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_encoding = None
+
+# ------------------------------------------------------------------- #
+
+def _encoder():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING)
+        except Exception:
+            # tiktoken missing, or its BPE file not downloadable (offline): estimate instead
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoder()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def content_hash(text: str) -> str:
+    """Identical up to case and whitespace."""
+    return hashlib.sha1(" ".join(text.lower().split()).encode()).hexdigest()
+
+
+def lexical_vector(text: str, size: int = 1024) -> np.ndarray:
+    """Signed hashing of word unigrams and bigrams, L2-normalised (like HashingEmbeddings, but only
+    comparable within one process: it uses the built-in, per-process salted hash)."""
+    words = _TOKEN.findall(text.lower())
+    hashes = np.fromiter((hash(t) for t in itertools.chain(words, zip(words, words[1:]))), dtype=np.int64)
+    vector = np.bincount(hashes % size, weights=np.where(hashes & (1 << 40), 1.0, -1.0), minlength=size).astype(np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def interleave(lookups: list[list[Document]]) -> list[Document]:
+    """Round-robin by rank: every lookup's first document, then every second one, ..."""
+    return [doc for rank in itertools.zip_longest(*lookups) for doc in rank if doc is not None]
+
+
+class ContextStats(object):
+    def __init__(self):
+        self.assembled = 0
+        self.docs_in = 0
+        self.docs_out = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def metrics(self) -> dict:
+        return {
+            "assembled": self.assembled,
+            "docs_in": self.docs_in,
+            "docs_out": self.docs_out,
+            "duplicates": self.duplicates,
+            "over_budget": self.over_budget,
+            "prompt_tokens_saved": self.tokens_in - self.tokens_out,
+            "saved_ratio": round(1 - self.tokens_out / self.tokens_in, 3) if self.tokens_in else 0.0,
+            "tokens_per_prompt": round(self.tokens_out / self.assembled, 1) if self.assembled else 0.0,
+        }
+
+
+class ContextBudgeter(object):
+    """Assembles the `context` prompt variable from the results of one or more retrieval lookups.
+
+    Each lookup's documents are in rank order; lookups are interleaved rank by rank, so every
+    lookup's best documents count as equally relevant. Then:
+    1. duplicates (same doc id, same normalised text, or lexical cosine >= `near_duplicate`) keep
+       their first, best-ranked occurrence;
+    2. the rest are picked in maximal-marginal-relevance order: rank-based relevance, weighed by
+       `mmr_lambda` against similarity to what is already picked;
+    3. picks are packed until `max_tokens` (counted with tiktoken) is reached; a document that does
+       not fit is skipped in favour of later, shorter ones. None disables the budget.
+
+    With `stable_order` the picks are written out lookup by lookup, in the order the lookups are
+    given, and by document id within each, rather than by rank. Lookups whose results do not depend
+    on the query should then come first: requests sharing them send the same prompt prefix
+    (provider prompt caching).
+
+    Similarity is lexical (see lexical_vector), so no upstream call is made.
+    """
+
+    def __init__(self, max_tokens: Optional[int], mmr_lambda: float = 0.7, near_duplicate: float = 0.9,
+                 stable_order: bool = False, maxsize: int = 4096):
+        self.max_tokens = max_tokens
+        self.stable_order = stable_order
+        self.mmr_lambda = mmr_lambda
+        self.near_duplicate = near_duplicate
+        self.stats = ContextStats()
+        # the corpus is small and retrieved over and over: token counts and vectors are kept per text
+        self._profiles = LRUCache(maxsize)
+        # load (or download) the tokenizer while the backend is built, not in the first request
+        _encoder()
+
+    def _profile(self, text: str) -> tuple[str, int, np.ndarray]:
+        """(content hash, tokens, lexical vector) of `text`."""
+        profile = self._profiles.get(text)
+        if profile is None:
+            profile = (content_hash(text), count_tokens(text), lexical_vector(text))
+            self._profiles.put(text, profile)
+        return profile
+
+    def _unique(self, docs: list[Document]) -> list[tuple[Document, tuple]]:
+        seen, unique = set(), []
+        for doc in docs:
+            profile = self._profile(doc.page_content)
+            keys = (document_key(doc), profile[0])
+            if seen.isdisjoint(keys):
+                unique.append((doc, profile))
+            seen.update(keys)
+        return unique
+
+    def select(self, docs: list[Document], max_tokens: Optional[int] = None) -> list[Document]:
+        """`docs` in rank order (see interleave) -> the documents to put in the prompt, in that order.
+        `max_tokens` lowers the budget for this call."""
+        unique = self._unique(docs)
+        duplicates = len(docs) - len(unique)
+        if not unique:
+            return []
+        vectors = np.stack([vector for _, (_, _, vector) in unique])
+        similarity = vectors @ vectors.T
+        relevance = 1.0 - np.arange(len(unique)) / len(unique)
+        budget = min(self.max_tokens if self.max_tokens is not None else float("inf"),
+                     max_tokens if max_tokens is not None else float("inf"))
+        remaining = list(range(len(unique)))
+        picked: list[int] = []
+        used = 0
+        while remaining:
+            redundancy = similarity[np.ix_(remaining, picked)].max(axis=1) if picked else np.zeros(len(remaining))
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = int(np.argmax(scores))
+            i = remaining.pop(best)
+            if redundancy[best] >= self.near_duplicate:
+                duplicates += 1
+                continue
+            tokens = unique[i][1][1]
+            if used + tokens > budget:
+                self.stats.over_budget += 1
+                continue
+            picked.append(i)
+            used += tokens
+        self.stats.duplicates += duplicates
+        return [unique[i][0] for i in picked]
+
+    def assemble(self, lookups: list[list[Document]], max_tokens: Optional[int] = None,
+                 layout: Optional[list[int]] = None) -> str:
+        """The formatted context for the results of `lookups` (in retrieval order, most important
+        first), within budget (or `max_tokens`, if lower). With stable_order, the selected documents
+        are written grouped by lookup, in the order of `layout` (lookup indices; default as given):
+        the layout never changes which documents are kept."""
+        docs = interleave(lookups)
+        selected = self.select(docs, max_tokens)
+        if self.stable_order:
+            source = {}
+            for position, i in enumerate(layout if layout is not None else range(len(lookups))):
+                for doc in lookups[i]:
+                    source.setdefault(document_key(doc), position)
+            selected.sort(key=lambda doc: (source[document_key(doc)], document_key(doc)))
+        self.stats.assembled += 1
+        self.stats.docs_in += len(docs)
+        self.stats.docs_out += len(selected)
+        self.stats.tokens_in += sum(self._profile(d.page_content)[1] for d in docs)
+        self.stats.tokens_out += sum(self._profile(d.page_content)[1] for d in selected)
+        return SEPARATOR.join(d.page_content for d in selected)
+
+    def metrics(self) -> dict:
+        return {"max_tokens": self.max_tokens, **self.stats.metrics()}
@@ -0,0 +1,54 @@
+"""Convert pickled docstores to docstore.bin (shared/mapped_docstore.py), which the backends load.
+
+    python -m shared.convert_docstores                  # the shipped ones: bph aua/, docs_vector, titles_vector
+    python -m shared.convert_docstores path/to/index    # a FAISS.save_local directory (index.pkl)
+
+Unpickling runs code from the file, so only convert pickles you built or shipped yourself.
+"""
+import argparse
+import pickle
+from pathlib import Path
+
+from .mapped_docstore import MappedDocstore, write_docstore
+from .persisted_index import LEGACY_DOCSTORE_FILE, convert_legacy_docstore
+
+ROOT = Path(__file__).resolve().parent.parent
+AUA = ROOT / "bph_backend" / "aua"
+SHIPPED_INDEXES = [ROOT / "all_guidelines_backend" / "docs_vector", ROOT / "all_guidelines_backend" / "titles_vector"]
+
+# ------------------------------------------------------------------- #
+
+def _unpickle(path: Path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def convert_aua(aua: Path = AUA):
+    """summary_docs.pkl -> aua/summaries (ids are list positions), doc_ids.pkl + docs.pkl -> aua/parents."""
+    summaries = _unpickle(aua / "summary_docs.pkl")
+    (aua / "summaries").mkdir(exist_ok=True)
+    write_docstore(aua / "summaries", [str(i) for i in range(len(summaries))], summaries)
+    doc_ids, docs = _unpickle(aua / "doc_ids.pkl"), _unpickle(aua / "docs.pkl")
+    (aua / "parents").mkdir(exist_ok=True)
+    write_docstore(aua / "parents", doc_ids, docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", type=Path, help=f"directories holding an {LEGACY_DOCSTORE_FILE}")
+    args = parser.parse_args()
+
+    if args.paths:
+        targets = args.paths
+    else:
+        convert_aua()
+        targets = SHIPPED_INDEXES
+        for name in ("summaries", "parents"):
+            print(f"{AUA / name}: {len(MappedDocstore(AUA / name))} documents")
+    for path in targets:
+        convert_legacy_docstore(path)
+        print(f"{path}: {len(MappedDocstore(path))} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import gc
+import hashlib
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+# ------------------------------------------------------------------- #
+# zero-downtime corpus updates: each backend's graph (its indexes, docstores and the caches tied to
+# them) is one version of its corpus. A new version is loaded next to the one serving, new requests
+# switch to it at once, and the old one is dropped when the last request still using it finishes.
+# Every worker process watches its sources for itself; POST /admin/reload swaps the worker it reaches.
+
+def source_signature(paths: Iterable[Path]) -> str:
+    """Changes whenever one of `paths` is replaced, rewritten, created or removed (size and mtime, no reads)."""
+    h = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        try:
+            stat = path.stat()
+            h.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        except FileNotFoundError:
+            h.update(f"{path}:missing;".encode())
+    return h.hexdigest()[:12]
+
+
+class CorpusVersion(object):
+    def __init__(self, version: str, value: Any, load_s: float):
+        self.version = version
+        self.value = value
+        self.load_s = load_s
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired_at: Optional[float] = None
+
+    def status(self) -> dict:
+        return {"version": self.version, "in_flight": self.in_flight, "load_s": round(self.load_s, 3),
+                "loaded_at": round(self.loaded_at, 3)}
+
+
+class CorpusRegistry(object):
+    """The loaded corpus of one backend, swapped without a restart.
+
+    Requests hold the version they started on for their whole run (`acquire`). `swap` builds a new
+    version with `load(timings)` while the current one keeps serving, then points new requests at
+    it; retired versions are released once their in-flight count drops to zero. `sources()` lists
+    the files a version is built from: `watch` swaps when they change.
+    """
+
+    def __init__(self, name: str, load: Callable[[dict], Any], sources: Callable[[], list[Path]] = lambda: []):
+        self.name = name
+        self.load = load
+        self.sources = sources
+        self.current: Optional[CorpusVersion] = None
+        self.retired: list[CorpusVersion] = []
+        self.swaps = 0
+        self.released = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()       # current, retired and in-flight counts
+        self._loading = threading.Lock()    # one load at a time
+
+    def signature(self) -> str:
+        return source_signature(self.sources())
+
+    @property
+    def loading(self) -> bool:
+        return self._loading.locked()
+
+    def get(self, timings: Optional[dict] = None) -> Any:
+        """The current version's value; the first call loads it."""
+        if self.current is None:
+            with self._loading:
+                if self.current is None:
+                    self._publish(self._build(timings))
+        return self.current.value
+
+    def _build(self, timings: Optional[dict]) -> CorpusVersion:
+        # taken before loading, so a change made during the load is picked up by the next swap
+        version = self.signature()
+        start = time.perf_counter()
+        value = self.load(timings if timings is not None else {})
+        return CorpusVersion(version, value, time.perf_counter() - start)
+
+    def _publish(self, new: CorpusVersion):
+        with self._lock:
+            old, self.current = self.current, new
+            if old is not None:
+                old.retired_at = time.time()
+                self.retired.append(old)
+                self.swaps += 1
+        self._release_idle()
+
+    def install(self, value: Any, version: Optional[str] = None):
+        """Make an already built `value` the current version."""
+        self._publish(CorpusVersion(version or f"installed-{self.swaps + 1}", value, 0.0))
+
+    def swap(self, timings: Optional[dict] = None) -> CorpusVersion:
+        """Load a new version and switch new requests to it; blocks for the whole load."""
+        with self._loading:
+            try:
+                new = self._build(timings)
+            except Exception:
+                self.failures += 1
+                self.last_error = traceback.format_exc(limit=3)
+                raise
+            self._publish(new)
+            return new
+
+    async def reload(self) -> dict:
+        """swap() in a worker thread: the current version serves every request until the new one is in place."""
+        timings = {}
+        previous = self.current.version if self.current is not None else None
+        new = await asyncio.to_thread(self.swap, timings)
+        return {"version": new.version, "previous": previous, "load_s": round(new.load_s, 3), "steps": timings}
+
+    @contextmanager
+    def acquire(self):
+        """The current version's value, kept alive until the block exits even if a swap retires it."""
+        self.get()
+        with self._lock:
+            version = self.current
+            version.in_flight += 1
+        try:
+            yield version.value
+        finally:
+            with self._lock:
+                version.in_flight -= 1
+            if version.retired_at is not None:
+                self._release_idle()
+
+    def _release_idle(self):
+        with self._lock:
+            idle = [v for v in self.retired if v.in_flight == 0]
+            self.retired = [v for v in self.retired if v.in_flight]
+            self.released += len(idle)
+        for version in idle:
+            version.value = None
+        if idle:
+            # a graph's nodes are its own bound methods: collect the cycle now so its indexes are unmapped at once
+            gc.collect()
+
+    async def watch(self, interval_s: float):
+        """Swap when the sources change, once they have stayed unchanged for a whole interval
+        (so a copy in progress is never loaded). A version that failed to load is not retried."""
+        seen, failed = None, None
+        while True:
+            await asyncio.sleep(interval_s)
+            if self.current is None or self.loading:
+                continue
+            signature = self.signature()
+            if signature != self.current.version and signature == seen and signature != failed:
+                try:
+                    await self.reload()
+                except Exception:
+                    failed = signature
+            seen = signature
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "current": self.current.status() if self.current is not None else None,
+                "retired": [v.status() for v in self.retired],
+                "loading": self.loading,
+                "swaps": self.swaps,
+                "released": self.released,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
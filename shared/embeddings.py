@@ -0,0 +1,56 @@
+import hashlib
+import re
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# ------------------------------------------------------------------- #
+
+class HashingEmbeddings(Embeddings):
+    """Local, offline stand-in for an embedding endpoint.
+
+    Word unigrams and bigrams are hashed into a fixed number of signed buckets and L2-normalised.
+    It has no semantic knowledge, but texts sharing vocabulary land close together, which is enough
+    to exercise ingestion, indexing and retrieval end to end without network access.
+    """
+
+    def __init__(self, size: int = 3072):
+        self.size = size
+        self.model = f"hashing-{size}"
+
+    def _bucket(self, token: str) -> tuple[int, float]:
+        digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+        return digest % self.size, 1.0 if digest >> 63 else -1.0
+
+    def _embed(self, text: str) -> list[float]:
+        words = _TOKEN.findall(text.lower())
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            bucket, sign = self._bucket(token)
+            vector[bucket] += sign
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def get_embeddings(name: str, model: str) -> Embeddings:
+    """`name` is "openai" (the production endpoint, using `model`) or "hashing" (local stand-in)."""
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model=model)
+    if name == "hashing":
+        return HashingEmbeddings()
+    raise ValueError(f"unknown embeddings backend: {name}")
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    return getattr(embeddings, "model", type(embeddings).__name__)
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Iterator
+
+_MISSING = object()
+
+# ------------------------------------------------------------------- #
+
+class LRUCache(object):
+    """Thread-safe LRU map with an optional per-entry time-to-live (seconds; None = no expiry)."""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        self.evictions = 0
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            stored_at, value = item
+            if self._expired(stored_at, time.monotonic()):
+                del self._data[key]
+                self.evictions += 1
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def items(self) -> Iterator[tuple[Hashable, Any]]:
+        """Snapshot of the live entries, oldest first; expired entries are dropped on the way."""
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (t, _) in self._data.items() if self._expired(t, now)]:
+                del self._data[key]
+                self.evictions += 1
+            return iter([(k, v) for k, (_, v) in self._data.items()])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
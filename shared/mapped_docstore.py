@@ -0,0 +1,147 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Sequence
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+# ------------------------------------------------------------------- #
+# One file per docstore, no pickle anywhere:
+#   header: magic, format version, document count, then the byte position of each section
+#   sections (8-byte aligned): three int64 offset tables (count + 1 entries each) into three
+#   blobs: ids (UTF-8), metadata (one JSON object per document) and text (UTF-8)
+# Opening it maps the file and decodes only the ids; a document is decoded when it is looked up.
+
+DOCS_FILE = "docstore.bin"
+MAGIC = b"TLIDOCS\x00"
+FORMAT_VERSION = 2                  # 1 was JSON records + docstore.offsets.npy + docstore.ids.json
+COLUMNS = ("ids", "metadata", "text")
+_HEADER = struct.Struct("<8sIIQ6Q")     # magic, version, reserved, count, 3 offset tables, 3 blobs
+_LEGACY_FILES = ("docstore.offsets.npy", "docstore.ids.json")
+
+# ------------------------------------------------------------------- #
+
+def _pad(position: int) -> int:
+    return -position % 8
+
+
+def write_docstore(directory: Path, ids: Sequence[str], documents: Sequence[Document]):
+    """Write `documents`, in `ids` order, to `directory`/docstore.bin (atomically replaced)."""
+    directory = Path(directory)
+    columns = {
+        "ids": [str(i).encode() for i in ids],
+        "metadata": [json.dumps(d.metadata, ensure_ascii=False, separators=(",", ":")).encode() for d in documents],
+        "text": [d.page_content.encode() for d in documents],
+    }
+    if len(columns["ids"]) != len(columns["metadata"]):
+        raise ValueError(f"{len(columns['ids'])} ids for {len(columns['metadata'])} documents")
+    tables = {name: np.concatenate([[0], np.cumsum([len(v) for v in values], dtype=np.int64)]).astype(np.int64)
+              for name, values in columns.items()}
+    starts, position = [], _HEADER.size
+    for name in COLUMNS:
+        starts.append(position)
+        position += tables[name].nbytes
+    for name in COLUMNS:
+        starts.append(position)
+        position += int(tables[name][-1])
+        position += _pad(position)
+
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".docstore-")
+    with os.fdopen(fd, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(columns["ids"]), *starts))
+        for name in COLUMNS:
+            file.write(tables[name].tobytes())
+        for name in COLUMNS:
+            for value in columns[name]:
+                file.write(value)
+            file.write(b"\0" * _pad(file.tell()))
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, directory / DOCS_FILE)
+    for legacy in _LEGACY_FILES:
+        (directory / legacy).unlink(missing_ok=True)
+
+
+def _read_header(data) -> tuple[int, list[int]]:
+    magic, version, _, count, *starts = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a docstore file")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"docstore format {version}, expected {FORMAT_VERSION}")
+    return count, starts
+
+
+class MappedDocstore(Docstore, BaseStore[str, Document]):
+    """Read-only documents served from a memory-mapped docstore.bin (see write_docstore).
+
+    Records are decoded on lookup, so the text stays in the page cache (one copy shared by every
+    worker process) instead of being materialised on each worker's heap. Usable both as a FAISS
+    docstore (`search`) and as a MultiVectorRetriever parent store (`mget`).
+    """
+
+    def __init__(self, directory: Path):
+        with open(Path(directory) / DOCS_FILE, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        count, starts = _read_header(self.data)
+        tables = [np.frombuffer(self.data, dtype=np.int64, count=count + 1, offset=start) for start in starts[:3]]
+        self._columns = {name: (table, blob) for name, table, blob in zip(COLUMNS, tables, starts[3:])}
+        self.ids = [self._value("ids", i).decode() for i in range(count)]
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    def _value(self, column: str, i: int) -> bytes:
+        table, blob = self._columns[column]
+        return self.data[blob + int(table[i]):blob + int(table[i + 1])]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _get(self, doc_id: str) -> Optional[Document]:
+        i = self.positions.get(doc_id)
+        if i is None:
+            return None
+        return Document(page_content=self._value("text", i).decode(), metadata=json.loads(self._value("metadata", i)), id=doc_id)
+
+    def search(self, search: str) -> Document | str:
+        doc = self._get(search)
+        return doc if doc is not None else f"ID {search} not found."
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[Document]]:
+        return [self._get(k) for k in keys]
+
+    def mset(self, key_value_pairs):
+        raise NotImplementedError("MappedDocstore is read-only")
+
+    def mdelete(self, keys):
+        raise NotImplementedError("MappedDocstore is read-only")
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        return (k for k in self.ids if prefix is None or k.startswith(prefix))
+
+    def documents(self) -> list[Document]:
+        """Every document, in stored order."""
+        return [self._get(doc_id) for doc_id in self.ids]
+
+
+def has_docstore(directory: Path) -> bool:
+    """A docstore.bin of the current format is in `directory`."""
+    try:
+        with open(Path(directory) / DOCS_FILE, 'rb') as file:
+            _read_header(file.read(_HEADER.size))
+        return True
+    except (OSError, ValueError, struct.error):
+        return False
+
+
+def load_or_build_docstore(directory: Path, load_pairs: Callable[[], list[tuple[str, Document]]]) -> MappedDocstore:
+    """Open the mapped docstore in `directory`, writing it from `load_pairs()` ((id, document) pairs) first if missing."""
+    directory = Path(directory)
+    if not has_docstore(directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        pairs = load_pairs()
+        write_docstore(directory, [i for i, _ in pairs], [d for _, d in pairs])
+    return MappedDocstore(directory)
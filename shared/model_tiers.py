@@ -0,0 +1,175 @@
+import logging
+import re
+import time
+from collections import Counter, deque
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+
+from .lru import LRUCache
+from .rerankers import tokenize
+from .tracing import log_json, span
+
+logger = logging.getLogger("tli.tiers")
+
+TIERS = ("small", "big")
+REASONS = ("trivial", "off_topic", "short_factual", "complex", "default")
+
+# ------------------------------------------------------------------- #
+# respond model tiering: every query is classified locally (no upstream call) from its wording and
+# the documents already retrieved for it, and answered by the small or the big chat model
+
+_SOCIAL = re.compile(r"^(hi|hello|hey|thanks|thank you|thank u|thx|ty|ok|okay|cool|great|perfect|awesome|got it|"
+                     r"good (morning|afternoon|evening)|bye|goodbye|cheers|yes|no|sure|nice|sounds good)\b", re.I)
+_COMPARES = re.compile(r"\b(compare[sd]?|comparison|versus|vs|differen(ce|ces|t)|differ|better|worse|best|pros and cons|"
+                       r"trade-?offs?|alternatives?|which (one|option|treatment|surgery|procedure|is|should|would))\b", re.I)
+# details of the patient's own situation turn a factual question into a decision to tailor
+_PERSONAL = re.compile(r"\b(\d+\s?(cc|ml|g|mg|years?|yo|y/o)|i('m| am| have| take| had|'ve)|my (prostate|psa|age|husband|father|wife))\b", re.I)
+_STOPWORDS = frozenset(
+    "a an and are as at be been but by can could do does for from had has have how i if in into is it its me my of on or "
+    "should so than that the their them then there these they this to was we what when where which who why will with would "
+    "you your about after before tell know need want much many more most any also there get".split())
+
+
+class TierDecision(NamedTuple):
+    tier: str                           # "small" or "big"
+    reason: str                         # one of REASONS
+    context_tokens: Optional[int]       # context budget for this answer; None: the default budget
+
+
+def content_words(text: str) -> list[str]:
+    return [t for t in tokenize(text) if len(t) > 2 and t not in _STOPWORDS]
+
+
+class TierUsage(BaseCallbackHandler):
+    """Time to first token, streaming rate and token usage of one tier's LLM calls."""
+    run_inline = True
+
+    def __init__(self, window: int = 1024):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.ttft = deque(maxlen=window)
+        self.tokens_per_s = deque(maxlen=window)
+        self._runs: dict[UUID, list] = {}       # run id -> [start, first token, streamed chunks]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._runs[run_id] = [time.perf_counter(), None, 0]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and token:
+            run[1] = run[1] or time.perf_counter()
+            run[2] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        end = time.perf_counter()
+        self.calls += 1
+        message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+        usage = getattr(message, "usage_metadata", None) or {}
+        output = usage.get("output_tokens") or run[2]
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.output_tokens += output
+        if run[1] is not None:
+            self.ttft.append(run[1] - run[0])
+            if end > run[1]:
+                self.tokens_per_s.append(output / (end - run[1]))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "ttft_p50_ms": round(float(np.median(self.ttft)) * 1000, 1) if self.ttft else None,
+            "tokens_per_s_p50": round(float(np.median(self.tokens_per_s)), 1) if self.tokens_per_s else None,
+        }
+
+
+class TierRouter(object):
+    """Picks the chat model for one answer, in order:
+
+    - trivial: greetings, thanks and acknowledgements;
+    - off_topic: the retrieved documents don't cover the query (reranker relevance below
+      `off_topic_relevance`, where the reranker reports one, or under `min_coverage` of the query's
+      content words found in the documents);
+    - complex: comparisons, the patient's own circumstances, several questions, or `complex_signals`
+      from the app (e.g. several treatments to discuss);
+    - short_factual: one question of at most `small_max_words` words;
+    - default: everything else.
+
+    `tiers` maps each reason to "small" or "big"; `context_tokens` optionally maps a reason to a
+    smaller context budget. With `log`, each decision is written as a JSON line to stderr.
+    """
+
+    def __init__(self, backend: str, tiers: dict, context_tokens: dict, small_max_words: int = 12,
+                 off_topic_relevance: Optional[float] = None, min_coverage: float = 0.2, enabled: bool = True,
+                 log: bool = False):
+        self.backend = backend
+        self.tiers = {reason: (tiers.get(reason, "big") if enabled else "big") for reason in REASONS}
+        self.context_tokens = context_tokens
+        self.small_max_words = small_max_words
+        self.off_topic_relevance = off_topic_relevance
+        self.min_coverage = min_coverage
+        self.log = log
+        self.decisions = Counter()
+        self.usage = {tier: TierUsage() for tier in TIERS}
+        self._terms = LRUCache(2048)        # document text -> its word set
+
+    def _doc_terms(self, doc: Document) -> frozenset:
+        terms = self._terms.get(doc.page_content)
+        if terms is None:
+            terms = frozenset(tokenize(doc.page_content))
+            self._terms.put(doc.page_content, terms)
+        return terms
+
+    def grounding(self, words: list[str], docs: list[Document]) -> tuple[Optional[float], float]:
+        """(best reranker relevance, if reported; share of `words` found in the documents)."""
+        scores = [d.metadata["relevance_score"] for d in docs if d.metadata.get("relevance_score") is not None]
+        terms = frozenset().union(*[self._doc_terms(d) for d in docs]) if docs else frozenset()
+        coverage = sum(w in terms for w in words) / len(words) if words else 1.0
+        return (max(scores) if scores else None), coverage
+
+    def _reason(self, query: str, docs: list[Document], complex_signals: int) -> tuple[str, dict]:
+        text = query.strip()
+        words = text.split()
+        if not content_words(text) or (len(words) <= 6 and _SOCIAL.search(text)):
+            return "trivial", {"words": len(words)}
+        relevance, coverage = self.grounding(content_words(text), docs)
+        signals = {"words": len(words), "relevance": relevance and round(relevance, 3), "coverage": round(coverage, 2)}
+        if (relevance is not None and self.off_topic_relevance is not None and relevance < self.off_topic_relevance) \
+                or coverage < self.min_coverage:
+            return "off_topic", signals
+        if complex_signals or _COMPARES.search(text) or _PERSONAL.search(text) or text.count("?") > 1:
+            return "complex", signals
+        if len(words) <= self.small_max_words:
+            return "short_factual", signals
+        return "default", signals
+
+    def route(self, query: str, docs: list[Document], complex_signals: int = 0) -> TierDecision:
+        """`docs`: the documents retrieved for the query itself, best first."""
+        with span("classify", "respond_tier") as s:
+            reason, signals = self._reason(query, docs, complex_signals)
+            decision = TierDecision(self.tiers[reason], reason, self.context_tokens.get(reason))
+            if s is not None:
+                s.attrs.update(tier=decision.tier, reason=reason)
+        self.decisions[(decision.tier, reason)] += 1
+        if self.log:
+            log_json(logger, {"backend": self.backend, "tier": decision.tier, "reason": reason,
+                              "context_tokens": decision.context_tokens, **signals, "query": query[:200]})
+        return decision
+
+    def metrics(self) -> dict:
+        return {
+            "decisions": {f"{tier}:{reason}": n for (tier, reason), n in sorted(self.decisions.items())},
+            **{tier: usage.metrics() for tier, usage in self.usage.items()},
+        }
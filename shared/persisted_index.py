@@ -0,0 +1,121 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable
+
+import faiss
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from .mapped_docstore import FORMAT_VERSION as DOCSTORE_FORMAT, MappedDocstore, has_docstore, write_docstore
+
+# bump when the on-disk layout changes so stale builds are never picked up
+INDEX_FORMAT_VERSION = "2"
+
+INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"      # FAISS.save_local's pickled docstore; only read to convert it
+
+# ------------------------------------------------------------------- #
+
+def fingerprint(source_paths: Iterable[Path], embedding_model: str) -> str:
+    """Content hash of the source files plus the embedding model used to embed them."""
+    h = hashlib.sha256()
+    h.update(f"format={INDEX_FORMAT_VERSION};model={embedding_model};".encode())
+    for path in sorted(Path(p) for p in source_paths):
+        h.update(path.name.encode())
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _read_index(path: Path):
+    # IO_FLAG_MMAP_IFC maps flat codes straight from the page cache instead of copying them onto the heap
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    return faiss.read_index(str(path / INDEX_FILE), flags)
+
+
+def save_docstore(path: Path, vectorstore: FAISS):
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    write_docstore(path, ids, [vectorstore.docstore.search(i) for i in ids])
+
+
+def save_index(path: Path, vectorstore: FAISS):
+    """index.faiss plus docstore.bin: what load_index reads (replaces FAISS.save_local, which pickles)."""
+    faiss.write_index(vectorstore.index, str(Path(path) / INDEX_FILE))
+    save_docstore(path, vectorstore)
+
+
+def convert_legacy_docstore(path: Path):
+    """Write docstore.bin from the pickled index.pkl next to it. Unpickling runs code from the
+    file: only for the shipped and locally built indexes (python -m shared.convert_docstores)."""
+    path = Path(path)
+    with open(path / LEGACY_DOCSTORE_FILE, 'rb') as file:
+        docstore, index_to_docstore_id = pickle.load(file)
+    ids = [index_to_docstore_id[i] for i in range(len(index_to_docstore_id))]
+    write_docstore(path, ids, [docstore.search(i) for i in ids])
+
+
+def load_index(path: Path, embeddings: Embeddings) -> FAISS:
+    """FAISS store whose vectors and documents are both memory-mapped, so every worker process
+    shares one page-cache copy. Nothing is unpickled: an index saved with only the pickled
+    docstore has to be converted first."""
+    path = Path(path)
+    if not has_docstore(path):
+        raise FileNotFoundError(f"no docstore.bin (format {DOCSTORE_FORMAT}) in {path}; "
+                                f"convert its {LEGACY_DOCSTORE_FILE} with python -m shared.convert_docstores {path}")
+    index = _read_index(path)
+    docstore = MappedDocstore(path)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(docstore.ids)),
+    )
+
+
+def load_or_build_index(
+    cache_dir: Path,
+    key: str,
+    load_documents: Callable[[], list[Document]],
+    embeddings: Embeddings,
+) -> FAISS:
+    """Load the index stored under `cache_dir/key`, building it first if no build exists for `key`.
+
+    Builds are written to a temporary directory and renamed into place, so a crashed or
+    concurrent build never leaves a half-written index behind. Builds for other keys are pruned.
+    """
+    cache_dir = Path(cache_dir)
+    target = cache_dir / key
+    if not (target / INDEX_FILE).exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        vectorstore = FAISS.from_documents(load_documents(), embeddings)
+        tmp = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=cache_dir))
+        save_index(tmp, vectorstore)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            # another worker finished the same build first
+            shutil.rmtree(tmp, ignore_errors=True)
+        for stale in cache_dir.iterdir():
+            if stale.is_dir() and stale.name != key and not stale.name.startswith('.'):
+                shutil.rmtree(stale, ignore_errors=True)
+    return load_index(target, embeddings)
+
+
+def load_writable_index(path: Path, embeddings: Embeddings) -> FAISS:
+    """The index at `path` read onto the heap with an in-memory docstore, for adding and deleting
+    documents (ingest.py); save it back with save_index."""
+    path = Path(path)
+    docstore = MappedDocstore(path)
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.read_index(str(path / INDEX_FILE)),
+        docstore=InMemoryDocstore({doc.id: doc for doc in docstore.documents()}),
+        index_to_docstore_id=dict(enumerate(docstore.ids)),
+    )
@@ -0,0 +1,48 @@
+from collections import deque
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# ------------------------------------------------------------------- #
+
+class PromptCacheStats(BaseCallbackHandler):
+    """Prompt tokens the provider served from its prompt cache, per LLM call.
+
+    Reads the usage the API reports with the response (OpenAI: prompt_tokens_details.cached_tokens,
+    surfaced by langchain as usage_metadata.input_token_details.cache_read); streamed responses
+    only carry it with stream_usage on (see shared/upstream.py).
+    """
+    run_inline = True
+
+    def __init__(self, window: int = 1024):
+        self.calls = 0
+        self.reported = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.recent = deque(maxlen=window)      # (prompt tokens, cached tokens) per call
+
+    def on_llm_end(self, response: LLMResult, **kwargs):
+        self.calls += 1
+        message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return
+        prompt = usage.get("input_tokens", 0)
+        cached = usage.get("input_token_details", {}).get("cache_read", 0) or 0
+        self.reported += 1
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        self.recent.append((prompt, cached))
+
+    def metrics(self) -> dict:
+        ratios = np.array([c / p for p, c in self.recent if p])
+        return {
+            "calls": self.calls,
+            "usage_reported": self.reported,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            "cache_hit_calls": round(float((ratios > 0).mean()), 3) if len(ratios) else 0.0,
+            "cached_ratio_p50": round(float(np.median(ratios)), 3) if len(ratios) else 0.0,
+        }
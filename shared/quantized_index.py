@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from .persisted_index import INDEX_FILE
+
+# "sq8": 8-bit scalar quantization (4x smaller), "ivfpq": inverted lists + product quantization
+# (~100x smaller), "mrl": Matryoshka truncation of text-embedding-3 vectors to `dims` (3072 / dims smaller)
+QUANTIZED_KINDS = ("sq8", "ivfpq", "mrl")
+
+# ------------------------------------------------------------------- #
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=1, keepdims=True).clip(min=1e-12)
+
+
+def _source_stamp(directory: Path) -> Optional[str]:
+    """Size and modification time of the exact index stored in `directory`, which the codes are built from."""
+    try:
+        stat = (Path(directory) / INDEX_FILE).stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _pq_subquantizers(d: int) -> int:
+    return next(m for m in (96, 64, 48, 32, 24, 16, 8, 4, 2, 1) if d % m == 0)
+
+
+def _compress(vectors: np.ndarray, kind: str, dims: int) -> faiss.Index:
+    n, d = vectors.shape
+    if kind == "mrl":
+        index = faiss.IndexFlatL2(dims)
+        index.add(_normalize(vectors[:, :dims]))
+        return index
+    if kind == "sq8":
+        index = faiss.index_factory(d, "SQ8")
+    elif kind == "ivfpq":
+        nlist = max(1, int(math.sqrt(n)))
+        # small corpora cannot train 256 centroids per sub-space
+        nbits = int(np.clip(math.log2(max(n, 2) / 39), 4, 8))
+        # "np": skip polysemous training, which is only used by Hamming-filtered search
+        index = faiss.index_factory(d, f"IVF{nlist},PQ{_pq_subquantizers(d)}x{nbits}np")
+    else:
+        raise ValueError(f"unknown index kind: {kind}")
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+class RescoredIndex(object):
+    """A compressed FAISS index whose short list is re-scored against the exact vectors.
+
+    Drop-in for the flat index of a langchain FAISS store (`vectorstore.index = RescoredIndex(...)`):
+    `search` returns exact squared-L2 distances, so scores and ordering match the flat index whenever
+    the true neighbours make it into the `oversample * k` short list. The exact index is expected to
+    be memory-mapped (see persisted_index.load_index), so only short-listed rows are paged in and the
+    pages are shared by every worker; the compressed codes are what each process keeps on its heap.
+    """
+
+    def __init__(self, exact: faiss.Index, compressed: faiss.Index, kind: str, dims: Optional[int] = None,
+                 nprobe: int = 1, oversample: int = 4, recall: Optional[float] = None, recall_target: Optional[float] = None):
+        self.exact = exact
+        self.compressed = compressed
+        self.kind = kind
+        self.dims = dims
+        self.nprobe = nprobe
+        self.oversample = oversample
+        self.recall = recall
+        self.recall_target = recall_target
+
+    @property
+    def ntotal(self) -> int:
+        return self.exact.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.exact.d
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return self.exact.reconstruct(i)
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        return self.exact.reconstruct_n(i0, n)
+
+    def _params(self, params: Optional[faiss.SearchParameters]):
+        sel = params.sel if params is not None else None
+        if self.kind == "ivfpq":
+            return faiss.SearchParametersIVF(sel=sel, nprobe=self.nprobe)
+        return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+    def search(self, x: np.ndarray, k: int, params: Optional[faiss.SearchParameters] = None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        query = _normalize(x[:, :self.dims]) if self.kind == "mrl" else x
+        _, short = self.compressed.search(query, k * self.oversample, params=self._params(params))
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for row, ids in enumerate(short):
+            ids = ids[ids != -1]
+            if not len(ids):
+                continue
+            exact = ((self.exact.reconstruct_batch(ids) - x[row]) ** 2).sum(axis=1)
+            order = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(order)] = exact[order]
+            labels[row, :len(order)] = ids[order]
+        return distances, labels
+
+    def calibrate(self, recall_target: float, k: int = 10, sample: int = 200, seed: int = 0) -> float:
+        """Pick the cheapest (nprobe, oversample) whose recall@k against exact search meets the target.
+
+        Calibration queries are stored vectors moved away by noise about as large as a typical
+        query-to-passage distance, so they are not trivially their own nearest neighbour.
+        Returns the recall reached.
+        """
+        self.recall_target = recall_target
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(self.ntotal, size=min(sample, self.ntotal), replace=False)
+        queries = self.exact.reconstruct_batch(picks.astype(np.int64))
+        queries = _normalize(queries + rng.normal(0, 2 / math.sqrt(self.d), queries.shape).astype(np.float32))
+        k = min(k, self.ntotal)
+        _, truth = self.exact.search(queries, k)
+        nlist = self.compressed.nlist if self.kind == "ivfpq" else 1
+        probes = sorted({min(2 ** i, nlist) for i in range(int(math.log2(nlist)) + 2)})
+        # cheapest first: inverted lists scanned times short-list length re-scored
+        for nprobe, oversample in sorted(((p, o) for p in probes for o in (1, 2, 4, 8, 16)), key=lambda c: c[0] * c[1]):
+            self.nprobe, self.oversample = nprobe, oversample
+            _, found = self.search(queries, k)
+            recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+            if recall >= recall_target:
+                break
+        self.recall = recall
+        return recall
+
+    def save(self, directory: Path):
+        directory = Path(directory)
+        faiss.write_index(self.compressed, str(directory / f"index.{self.kind}.faiss"))
+        settings = {"kind": self.kind, "dims": self.dims, "nprobe": self.nprobe, "oversample": self.oversample,
+                    "recall": self.recall, "recall_target": self.recall_target, "ntotal": self.ntotal,
+                    "source": _source_stamp(directory)}
+        # settings last: a reader that finds them also finds the codes they describe
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".quantized-")
+        with os.fdopen(fd, 'w') as file:
+            json.dump(settings, file)
+        os.replace(tmp, directory / f"index.{self.kind}.json")
+
+    @classmethod
+    def load(cls, directory: Path, exact: faiss.Index, kind: str) -> Optional["RescoredIndex"]:
+        directory = Path(directory)
+        try:
+            with open(directory / f"index.{kind}.json") as file:
+                settings = json.load(file)
+            compressed = faiss.read_index(str(directory / f"index.{kind}.faiss"))
+        except (FileNotFoundError, RuntimeError):
+            return None
+        # codes built from another index.faiss are stale even with as many vectors
+        if settings.pop("ntotal") != exact.ntotal or settings.pop("source", None) != _source_stamp(directory):
+            return None
+        return cls(exact, compressed, **settings)
+
+    @classmethod
+    def build(cls, exact: faiss.Index, kind: str, dims: int = 1024, recall_target: float = 0.95) -> "RescoredIndex":
+        vectors = exact.reconstruct_n(0, exact.ntotal)
+        index = cls(exact, _compress(vectors, kind, dims), kind, dims=dims if kind == "mrl" else None)
+        index.calibrate(recall_target)
+        return index
+
+
+def load_or_build_quantized(vectorstore, directory: Path, kind: str, dims: int = 1024,
+                            recall_target: float = 0.95) -> RescoredIndex:
+    """Swap `vectorstore.index` for its `kind` compressed version stored in `directory`, building
+    (and trying to store) it if missing or stale. Returns the new index."""
+    index = RescoredIndex.load(directory, vectorstore.index, kind)
+    stale = index is None or (kind == "mrl" and index.dims != dims)
+    if stale:
+        index = RescoredIndex.build(vectorstore.index, kind, dims, recall_target)
+    elif index.recall_target != recall_target:
+        index.calibrate(recall_target)
+        stale = True
+    if stale:
+        try:
+            index.save(directory)
+        except OSError:
+            pass
+    vectorstore.index = index
+    return index
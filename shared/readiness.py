@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+# ------------------------------------------------------------------- #
+
+@contextmanager
+def timed(timings: Optional[dict], step: str):
+    """Record how long `step` took (seconds) in `timings`, if given."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[step] = round(time.perf_counter() - start, 3)
+
+
+class Component(object):
+    """A backend that loads in a worker thread while the server is already accepting connections.
+
+    `load(timings)` builds the component and may record per-step durations in `timings`, which
+    `status()` reports while loading is still in progress.
+    """
+
+    def __init__(self, name: str, load: Callable[[dict], Any]):
+        self.name = name
+        self._load = load
+        self.state = "pending"
+        self.value = None
+        self.error: Optional[str] = None
+        self.timings: dict[str, float] = {}
+        self.created = time.perf_counter()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._done = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _run(self):
+        self.started = time.perf_counter()
+        self.state = "loading"
+        try:
+            self.value = self._load(self.timings)
+            self.state = "ready"
+        except Exception:
+            self.error = traceback.format_exc(limit=3)
+            self.state = "failed"
+        finally:
+            self.finished = time.perf_counter()
+            self._done.set()
+
+    def start(self) -> asyncio.Task:
+        """Begin loading off the event loop; safe to call more than once."""
+        if self._task is None:
+            self._task = asyncio.create_task(asyncio.to_thread(self._run))
+        return self._task
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for loading to finish; True if the component is ready."""
+        if not self._done.is_set():
+            try:
+                await asyncio.wait_for(asyncio.shield(self.start()), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.ready
+
+    def status(self) -> dict:
+        status = {"state": self.state, "steps": dict(self.timings)}
+        if self.started is not None:
+            end = self.finished if self.finished is not None else time.perf_counter()
+            status["load_s"] = round(end - self.started, 3)
+        if self.finished is not None:
+            status["since_created_s"] = round(self.finished - self.created, 3)
+        if self.error:
+            status["error"] = self.error
+        return status
@@ -0,0 +1,312 @@
+import asyncio
+import math
+import re
+from collections import Counter
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from pydantic import ConfigDict, PrivateAttr
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.embeddings import Embeddings
+
+from .lru import LRUCache
+from .retrieval_cache import CachedReranker
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# ------------------------------------------------------------------- #
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _minmax(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min() if len(scores) else 0.0
+    return (scores - scores.min()) / spread if spread else np.zeros_like(scores)
+
+
+class LocalReranker(BaseDocumentCompressor):
+    """In-process drop-in for CohereRerank.
+
+    Subclasses score (query, candidate) pairs for several queries at once, so every lookup made for
+    one chat request can be reranked in a single scoring pass (see `rerank_many` / `aretrieve_many`).
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    top_n: int = 3
+
+    def score(self, queries: list[str], candidates: list[list[str]]) -> list[np.ndarray]:
+        raise NotImplementedError
+
+    async def ascore(self, queries: list[str], candidates: list[list[str]]) -> list[np.ndarray]:
+        return await asyncio.to_thread(self.score, queries, candidates)
+
+    def _select(self, documents: Sequence[Document], scores: np.ndarray, top_n: int) -> list[Document]:
+        ranked = []
+        for i in np.argsort(-scores, kind="stable")[:top_n]:
+            doc = documents[i]
+            ranked.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "relevance_score": float(scores[i])}, id=doc.id))
+        return ranked
+
+    def score_documents(self, queries: list[str], candidates: list[Sequence[Document]]) -> list[np.ndarray]:
+        return self.score(queries, [[d.page_content for d in docs] for docs in candidates])
+
+    async def ascore_documents(self, queries: list[str], candidates: list[Sequence[Document]]) -> list[np.ndarray]:
+        return await self.ascore(queries, [[d.page_content for d in docs] for docs in candidates])
+
+    def rerank_many(self, requests: list[tuple[str, Sequence[Document], int]]) -> list[list[Document]]:
+        """`requests` are (query, candidates, top_n) triples, scored together."""
+        scores = self.score_documents([q for q, _, _ in requests], [docs for _, docs, _ in requests])
+        return [self._select(docs, s, top_n) for (_, docs, top_n), s in zip(requests, scores)]
+
+    async def arerank_many(self, requests: list[tuple[str, Sequence[Document], int]]) -> list[list[Document]]:
+        scores = await self.ascore_documents([q for q, _, _ in requests], [docs for _, docs, _ in requests])
+        return [self._select(docs, s, top_n) for (_, docs, top_n), s in zip(requests, scores)]
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        return self.rerank_many([(query, documents, self.top_n)])[0]
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        return (await self.arerank_many([(query, documents, self.top_n)]))[0]
+
+
+class IndexVectors(object):
+    """The vectors a langchain FAISS store already holds for its documents, by document id, so a
+    reranker can score candidates without embedding them again.
+
+    `vectorstore.index` must still be the exact index (take this before quantizing or wrapping it).
+    With `id_key` the store indexes summaries of other documents (MultiVectorRetriever): a document
+    has the vectors of every summary whose `id_key` metadata names it.
+    """
+
+    def __init__(self, vectorstore, id_key: Optional[str] = None):
+        self.index = vectorstore.index
+        self.positions: dict[str, list[int]] = {}
+        ids = vectorstore.index_to_docstore_id
+        for i in range(len(ids)):
+            key = ids[i]
+            if id_key is not None:
+                summary = vectorstore.docstore.search(key)
+                key = summary.metadata.get(id_key) if isinstance(summary, Document) else None
+            if key is not None:
+                self.positions.setdefault(key, []).append(i)
+
+    def get(self, doc: Document) -> Optional[np.ndarray]:
+        rows = self.positions.get(doc.id) if doc.id is not None else None
+        if not rows:
+            return None
+        return self.index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+
+
+def _unit(matrix) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True).clip(min=1e-12)
+
+
+class HybridReranker(LocalReranker):
+    """BM25 over the candidate set fused with dense cosine similarity.
+
+    Document frequencies come from the candidates in the current pass, so no corpus statistics are
+    needed. With `embeddings` unset the scorer is purely lexical. With `vectors`, candidates are
+    scored against the vectors already in the FAISS index (a document with several, by the best one)
+    and only the queries are embedded, which a cached embedding client has already seen; otherwise
+    the candidate texts are embedded too.
+    """
+    embeddings: Optional[Embeddings] = None
+    vectors: Optional[IndexVectors] = None
+    dense_weight: float = 0.6
+    k1: float = 1.2
+    b: float = 0.75
+    # term counts of recently seen candidates; tokenizing dominates the lexical cost
+    _term_counts: LRUCache = PrivateAttr(default_factory=lambda: LRUCache(4096))
+
+    def _counts(self, text: str) -> Counter:
+        counts = self._term_counts.get(text)
+        if counts is None:
+            counts = Counter(tokenize(text))
+            self._term_counts.put(text, counts)
+        return counts
+
+    def _lexical(self, queries: list[str], candidates: list[list[str]]) -> list[np.ndarray]:
+        texts = list(dict.fromkeys(t for texts in candidates for t in texts))
+        counts = {t: self._counts(t) for t in texts}
+        lengths = {t: sum(c.values()) for t, c in counts.items()}
+        avgdl = (sum(lengths.values()) / len(texts)) if texts else 1.0
+        n = len(texts)
+        df = Counter(term for c in counts.values() for term in c)
+
+        scores = []
+        for query, docs in zip(queries, candidates):
+            terms = set(tokenize(query))
+            idf = {term: math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) for term in terms}
+            row = np.zeros(len(docs), dtype=np.float32)
+            for j, text in enumerate(docs):
+                c, norm = counts[text], self.k1 * (1 - self.b + self.b * lengths[text] / (avgdl or 1.0))
+                row[j] = sum(idf[t] * c[t] * (self.k1 + 1) / (c[t] + norm) for t in terms if c[t])
+            scores.append(row)
+        return scores
+
+    def _dense(self, queries: list[str], candidates: list[list[str]], vectors: list[list[float]]) -> list[np.ndarray]:
+        matrix = _unit(vectors)
+        query_vectors, doc_vectors = matrix[:len(queries)], matrix[len(queries):]
+        position = {t: i for i, t in enumerate(self._dense_texts(queries, candidates)[len(queries):])}
+        return [doc_vectors[[position[t] for t in docs]] @ query_vectors[i] for i, docs in enumerate(candidates)]
+
+    def _dense_texts(self, queries, candidates) -> list[str]:
+        return queries + list(dict.fromkeys(t for texts in candidates for t in texts))
+
+    def _stored(self, candidates: list[Sequence[Document]]) -> tuple[dict[str, np.ndarray], list[str]]:
+        """Index vectors by candidate text, and the texts of candidates the index has no vector for."""
+        stored, missing = {}, []
+        for doc in (d for docs in candidates for d in docs):
+            if doc.page_content not in stored:
+                rows = self.vectors.get(doc)
+                if rows is not None:
+                    stored[doc.page_content] = _unit(rows)
+                else:
+                    missing.append(doc.page_content)
+        return stored, list(dict.fromkeys(t for t in missing if t not in stored))
+
+    def _dense_stored(self, query_vectors, texts: list[list[str]], stored: dict[str, np.ndarray]) -> list[np.ndarray]:
+        query_vectors = _unit(query_vectors)
+        return [np.array([(stored[t] @ query_vectors[i]).max() for t in docs], dtype=np.float32) for i, docs in enumerate(texts)]
+
+    def score_documents(self, queries, candidates):
+        if self.vectors is None or self.embeddings is None:
+            return super().score_documents(queries, candidates)
+        texts = [[d.page_content for d in docs] for docs in candidates]
+        stored, missing = self._stored(candidates)
+        if missing:
+            stored.update(zip(missing, _unit(self.embeddings.embed_documents(missing))[:, None, :]))
+        query_vectors = [self.embeddings.embed_query(q) for q in queries]
+        return self._fuse(self._lexical(queries, texts), self._dense_stored(query_vectors, texts, stored))
+
+    async def ascore_documents(self, queries, candidates):
+        if self.vectors is None or self.embeddings is None:
+            return await super().ascore_documents(queries, candidates)
+        texts = [[d.page_content for d in docs] for docs in candidates]
+        stored, missing = self._stored(candidates)
+        if missing:
+            stored.update(zip(missing, _unit(await self.embeddings.aembed_documents(missing))[:, None, :]))
+        # the retriever embedded these queries moments ago: cache hits
+        query_vectors = await asyncio.gather(*[self.embeddings.aembed_query(q) for q in queries])
+        lexical = await asyncio.to_thread(self._lexical, queries, texts)
+        return self._fuse(lexical, self._dense_stored(query_vectors, texts, stored))
+
+    def _fuse(self, lexical, dense) -> list[np.ndarray]:
+        if dense is None:
+            return lexical
+        return [(1 - self.dense_weight) * _minmax(l) + self.dense_weight * _minmax(d) for l, d in zip(lexical, dense)]
+
+    def score(self, queries, candidates):
+        dense = None
+        if self.embeddings is not None:
+            texts = self._dense_texts(queries, candidates)
+            dense = self._dense(queries, candidates, self.embeddings.embed_documents(texts))
+        return self._fuse(self._lexical(queries, candidates), dense)
+
+    async def ascore(self, queries, candidates):
+        dense = None
+        if self.embeddings is not None:
+            # one embedding call for every query and candidate in the pass
+            texts = self._dense_texts(queries, candidates)
+            dense = self._dense(queries, candidates, await self.embeddings.aembed_documents(texts))
+        lexical = await asyncio.to_thread(self._lexical, queries, candidates)
+        return self._fuse(lexical, dense)
+
+
+class CrossEncoderReranker(LocalReranker):
+    """CPU cross-encoder (sentence-transformers); all pairs of a pass go through one `predict` call."""
+    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    batch_size: int = 64
+    model: Any = None
+
+    def _load(self):
+        if self.model is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError as e:
+                raise ImportError("the cross-encoder reranker needs `pip install sentence-transformers`") from e
+            self.model = CrossEncoder(self.model_name, device="cpu")
+        return self.model
+
+    def score(self, queries, candidates):
+        pairs = [(q, t) for q, texts in zip(queries, candidates) for t in texts]
+        flat = np.asarray(self._load().predict(pairs, batch_size=self.batch_size), dtype=np.float32) if pairs else np.zeros(0)
+        scores, start = [], 0
+        for texts in candidates:
+            scores.append(flat[start:start + len(texts)])
+            start += len(texts)
+        return scores
+
+
+def make_reranker(kind: str, top_n: int, cohere_model: str, embeddings: Optional[Embeddings] = None,
+                  vectors: Optional[IndexVectors] = None) -> BaseDocumentCompressor:
+    """`kind` is "cohere", "hybrid" (BM25 + dense, in-process; `vectors` spares embedding the
+    candidates) or "cross-encoder" (in-process, CPU)."""
+    if kind == "cohere":
+        from langchain_cohere import CohereRerank
+        from .upstream import cohere_client
+        return CohereRerank(model=cohere_model, top_n=top_n, client=cohere_client())
+    if kind == "hybrid":
+        return HybridReranker(top_n=top_n, embeddings=embeddings, vectors=vectors)
+    if kind == "cross-encoder":
+        return CrossEncoderReranker(top_n=top_n)
+    raise ValueError(f"unknown reranker: {kind}")
+
+# ------------------------------------------------------------------- #
+
+def _local(compressor: BaseDocumentCompressor) -> Optional[LocalReranker]:
+    if isinstance(compressor, CachedReranker):
+        compressor = compressor.base_compressor
+    return compressor if isinstance(compressor, LocalReranker) else None
+
+
+async def arerank(retriever: Any, query: str, candidates: Optional[list[Document]] = None) -> list[Document]:
+    """A ContextualCompressionRetriever lookup; given `candidates`, only the rerank runs, no search."""
+    if candidates is None:
+        return await retriever.ainvoke(query)
+    return list(await retriever.base_compressor.acompress_documents(candidates, query)) if candidates else []
+
+
+async def aretrieve_many(requests: list[tuple]) -> list[list[Document]]:
+    """Run several ContextualCompressionRetriever lookups, given as (retriever, query) pairs, or as
+    (retriever, query, candidates) when the candidates are already known (reranked without a search).
+
+    When every retriever reranks with the same kind of local reranker, candidates are fetched
+    concurrently and all uncached (query, candidate) pairs are scored in one pass; otherwise each
+    lookup runs on its own, concurrently.
+    """
+    requests = [(r[0], r[1], r[2] if len(r) > 2 else None) for r in requests]
+    scorers = [_local(r.base_compressor) for r, _, _ in requests]
+    if not requests or any(s is None for s in scorers) or len({type(s) for s in scorers}) > 1:
+        return list(await asyncio.gather(*[arerank(r, q, c) for r, q, c in requests]))
+
+    async def fetch(retriever, query, candidates):
+        return candidates if candidates is not None else await retriever.base_retriever.ainvoke(query)
+    candidates = await asyncio.gather(*[fetch(*r) for r in requests])
+    results: list[Optional[list[Document]]] = [None] * len(requests)
+    pending = []
+    for i, ((retriever, query, _), docs) in enumerate(zip(requests, candidates)):
+        compressor = retriever.base_compressor
+        if not docs:
+            results[i] = []
+        elif isinstance(compressor, CachedReranker) and (hit := compressor.lookup(docs, query)) is not None:
+            results[i] = hit
+        else:
+            pending.append(i)
+
+    if pending:
+        reranked = await scorers[pending[0]].arerank_many([(requests[i][1], candidates[i], scorers[i].top_n) for i in pending])
+        for i, docs in zip(pending, reranked):
+            compressor = requests[i][0].base_compressor
+            if isinstance(compressor, CachedReranker):
+                docs = compressor.remember(candidates[i], requests[i][1], docs)
+            results[i] = docs
+    return results
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from threading import Lock
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+DEFAULT_ADDRESS = ("127.0.0.1", 50055)
+# the "local" store unpickles whatever its clients send: it only accepts clients holding this shared secret
+AUTHKEY_ENV = "RESPONSE_CACHE_AUTHKEY"
+
+# ------------------------------------------------------------------- #
+
+class CacheBackend(ABC):
+    # backends whose calls cross a process boundary are called off the event loop
+    blocking = False
+
+    @abstractmethod
+    def search(self, vector: list[float], threshold: float) -> tuple[str | None, float]:
+        """Best stored answer whose key vector has cosine similarity >= threshold, and that similarity."""
+
+    @abstractmethod
+    def put(self, vector: list[float], answer: str): ...
+
+    @abstractmethod
+    def clear(self): ...
+
+    @abstractmethod
+    def get_version(self) -> str | None: ...
+
+    @abstractmethod
+    def set_version(self, version: str): ...
+
+    @abstractmethod
+    def size(self) -> int: ...
+
+
+class InProcessBackend(CacheBackend):
+    """Key vectors in the rows of one matrix, each row an entry slot: a search is one matrix-vector
+    product, and neither a hit nor the LRU order it refreshes moves any row."""
+
+    def __init__(self, maxsize: int, ttl: float | None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self._lock = Lock()
+        self._matrix = None                                 # (capacity, dims), grown by doubling up to maxsize
+        self._stored_at = np.zeros(0)
+        self._live = np.zeros(0, dtype=bool)
+        self._answers: list[str | None] = []
+        self._order: OrderedDict[int, None] = OrderedDict()  # live slots, least recently used first
+
+    def _expire(self):
+        if self.ttl is None or not self._order:
+            return
+        for slot in np.flatnonzero(self._live & (self._stored_at < time.monotonic() - self.ttl)).tolist():
+            self._free(slot)
+
+    def _free(self, slot: int):
+        self._live[slot] = False
+        self._answers[slot] = None
+        self._order.pop(slot, None)
+
+    def _slot(self, dims: int) -> int:
+        if self._matrix is None:
+            self._matrix = np.zeros((min(64, self.maxsize), dims), dtype=np.float32)
+            self._stored_at = np.zeros(len(self._matrix))
+            self._live = np.zeros(len(self._matrix), dtype=bool)
+            self._answers = [None] * len(self._matrix)
+        free = np.flatnonzero(~self._live)
+        if len(free):
+            return int(free[0])
+        if len(self._matrix) < self.maxsize:
+            capacity = min(2 * len(self._matrix), self.maxsize)
+            grown = np.zeros((capacity, dims), dtype=np.float32)
+            grown[:len(self._matrix)] = self._matrix
+            slot = len(self._matrix)
+            self._matrix = grown
+            self._stored_at = np.concatenate([self._stored_at, np.zeros(capacity - slot)])
+            self._live = np.concatenate([self._live, np.zeros(capacity - slot, dtype=bool)])
+            self._answers.extend([None] * (capacity - slot))
+            return slot
+        slot = next(iter(self._order))
+        self._free(slot)
+        return slot
+
+    def search(self, vector, threshold):
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            self._expire()
+            if not self._order:
+                return None, 0.0
+            scores = np.where(self._live, self._matrix @ query, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None, float(scores[best])
+            self._order.move_to_end(best)
+            return self._answers[best], float(scores[best])
+
+    def put(self, vector, answer):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._expire()
+            slot = self._slot(len(vector))
+            self._matrix[slot] = vector
+            self._stored_at[slot] = time.monotonic()
+            self._live[slot] = True
+            self._answers[slot] = answer
+            self._order[slot] = None
+
+    def clear(self):
+        with self._lock:
+            self._live[:] = False
+            self._answers = [None] * len(self._answers)
+            self._order.clear()
+
+    def get_version(self):
+        return self.version
+
+    def set_version(self, version):
+        self.version = version
+
+    def size(self):
+        with self._lock:
+            self._expire()
+            return len(self._order)
+
+
+_stores: dict[str, InProcessBackend] = {}
+
+def _get_store(namespace: str, maxsize: int, ttl: float | None) -> InProcessBackend:
+    if namespace not in _stores:
+        _stores[namespace] = InProcessBackend(maxsize, ttl)
+    return _stores[namespace]
+
+
+class _StoreManager(BaseManager):
+    pass
+
+_StoreManager.register("get_store", callable=_get_store)
+
+
+def _authkey(authkey: bytes | None) -> bytes:
+    authkey = authkey or os.getenv(AUTHKEY_ENV, "").encode()
+    if not authkey:
+        raise RuntimeError(f"the local response cache store needs a shared secret: set {AUTHKEY_ENV}")
+    return authkey
+
+
+class LocalProcessBackend(CacheBackend):
+    """Stand-in for a shared store (e.g. Redis): one process owns the entries, every worker talks to it.
+
+    Connects to the store at `address`; if none is listening, starts one as a child of this process.
+    Similarity search runs inside the store process, so only the query vector crosses the boundary.
+    Workers and store authenticate with RESPONSE_CACHE_AUTHKEY, which must be set.
+    """
+    blocking = True
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float | None,
+                 address: tuple[str, int] = DEFAULT_ADDRESS, authkey: bytes | None = None):
+        self.manager = _StoreManager(address=address, authkey=_authkey(authkey))
+        try:
+            self.manager.connect()
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.manager.start()
+        self.store = self.manager.get_store(namespace, maxsize, ttl)
+
+    def search(self, vector, threshold):
+        return self.store.search(vector, threshold)
+
+    def put(self, vector, answer):
+        self.store.put(vector, answer)
+
+    def clear(self):
+        self.store.clear()
+
+    def get_version(self):
+        return self.store.get_version()
+
+    def set_version(self, version):
+        self.store.set_version(version)
+
+    def size(self):
+        return self.store.size()
+
+
+def serve_local_store(address: tuple[str, int] = DEFAULT_ADDRESS, authkey: bytes | None = None):
+    """Run the shared store in the foreground: `python -c "from shared.response_cache import serve_local_store; serve_local_store()"`."""
+    _StoreManager(address=address, authkey=_authkey(authkey)).get_server().serve_forever()
+
+# ------------------------------------------------------------------- #
+
+class SemanticResponseCache(object):
+    """Maps the (rewritten) query embedding to a previously streamed answer.
+
+    `version` identifies the index build the answers were grounded in; a backend holding answers
+    for any other version is cleared, so rebuilding an index invalidates the cache.
+    """
+
+    def __init__(self, embeddings: Embeddings, backend: CacheBackend, threshold: float, version: str):
+        self.embeddings = embeddings
+        self.backend = backend
+        self.threshold = threshold
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        if backend.get_version() != version:
+            backend.clear()
+            backend.set_version(version)
+
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def lookup(self, query: str) -> tuple[str | None, list[float]]:
+        vector = await self.embeddings.aembed_query(query)
+        answer, _ = await self._call(self.backend.search, vector, self.threshold)
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer, vector
+
+    async def store(self, vector: list[float], answer: str):
+        if not vector or not answer:
+            return
+        await self._call(self.backend.put, vector, answer)
+        self.stores += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "entries": self.backend.size(),
+            "version": self.version,
+        }
+
+
+def make_response_cache(embeddings: Embeddings, namespace: str, version: str, backend: str | None,
+                        threshold: float, maxsize: int, ttl: float | None,
+                        address: tuple[str, int] = DEFAULT_ADDRESS) -> SemanticResponseCache | None:
+    """`backend` is "memory", "local" (shared local-process store) or None to disable caching."""
+    if backend is None:
+        return None
+    if backend == "memory":
+        store = InProcessBackend(maxsize, ttl)
+    elif backend == "local":
+        store = LocalProcessBackend(namespace, maxsize, ttl, address)
+    else:
+        raise ValueError(f"unknown response cache backend: {backend}")
+    return SemanticResponseCache(embeddings, store, threshold, f"{namespace}:{version}")
+
+
+_REPLAY_CHUNK = re.compile(r"\s*\S+\s*?(?=\s|$)|\s+$")
+
+def replay_chunks(answer: str) -> list[str]:
+    """Split a cached answer into word-sized pieces so a replay streams like a live completion."""
+    return _REPLAY_CHUNK.findall(answer) or [answer]
@@ -0,0 +1,150 @@
+import hashlib
+from typing import Optional, Sequence
+
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.embeddings import Embeddings
+
+from .lru import LRUCache
+from .tracing import span
+
+# ------------------------------------------------------------------- #
+
+class CachedEmbeddings(Embeddings):
+    """text -> vector cache in front of an embedding client; only cache misses are sent upstream.
+
+    Vectors are kept as float32 arrays, so `maxsize` bounds memory at roughly maxsize * dims * 4 bytes.
+    """
+
+    def __init__(self, embeddings: Embeddings, maxsize: int = 2000):
+        self.embeddings = embeddings
+        self.cache = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self) -> str:
+        return getattr(self.embeddings, "model", type(self.embeddings).__name__)
+
+    def _lookup(self, texts: list[str]) -> tuple[list, list[str]]:
+        vectors = [self.cache.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return vectors, missing
+
+    def _fill(self, texts, vectors, missing, fetched) -> list[list[float]]:
+        fetched = dict(zip(missing, fetched))
+        for text, vector in fetched.items():
+            self.cache.put(text, np.asarray(vector, dtype=np.float32))
+        return [(fetched[t] if v is None else v.tolist()) for t, v in zip(texts, vectors)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        fetched = []
+        if missing:
+            with span("embed", self.model, texts=len(missing)):
+                fetched = self.embeddings.embed_documents(missing)
+        return self._fill(texts, vectors, missing, fetched)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        fetched = []
+        if missing:
+            with span("embed", self.model, texts=len(missing)):
+                fetched = await self.embeddings.aembed_documents(missing)
+        return self._fill(texts, vectors, missing, fetched)
+
+    def embed_query(self, text: str) -> list[float]:
+        vectors, missing = self._lookup([text])
+        fetched = []
+        if missing:
+            with span("embed", self.model, texts=1):
+                fetched = [self.embeddings.embed_query(text)]
+        return self._fill([text], vectors, missing, fetched)[0]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vectors, missing = self._lookup([text])
+        fetched = []
+        if missing:
+            with span("embed", self.model, texts=1):
+                fetched = [await self.embeddings.aembed_query(text)]
+        return self._fill([text], vectors, missing, fetched)[0]
+
+
+def document_key(doc: Document) -> str:
+    doc_id = doc.id or doc.metadata.get("doc_id")
+    if doc_id:
+        return str(doc_id)
+    return hashlib.sha1(doc.page_content.encode()).hexdigest()
+
+
+class CachedReranker(BaseDocumentCompressor):
+    """(query, candidate ids) -> ordering cache in front of a reranker such as CohereRerank.
+
+    Only the ordering and relevance scores are cached; documents are always the caller's candidates,
+    so a hit never serves stale content.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    base_compressor: BaseDocumentCompressor
+    cache: LRUCache
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, base_compressor: BaseDocumentCompressor, maxsize: int = 2000, **kwargs):
+        super().__init__(base_compressor=base_compressor, cache=LRUCache(maxsize), **kwargs)
+
+    def _key(self, documents: Sequence[Document], query: str) -> tuple:
+        return (query, tuple(document_key(d) for d in documents))
+
+    def _ordering(self, documents: Sequence[Document], reranked: Sequence[Document]) -> list[tuple[int, Optional[float]]]:
+        positions = {}
+        for i, doc in enumerate(documents):
+            positions.setdefault(doc.page_content, []).append(i)
+        ordering = []
+        for doc in reranked:
+            i = positions[doc.page_content].pop(0)
+            ordering.append((i, doc.metadata.get("relevance_score")))
+        return ordering
+
+    def _apply(self, documents: Sequence[Document], ordering) -> list[Document]:
+        result = []
+        for i, score in ordering:
+            doc = documents[i]
+            if score is not None:
+                doc = Document(page_content=doc.page_content, metadata={**doc.metadata, "relevance_score": score}, id=doc.id)
+            result.append(doc)
+        return result
+
+    def lookup(self, documents: Sequence[Document], query: str) -> Optional[list[Document]]:
+        ordering = self.cache.get(self._key(documents, query))
+        if ordering is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._apply(documents, ordering)
+
+    def remember(self, documents: Sequence[Document], query: str, reranked: Sequence[Document]) -> list[Document]:
+        ordering = self._ordering(documents, reranked)
+        self.cache.put(self._key(documents, query), ordering)
+        return self._apply(documents, ordering)
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        cached = self.lookup(documents, query)
+        if cached is not None:
+            return cached
+        with span("rerank", type(self.base_compressor).__name__, documents=len(documents)):
+            reranked = self.base_compressor.compress_documents(documents, query, callbacks)
+        return self.remember(documents, query, reranked)
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        cached = self.lookup(documents, query)
+        if cached is not None:
+            return cached
+        with span("rerank", type(self.base_compressor).__name__, documents=len(documents)):
+            reranked = await self.base_compressor.acompress_documents(documents, query, callbacks)
+        return self.remember(documents, query, reranked)
@@ -0,0 +1,125 @@
+from typing import Optional
+
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .sparse_index import FusedRetriever, SparseIndex
+
+# ------------------------------------------------------------------- #
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True).clip(min=1e-12)
+
+
+def _vectors(vectorstore) -> np.ndarray:
+    return vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+
+
+def link_titles(titles: list[str], first_pages: dict[str, str], margin: float = 1.5) -> list[Optional[str]]:
+    """Match titles without a `source` to a guideline by BM25 against each guideline's first page.
+
+    A title is linked only when its best match beats the runner-up by `margin`; the rest are left
+    unlinked rather than routed to the wrong guideline.
+    """
+    sources = list(first_pages)
+    index = SparseIndex.build(sources, [first_pages[s] for s in sources])
+    links = []
+    for title in titles:
+        hits = index.search(title, 2)
+        if hits and (len(hits) == 1 or hits[0][1] >= margin * hits[1][1]):
+            links.append(hits[0][0])
+        else:
+            links.append(None)
+    return links
+
+
+class GuidelineRouter(object):
+    """Scores whole guidelines against a query, ahead of chunk search.
+
+    Each guideline is represented by the normalised centroid of its chunk vectors (a summary vector
+    that needs no extra embedding calls) and by its title from `titles_vector`, if one is linked;
+    a guideline's score is the better of the two cosine similarities.
+    """
+
+    def __init__(self, docs, titles=None):
+        positions: dict[str, list[int]] = {}
+        first_pages: dict[str, tuple[int, str]] = {}
+        for i in range(len(docs.index_to_docstore_id)):
+            doc = docs.docstore.search(docs.index_to_docstore_id[i])
+            source = doc.metadata.get("source")
+            positions.setdefault(source, []).append(i)
+            page = doc.metadata.get("page", 0)
+            if source not in first_pages or page < first_pages[source][0]:
+                first_pages[source] = (page, doc.page_content)
+
+        self.sources = list(positions)
+        self.positions = {s: np.asarray(p, dtype=np.int64) for s, p in positions.items()}
+        vectors = _vectors(docs)
+        self.centroids = _normalize(np.stack([vectors[self.positions[s]].mean(axis=0) for s in self.sources]))
+
+        self.title_vectors = np.zeros((0, self.centroids.shape[1]), dtype=np.float32)
+        self.title_sources = np.zeros(0, dtype=np.int64)
+        if titles is not None:
+            title_docs = [titles.docstore.search(titles.index_to_docstore_id[i]) for i in range(len(titles.index_to_docstore_id))]
+            # titles written by the ingest CLI carry their source; older builds are linked by content
+            links = [d.metadata.get("source") for d in title_docs]
+            if any(link is None for link in links):
+                guessed = link_titles([d.page_content for d in title_docs], {s: text for s, (_, text) in first_pages.items()})
+                links = [link or guess for link, guess in zip(links, guessed)]
+            keep = [i for i, link in enumerate(links) if link in self.positions]
+            source_index = {s: j for j, s in enumerate(self.sources)}
+            self.title_vectors = _normalize(_vectors(titles)[keep])
+            self.title_sources = np.asarray([source_index[links[i]] for i in keep], dtype=np.int64)
+
+    def route(self, vector: list[float], top_m: int) -> list[tuple[str, float]]:
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        scores = self.centroids @ query
+        if len(self.title_sources):
+            np.maximum.at(scores, self.title_sources, self.title_vectors @ query)
+        top = np.argsort(-scores, kind="stable")[:top_m]
+        return [(self.sources[i], float(scores[i])) for i in top]
+
+    def positions_for(self, sources: list[str]) -> np.ndarray:
+        return np.concatenate([self.positions[s] for s in sources])
+
+
+class RoutedRetriever(BaseRetriever):
+    """Two-stage retrieval: route to the top guidelines, then search only their chunks.
+
+    When the best guideline scores below `min_score` the query is not clearly about any one
+    guideline and `fallback` (global search) is used instead.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    router: GuidelineRouter
+    retriever: FusedRetriever
+    fallback: BaseRetriever
+    top_m: int = 3
+    min_score: float = 0.3
+    routed: int = 0
+    fell_back: int = 0
+
+    def _route(self, vector: list[float]) -> Optional[np.ndarray]:
+        routes = self.router.route(vector, self.top_m)
+        if not routes or routes[0][1] < self.min_score:
+            self.fell_back += 1
+            return None
+        self.routed += 1
+        return self.router.positions_for([s for s, _ in routes])
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        vector = self.retriever.vectorstore.embedding_function.embed_query(query)
+        positions = self._route(vector)
+        if positions is None:
+            return self.fallback.invoke(query)
+        return self.retriever.search(query, vector, positions)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        vector = await self.retriever.vectorstore.embedding_function.aembed_query(query)
+        positions = self._route(vector)
+        if positions is None:
+            return await self.fallback.ainvoke(query)
+        return await self.retriever.asearch(query, vector, positions)
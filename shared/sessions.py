@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+# ------------------------------------------------------------------- #
+# server-side chat sessions: a graph compiled with a checkpointer keeps each session's last turn (its
+# query embedding, retrieval candidates and app-specific choices) under the session id, so a follow-up
+# on the same subject can rerank those candidates instead of searching again. Sessions live in the
+# worker process that served them (route a session to one worker) and start afresh after a corpus swap.
+
+class SessionStore(InMemorySaver):
+    """In-process LangGraph checkpointer holding only the latest checkpoint of each session (thread),
+    for `ttl` seconds after its last turn and for at most `maxsize` sessions (least recently used
+    dropped first). Graphs using it run with durability="exit": one checkpoint per turn."""
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = 30 * 60):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._used: OrderedDict[str, float] = OrderedDict()     # thread id -> last turn (monotonic)
+        self._versions: dict[tuple[str, str], dict] = {}         # (thread id, ns) -> channel versions stored
+        self._lock = threading.RLock()
+        self.resumed = 0
+        self.started = 0
+        self.expired = 0
+
+    def _expired(self, thread_id: str, now: float) -> bool:
+        return self.ttl is not None and now - self._used[thread_id] > self.ttl
+
+    def _drop(self, thread_id: str):
+        self._used.pop(thread_id, None)
+        for ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, ns, checkpoint_id), None)
+            for channel, version in self._versions.pop((thread_id, ns), {}).items():
+                self.blobs.pop((thread_id, ns, channel, version), None)
+
+    def get_tuple(self, config: RunnableConfig):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            # unknown ids are not looked up: the base class would create an empty entry for each
+            if thread_id in self._used and self._expired(thread_id, time.monotonic()):
+                self._drop(thread_id)
+                self.expired += 1
+            if thread_id not in self._used:
+                self.started += 1
+                return None
+            self.resumed += 1
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            saved = super().put(config, checkpoint, metadata, new_versions)
+            # only the latest checkpoint is ever read back: drop the earlier ones and the values they alone held
+            checkpoints = self.storage[thread_id][ns]
+            for old in [i for i in checkpoints if i != checkpoint["id"]]:
+                del checkpoints[old]
+                self.writes.pop((thread_id, ns, old), None)
+            versions = dict(checkpoint["channel_versions"])
+            for channel, version in self._versions.get((thread_id, ns), {}).items():
+                if versions.get(channel) != version:
+                    self.blobs.pop((thread_id, ns, channel, version), None)
+            self._versions[(thread_id, ns)] = versions
+
+            now = time.monotonic()
+            self._used[thread_id] = now
+            self._used.move_to_end(thread_id)
+            while self._used and (len(self._used) > self.maxsize or self._expired(next(iter(self._used)), now)):
+                self._drop(next(iter(self._used)))
+                self.expired += 1
+            return saved
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            self._drop(thread_id)
+
+    def metrics(self) -> dict:
+        return {"sessions": len(self._used), "resumed": self.resumed, "started": self.started, "expired": self.expired}
+
+
+def make_session_store(backend: Optional[str], maxsize: int, ttl: Optional[float]) -> Optional[BaseCheckpointSaver]:
+    """`backend` is "memory" (SessionStore) or None to disable sessions. Any other LangGraph checkpointer
+    (Redis, Postgres, ...) can be handed to a MainGraph instead."""
+    if backend is None:
+        return None
+    if backend == "memory":
+        return SessionStore(maxsize, ttl)
+    raise ValueError(f"unknown session backend: {backend}")
+
+
+def session_config(config: Optional[RunnableConfig], session_id: str) -> RunnableConfig:
+    return {**(config or {}), "configurable": {**(config or {}).get("configurable", {}), "thread_id": session_id}}
+
+
+def in_session(config: Optional[RunnableConfig]) -> bool:
+    return bool((config or {}).get("configurable", {}).get("thread_id"))
+
+# ------------------------------------------------------------------- #
+
+class RetrievalReuse(object):
+    """A session's last turn, as the query it searched for, that query's embedding and the ids of its
+    retrieval candidates (looked up again in `docstore`, so a session stays a few KB and serializable
+    by any checkpointer). A follow-up close enough to that query reranks those candidates instead of
+    searching again."""
+
+    def __init__(self, docstore: Any, min_similarity: float):
+        self.docstore = docstore
+        self.min_similarity = min_similarity
+        self.reused = 0
+        self.searched = 0
+
+    def remember(self, query: str, embedding: list[float], candidates: list[Document], **extra: Any) -> Optional[dict]:
+        ids = [d.id for d in candidates]
+        if not all(ids):
+            return None
+        return {"query": query, "embedding": np.asarray(embedding, dtype=np.float32), "candidate_ids": ids, **extra}
+
+    def candidates(self, last_turn: Optional[dict], embedding: Optional[list[float]]) -> Optional[list[Document]]:
+        """The last turn's candidates if `embedding` is close enough to its query, else None."""
+        if not last_turn or embedding is None:
+            return None
+        a, b = np.asarray(embedding, dtype=np.float32), last_turn["embedding"]
+        if float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0)) < self.min_similarity:
+            self.searched += 1
+            return None
+        self.reused += 1
+        return [d for d in self.docstore.mget(last_turn["candidate_ids"]) if d is not None]
+
+    def metrics(self) -> dict:
+        turns = self.reused + self.searched
+        return {"follow_ups": turns, "reused": self.reused, "reuse_rate": round(self.reused / turns, 3) if turns else None}
@@ -0,0 +1,191 @@
+import asyncio
+from collections import Counter
+from pathlib import Path
+from typing import Any, Optional
+
+import faiss
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .rerankers import tokenize
+
+SPARSE_FILE = "sparse.npz"
+
+# ------------------------------------------------------------------- #
+
+class SparseIndex(object):
+    """BM25 inverted index keyed by docstore id, stored next to a FAISS index as `sparse.npz`.
+
+    Postings are CSR arrays (term -> doc positions, term frequencies), so a query only touches the
+    postings of its own terms. Exact-match terms (drug and device names, acronyms) are where this
+    beats dense retrieval.
+    """
+
+    def __init__(self, ids: np.ndarray, terms: np.ndarray, indptr: np.ndarray, postings: np.ndarray,
+                 freqs: np.ndarray, doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.ids = ids
+        self.vocab = {t: i for i, t in enumerate(terms.tolist())}
+        self.terms = terms
+        self.indptr = indptr
+        self.postings = postings
+        self.freqs = freqs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        n = len(ids)
+        df = np.diff(indptr)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.norm = (k1 * (1 - b + b * doc_len / max(doc_len.mean(), 1.0))).astype(np.float32) if n else doc_len
+
+    @classmethod
+    def build(cls, ids: list[str], texts: list[str], **kwargs) -> "SparseIndex":
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for j, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[j] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((j, tf))
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(postings[t]) for t in terms])
+        flat = [p for t in terms for p in postings[t]]
+        return cls(
+            ids=np.array(ids, dtype=str),
+            terms=np.array(terms, dtype=str),
+            indptr=indptr,
+            postings=np.array([j for j, _ in flat], dtype=np.int32),
+            freqs=np.array([tf for _, tf in flat], dtype=np.float32),
+            doc_len=doc_len,
+            **kwargs,
+        )
+
+    @staticmethod
+    def _index_ids(vectorstore) -> list[str]:
+        return [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "SparseIndex":
+        ids = cls._index_ids(vectorstore)
+        return cls.build(ids, [vectorstore.docstore.search(i).page_content for i in ids])
+
+    def matches(self, vectorstore) -> bool:
+        """Built from this index: the same docstore ids at the same positions."""
+        return self.ids.tolist() == self._index_ids(vectorstore)
+
+    def save(self, directory: Path):
+        np.savez(Path(directory) / SPARSE_FILE, ids=self.ids, terms=self.terms, indptr=self.indptr,
+                 postings=self.postings, freqs=self.freqs, doc_len=self.doc_len)
+
+    @classmethod
+    def load(cls, directory: Path) -> "SparseIndex":
+        with np.load(Path(directory) / SPARSE_FILE) as data:
+            return cls(**{k: data[k] for k in data.files})
+
+    def search(self, query: str, k: int, positions: Optional[np.ndarray] = None) -> list[tuple[str, float]]:
+        """Top-k (id, score) pairs; `positions` restricts the search to those index positions."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            row = self.vocab.get(term)
+            if row is None:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            docs, tf = self.postings[start:end], self.freqs[start:end]
+            scores[docs] += self.idf[row] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        if positions is not None:
+            allowed = np.zeros(len(self.ids), dtype=bool)
+            allowed[positions] = True
+            scores[~allowed] = 0.0
+        k = min(k, int((scores > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(str(self.ids[i]), float(scores[i])) for i in top]
+
+
+def load_or_build_sparse(vectorstore, directory: Path) -> SparseIndex:
+    """Load `sparse.npz` from the FAISS index directory, building (and trying to store) it if missing
+    or built from another version of the index."""
+    try:
+        sparse = SparseIndex.load(directory)
+        if sparse.matches(vectorstore):
+            return sparse
+    except FileNotFoundError:
+        pass
+    sparse = SparseIndex.from_vectorstore(vectorstore)
+    try:
+        sparse.save(directory)
+    except OSError:
+        pass
+    return sparse
+
+# ------------------------------------------------------------------- #
+
+class FusedRetriever(BaseRetriever):
+    """Dense FAISS search and BM25 search run concurrently, merged with reciprocal-rank fusion.
+
+    Fusion recovers exact-term matches the dense search misses, so `k` (the candidate set handed to
+    the reranker) can be smaller than with dense retrieval alone for the same recall. With `sparse`
+    unset it is a plain dense retriever that can also search a subset of the index (`asearch`).
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Any
+    sparse: Optional[SparseIndex] = None
+    k: int = 25
+    dense_k: int = 30
+    sparse_k: int = 30
+    rrf_k: int = 60
+
+    def _dense(self, vector: list[float], positions: Optional[np.ndarray] = None) -> list[str]:
+        if not self.dense_k:
+            return []
+        params = None
+        if positions is not None:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64)))
+        _, found = self.vectorstore.index.search(np.asarray([vector], dtype=np.float32), self.dense_k, params=params)
+        return [self.vectorstore.index_to_docstore_id[i] for i in found[0] if i != -1]
+
+    def _sparse(self, query: str, positions: Optional[np.ndarray] = None) -> list[tuple[str, float]]:
+        if self.sparse is None or not self.sparse_k:
+            return []
+        return self.sparse.search(query, self.sparse_k, positions)
+
+    def _fuse(self, dense: list[str], sparse: list[tuple[str, float]]) -> list[Document]:
+        scores: dict[str, float] = {}
+        for ranking in (dense, [i for i, _ in sparse]):
+            for rank, doc_id in enumerate(ranking):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        top = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        docs = []
+        for doc_id in top:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                # the docstore answers a missing id with a message
+                continue
+            docs.append(Document(page_content=doc.page_content, metadata=doc.metadata, id=doc_id))
+        return docs
+
+    def search(self, query: str, vector: list[float], positions: Optional[np.ndarray] = None) -> list[Document]:
+        return self._fuse(self._dense(vector, positions), self._sparse(query, positions))
+
+    async def asearch(self, query: str, vector: list[float], positions: Optional[np.ndarray] = None) -> list[Document]:
+        dense_ids, sparse_hits = await asyncio.gather(
+            asyncio.to_thread(self._dense, vector, positions),
+            asyncio.to_thread(self._sparse, query, positions),
+        )
+        return self._fuse(dense_ids, sparse_hits)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.search(query, self.vectorstore.embedding_function.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        # the BM25 side does not wait for the query embedding
+        sparse_task = asyncio.create_task(asyncio.to_thread(self._sparse, query))
+        vector = await self.vectorstore.embedding_function.aembed_query(query)
+        dense_ids = await asyncio.to_thread(self._dense, vector)
+        return self._fuse(dense_ids, await sparse_task)
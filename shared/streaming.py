@@ -0,0 +1,219 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import numpy as np
+
+from .corpus import CorpusRegistry
+from .response_cache import replay_chunks
+from .sessions import session_config
+from .tracing import traced
+
+logger = logging.getLogger("tli.stream")
+
+# "raw" is the original unframed stream (concatenated JSON objects), kept for existing clients
+MEDIA_TYPES = {
+    "raw": None,
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+# keep proxies from buffering the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_END = object()
+_CANCELLED = object()
+
+# ------------------------------------------------------------------- #
+
+def negotiate(format: Optional[str], accept: str) -> str:
+    """Stream format from an explicit ?format= value, else the Accept header, else "raw".
+
+    Only "sse" and "ndjson" report how a stream ended (a "done" or an "error" event): a raw stream
+    that fails just stops, as it always has. Clients that need to tell the two apart use a framed format.
+    """
+    if format in MEDIA_TYPES:
+        return format
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept or "application/jsonl" in accept:
+        return "ndjson"
+    return "raw"
+
+
+def encode(event: dict, format: str, seq: int) -> str:
+    if format == "sse":
+        return f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    if format == "ndjson":
+        return json.dumps(event) + "\n"
+    return json.dumps(event)
+
+
+def heartbeat(format: str) -> str:
+    # an SSE comment line is ignored by EventSource; NDJSON readers skip the "heartbeat" type
+    return ": heartbeat\n\n" if format == "sse" else json.dumps({"type": "heartbeat"}) + "\n"
+
+
+class StreamStats(object):
+    """Completed vs. abandoned streams, and what was left undelivered when a client went away."""
+
+    def __init__(self, window: int = 1024):
+        self.streams = 0
+        self.completed = 0
+        self.disconnects = 0
+        self.frames = 0
+        self.chunks = 0
+        self.undelivered_chunks = 0
+        self.cancel_s = deque(maxlen=window)
+
+    def metrics(self) -> dict:
+        cancel = np.array(self.cancel_s)
+        return {
+            "streams": self.streams,
+            "completed": self.completed,
+            "disconnects": self.disconnects,
+            "chunks_per_frame": round(self.chunks / self.frames, 2) if self.frames else 0.0,
+            "undelivered_chunks": self.undelivered_chunks,
+            "cancel_ms_p99": round(float(np.percentile(cancel, 99)) * 1000, 1) if len(cancel) else 0.0,
+        }
+
+
+def _cancel(producer: asyncio.Task, stats: StreamStats):
+    start = time.perf_counter()
+    producer.cancel()
+    producer.add_done_callback(lambda _: stats.cancel_s.append(time.perf_counter() - start))
+
+
+async def framed(events: AsyncIterator[dict], format: str, flush_s: float = 0.04, max_chars: int = 256,
+                 heartbeat_s: float = 15.0, stats: Optional[StreamStats] = None,
+                 disconnected: Optional[Callable[[], Awaitable[bool]]] = None, poll_s: float = 0.5) -> AsyncIterator[str]:
+    """Frame `events` ({"id", "text", "type"} dicts) for the wire.
+
+    The source runs in a task of its own, so closing or cancelling this generator (the client went
+    away) cancels the source and, through it, the graph run and its upstream calls. Consecutive text
+    chunks of one run are merged: the first goes out at once, later ones wait at most `flush_s` or
+    until `max_chars` have accumulated. A heartbeat goes out after `heartbeat_s` without a frame.
+    The raw format keeps the original behaviour: one unframed JSON object per chunk, no heartbeats
+    and no "done" or "error" events.
+
+    Servers do not always cancel the response when the client goes away (under ASGI 2.4 a
+    disconnect only surfaces on a failed write), so `disconnected` (e.g. Request.is_disconnected)
+    is also polled every `poll_s` seconds.
+    """
+    stats = stats or StreamStats()
+    stats.streams += 1
+    # unbounded, like the astream_events buffer it drains; the source is paced by the LLM
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+            queue.put_nowait(_END)
+        except asyncio.CancelledError:
+            queue.put_nowait(_CANCELLED)
+            raise
+        except Exception:
+            # upstream errors can carry URLs and internal detail: the client only learns the stream failed
+            logger.exception("stream failed")
+            queue.put_nowait({"type": "error", "detail": "internal error"})
+            queue.put_nowait(_END)
+
+    async def watch():
+        while not producer.done():
+            await asyncio.sleep(poll_s)
+            if await disconnected():
+                stats.disconnects += 1
+                stats.undelivered_chunks += queue.qsize()
+                _cancel(producer, stats)
+                return
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(watch()) if disconnected is not None else None
+    seq = itertools.count()
+    loop = asyncio.get_running_loop()
+    pending: list[dict] = []
+    deadline = None
+    sent_text = False
+
+    def flush() -> str:
+        nonlocal deadline
+        event = {**pending[0], "text": "".join(e["text"] for e in pending)}
+        stats.frames += 1
+        stats.chunks += len(pending)
+        pending.clear()
+        deadline = None
+        return encode(event, format, next(seq))
+
+    try:
+        while True:
+            timeout = heartbeat_s if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout if format != "raw" else None)
+            except asyncio.TimeoutError:
+                yield flush() if pending else heartbeat(format)
+                continue
+            if event is _END:
+                break
+            if event is _CANCELLED:
+                return
+            if format == "raw":
+                if event["type"] != "error":
+                    yield encode(event, format, next(seq))
+                continue
+            if event["type"] == "text" and (not pending or pending[-1].get("id") == event.get("id")):
+                pending.append(event)
+                if not sent_text or flush_s <= 0 or sum(len(e["text"]) for e in pending) >= max_chars:
+                    sent_text = True
+                    yield flush()
+                elif deadline is None:
+                    deadline = loop.time() + flush_s
+                continue
+            if pending:
+                yield flush()
+            yield encode(event, format, next(seq))
+        if pending:
+            yield flush()
+        if format != "raw":
+            yield encode({"type": "done"}, format, next(seq))
+        stats.completed += 1
+    except (asyncio.CancelledError, GeneratorExit):
+        stats.disconnects += 1
+        stats.undelivered_chunks += len(pending) + queue.qsize()
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not producer.done():
+            _cancel(producer, stats)
+
+# ------------------------------------------------------------------- #
+
+async def graph_events(corpus: CorpusRegistry, backend: str, input: list, session_id: Optional[str] = None,
+                       sample_rate: float = 0.0, json_log: bool = False) -> AsyncIterator[dict]:
+    """One chat turn on `corpus`'s current graph, as {"id", "text", "type"} events for framed().
+
+    The graph is held for the whole stream: a corpus swap meanwhile only affects later requests.
+    A share `sample_rate` of turns is traced under `backend` (see shared/tracing.py).
+    """
+    with corpus.acquire() as main_graph, traced(backend, sample_rate, json_log) as trace:
+        graph, config, options = main_graph.graph, trace and trace.config, {}
+        if session_id and main_graph.session_graph is not None:
+            # the session's state is saved once, when the turn completes
+            graph, config, options = main_graph.session_graph, session_config(config, session_id), {"durability": "exit"}
+        # only the token stream and the cache node's writes: astream_events would build (and
+        # serialize) a start/stream/end event for every chain, prompt, parser and retriever in the run
+        async for mode, data in graph.astream(main_graph.turn_input(input), config, stream_mode=["messages", "custom"],
+                                              **options):
+            if mode == "messages":
+                chunk, metadata = data
+                if chunk.content and metadata["langgraph_node"] == "respond":
+                    yield {"id": chunk.id, "text": chunk.content, "type": "text"}
+            elif "cached_response" in data:
+                id = str(uuid.uuid4())
+                for content in replay_chunks(data["cached_response"]):
+                    yield {"id": id, "text": content, "type": "text"}
@@ -0,0 +1,307 @@
+import bisect
+import contextlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ------------------------------------------------------------------- #
+# per-request spans, kept only for sampled requests, with no external tracing service: span
+# durations feed Prometheus-style histograms (render_prometheus) and, optionally, one JSON log
+# line per request
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("tli.trace")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_ids = itertools.count(1)
+
+# ------------------------------------------------------------------- #
+
+class Histogram(object):
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}    # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = _labels(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{base.rstrip(',')}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{base.rstrip(',')}}} {values[-1]}")
+        return lines
+
+
+class Counter(object):
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._series: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float, *labels: str):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            lines.append(f"{self.name}{{{_labels(self.labelnames, labels).rstrip(',')}}} {value:g}")
+        return lines
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    return "".join(f'{n}="{v}",' for n, v in zip(names, values))
+
+
+SPAN_SECONDS = Histogram("tli_span_seconds", "Duration of traced work, by kind (request, node, retriever, llm, "
+                         "embed, search, rerank, classify, upstream) and name.", ("backend", "kind", "name"))
+TTFT_SECONDS = Histogram("tli_llm_time_to_first_token_seconds", "LLM call start to first streamed token.", ("backend", "node"))
+LLM_TOKENS = Counter("tli_llm_tokens_total", "LLM tokens by type (prompt, cached_prompt, completion).", ("backend", "node", "type"))
+TRACED_REQUESTS = Counter("tli_traced_requests_total", "Requests traced (sampled) and their outcome.", ("backend", "outcome"))
+REGISTRY = [SPAN_SECONDS, TTFT_SECONDS, LLM_TOKENS, TRACED_REQUESTS]
+
+# ------------------------------------------------------------------- #
+
+class Trace(object):
+    """The spans of one sampled request. Spans are (kind, name, start, duration, attrs), relative to the trace start."""
+
+    def __init__(self, backend: str, log: bool):
+        self.backend = backend
+        self.log = log
+        self.id = f"{os.getpid():x}-{next(_ids):x}"
+        self.start = time.perf_counter()
+        self.spans: list[tuple] = []
+        self.tracer = GraphTracer(self)
+        self.config = {"callbacks": [self.tracer]}
+        self.finished = False
+
+    def record(self, kind: str, name: str, start: float, end: float, **attrs):
+        if self.finished:
+            return
+        SPAN_SECONDS.observe(end - start, self.backend, kind, name)
+        self.spans.append((kind, name, start - self.start, end - start, attrs))
+
+    def finish(self, outcome: str):
+        end = time.perf_counter()
+        self.record("request", "chat", self.start, end, outcome=outcome)
+        self.finished = True
+        TRACED_REQUESTS.inc(1, self.backend, outcome)
+        if self.log:
+            log_json(logger, {
+                "trace_id": self.id, "backend": self.backend, "outcome": outcome, "ms": round((end - self.start) * 1000, 1),
+                "spans": [{"kind": k, "name": n, "start_ms": round(s * 1000, 1), "ms": round(d * 1000, 1), **a}
+                          for k, n, s, d, a in self.spans],
+            })
+
+
+def log_json(logger: logging.Logger, record: dict):
+    """`record` as one JSON line on `logger`, which writes to stderr unless configured otherwise."""
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    logger.info(json.dumps(record, default=str))
+
+
+@contextlib.contextmanager
+def traced(backend: str, sample_rate: float, log: bool = False):
+    """Trace the request run inside the block with probability `sample_rate`; yields the Trace or None.
+
+    Pass `trace.config` to the graph run so node, retriever and LLM callbacks are recorded; code in
+    the same (or a copied) context records its own work with span().
+    """
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        yield None
+        return
+    trace = Trace(backend, log)
+    token = _current.set(trace)
+    outcome = "ok"
+    try:
+        yield trace
+    except GeneratorExit:
+        outcome = "closed"
+        raise
+    except BaseException as e:
+        outcome = "cancelled" if type(e).__name__ == "CancelledError" else "error"
+        raise
+    finally:
+        trace.finish(outcome)
+        # a generator closed from another task runs this in a different context
+        with contextlib.suppress(ValueError):
+            _current.reset(token)
+
+
+class _Span(object):
+    __slots__ = ("trace", "kind", "name", "attrs", "start")
+
+    def __init__(self, trace: Trace, kind: str, name: str, attrs: dict):
+        self.trace, self.kind, self.name, self.attrs = trace, kind, name, attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.kind, self.name, self.start, time.perf_counter(), **self.attrs)
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(kind: str, name: str, **attrs):
+    """Time the enclosed block as part of the current request's trace; a no-op when it is not sampled."""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, kind, name, attrs)
+
+
+class TracedIndex(object):
+    """Wraps a faiss index (vectorstore.index) so its searches show up as spans."""
+
+    def __init__(self, index, name: str):
+        self._index = index
+        self._name = name
+
+    def search(self, *args, **kwargs):
+        with span("search", self._name):
+            return self._index.search(*args, **kwargs)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._index, attr)
+
+# ------------------------------------------------------------------- #
+
+class GraphTracer(BaseCallbackHandler):
+    """Graph node, retriever and LLM spans of one request, from the run's callbacks."""
+    run_inline = True
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self._started: dict[UUID, tuple] = {}
+        self._first_token: dict[UUID, float] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # the node's own run (not the runnables inside it) carries the node's name
+        if node is not None and kwargs.get("name") == node:
+            self._started[run_id] = ("node", node, time.perf_counter(), node)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "retriever"
+        self._started[run_id] = ("retriever", name, time.perf_counter(), (metadata or {}).get("langgraph_node"))
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None, **kwargs):
+        metadata = metadata or {}
+        name = metadata.get("ls_model_name") or kwargs.get("name") or "llm"
+        self._started[run_id] = ("llm", name, time.perf_counter(), metadata.get("langgraph_node"))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        if run_id not in self._first_token and token:
+            self._first_token[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        started = self._started.get(run_id)
+        if started is None:
+            return
+        node = started[3] or "-"
+        attrs = {}
+        first = self._first_token.pop(run_id, None)
+        if first is not None:
+            TTFT_SECONDS.observe(first - started[2], self.trace.backend, node)
+            attrs["ttft_ms"] = round((first - started[2]) * 1000, 1)
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if usage:
+            cached = usage.get("input_token_details", {}).get("cache_read", 0) or 0
+            for kind, count in (("prompt", usage.get("input_tokens", 0)), ("cached_prompt", cached),
+                                ("completion", usage.get("output_tokens", 0))):
+                LLM_TOKENS.inc(count, self.trace.backend, node, kind)
+                attrs[f"{kind}_tokens"] = count
+        self._end(run_id, **attrs)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._first_token.pop(run_id, None)
+        self._end(run_id, error=type(error).__name__)
+
+    def _end(self, run_id: UUID, **attrs):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        kind, name, start, node = started
+        if node is not None and kind != "node":
+            attrs["node"] = node
+        self.trace.record(kind, name, start, time.perf_counter(), **attrs)
+
+# ------------------------------------------------------------------- #
+
+def _gauges(prefix: str, value: Any, labels: str, lines: list[str]):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        lines.append(f"{prefix}{{{labels}}} {value:g}")
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _gauges(f"{prefix}_{''.join(c if c.isalnum() else '_' for c in str(key))}", item, labels, lines)
+
+
+def render_prometheus(snapshots: dict[str, dict]) -> str:
+    """Text exposition: the trace histograms and counters, plus every numeric value of the JSON
+    /metrics snapshots (given per backend) as an untyped gauge."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for backend, snapshot in snapshots.items():
+        _gauges("tli", snapshot, f'backend="{backend}"', lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import Counter
+from typing import Optional
+
+import httpx
+
+from .admission import UPSTREAMS, AsyncBudgetedTransport, BudgetedTransport, UpstreamBudget
+from .tracing import span
+
+try:
+    import h2  # noqa: F401  (httpx negotiates HTTP/2 only when h2 is installed)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# ------------------------------------------------------------------- #
+# one keep-alive pool per upstream for the whole process, shared by both backends
+
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=60)
+
+# identical in-flight requests share one upstream call; never for chat completions (sampled, streamed)
+COALESCE = {"llm": False, "embeddings": True, "rerank": True}
+
+# ------------------------------------------------------------------- #
+
+class PoolStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.http_versions = Counter()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def metrics(self) -> dict:
+        shared = self.leaders + self.coalesced
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections,
+            "connection_reuse": round(1 - self.connections / self.requests, 3) if self.requests else 0.0,
+            "http_versions": dict(self.http_versions),
+            "coalesced": self.coalesced,
+            "coalesce_hit_rate": round(self.coalesced / shared, 3) if shared else 0.0,
+        }
+
+
+class PooledTransport(httpx.BaseTransport):
+    """Keep-alive (HTTP/2 when available) connection pool that counts new connections per request."""
+
+    def __init__(self, stats: PoolStats, transport: Optional[httpx.BaseTransport] = None, name: str = "upstream"):
+        self.stats = stats
+        self.name = name
+        self._transport = transport or httpx.HTTPTransport(http2=HTTP2, limits=POOL_LIMITS)
+
+    def _trace(self, event: str, info: dict):
+        if event.endswith("connect_tcp.complete"):
+            self.stats.connections += 1
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        # until the response headers; streamed bodies are timed by the LLM spans
+        with span("upstream", self.name):
+            response = self._transport.handle_request(request)
+        self.stats.http_versions[response.extensions.get("http_version", b"HTTP/1.1").decode()] += 1
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncPooledTransport(httpx.AsyncBaseTransport):
+    def __init__(self, stats: PoolStats, transport: Optional[httpx.AsyncBaseTransport] = None, name: str = "upstream"):
+        self.stats = stats
+        self.name = name
+        self._transport = transport or httpx.AsyncHTTPTransport(http2=HTTP2, limits=POOL_LIMITS)
+
+    async def _trace(self, event: str, info: dict):
+        if event.endswith("connect_tcp.complete"):
+            self.stats.connections += 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.requests += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        with span("upstream", self.name):
+            response = await self._transport.handle_async_request(request)
+        self.stats.http_versions[response.extensions.get("http_version", b"HTTP/1.1").decode()] += 1
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+# ------------------------------------------------------------------- #
+
+def _key(request: httpx.Request) -> tuple:
+    # callers holding different credentials never share a response
+    credentials = hashlib.sha1(request.headers.get("authorization", "").encode()).hexdigest()
+    return (request.method, str(request.url), credentials, hashlib.sha1(request.content).hexdigest())
+
+
+def _replay(status_code: int, headers: httpx.Headers, body: bytes, request: httpx.Request) -> httpx.Response:
+    # body is the raw (still encoded) payload, so the client decodes every copy as usual
+    return httpx.Response(status_code, headers=headers, content=body, request=request)
+
+
+class CoalescingTransport(httpx.BaseTransport):
+    """Single-flight: a request identical (method, URL, credentials, body) to one in flight waits for its response."""
+
+    def __init__(self, stats: PoolStats, transport: httpx.BaseTransport):
+        self.stats = stats
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._in_flight: dict[tuple, list] = {}
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        key = _key(request)
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = [threading.Event(), None, None]
+        if not leader:
+            self.stats.coalesced += 1
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return _replay(*call[1], request)
+        self.stats.leaders += 1
+        try:
+            response = self._transport.handle_request(request)
+            try:
+                call[1] = (response.status_code, response.headers, b"".join(response.stream))
+            finally:
+                response.close()
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call[0].set()
+        return _replay(*call[1], request)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncCoalescingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, stats: PoolStats, transport: httpx.AsyncBaseTransport):
+        self.stats = stats
+        self._transport = transport
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+
+    async def _fetch(self, request: httpx.Request) -> tuple:
+        response = await self._transport.handle_async_request(request)
+        try:
+            return response.status_code, response.headers, b"".join([chunk async for chunk in response.stream])
+        finally:
+            await response.aclose()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        key = (id(asyncio.get_running_loop()),) + _key(request)
+        call = self._in_flight.get(key)
+        if call is not None:
+            self.stats.coalesced += 1
+        else:
+            self.stats.leaders += 1
+            # a task of its own, so one caller giving up does not cancel the call for the others
+            call = self._in_flight[key] = asyncio.ensure_future(self._fetch(request))
+            call.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return _replay(*await asyncio.shield(call), request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+# ------------------------------------------------------------------- #
+
+class UpstreamClients(object):
+    """Sync and async httpx clients for one upstream: single-flight -> budget -> keep-alive pool."""
+
+    def __init__(self, name: str, budget: UpstreamBudget, coalesce: bool,
+                 transport: Optional[httpx.BaseTransport] = None, async_transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.budget = budget
+        self.stats = PoolStats()
+        sync = BudgetedTransport(budget, PooledTransport(self.stats, transport, name))
+        async_ = AsyncBudgetedTransport(budget, AsyncPooledTransport(self.stats, async_transport, name))
+        if coalesce:
+            sync, async_ = CoalescingTransport(self.stats, sync), AsyncCoalescingTransport(self.stats, async_)
+        self.http_client = httpx.Client(transport=sync)
+        self.http_async_client = httpx.AsyncClient(transport=async_)
+
+    def kwargs(self) -> dict:
+        """http_client / http_async_client kwargs for the OpenAI SDK wrappers."""
+        return {"http_client": self.http_client, "http_async_client": self.http_async_client}
+
+    def metrics(self) -> dict:
+        return {**self.budget.metrics(), "pool": self.stats.metrics()}
+
+
+_clients: dict[str, UpstreamClients] = {}
+_clients_lock = threading.Lock()
+_cohere = None
+
+
+def upstream_clients(name: str) -> UpstreamClients:
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = UpstreamClients(name, UPSTREAMS[name], COALESCE[name])
+        return _clients[name]
+
+
+def chat_model(model: str, temperature: float):
+    from langchain_openai import ChatOpenAI
+    # stream_usage: streamed responses end with their token usage, including cached prompt tokens
+    return ChatOpenAI(model=model, temperature=temperature, stream_usage=True, **upstream_clients("llm").kwargs())
+
+
+def openai_embeddings(model: str):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model, **upstream_clients("embeddings").kwargs())
+
+
+def cohere_client():
+    """One Cohere client for every CohereRerank in the process."""
+    global _cohere
+    if _cohere is None:
+        import cohere
+        http_client = upstream_clients("rerank").http_client
+        with _clients_lock:
+            if _cohere is None:
+                _cohere = cohere.ClientV2(os.getenv("COHERE_API_KEY"), client_name="langchain:partner", httpx_client=http_client)
+    return _cohere
+
+
+def upstream_metrics() -> dict:
+    return {name: upstream_clients(name).metrics() for name in UPSTREAMS}